@@ -1,350 +1,215 @@
 # -*- coding: utf-8 -*-
 """
 原価管理MVP｜商品主軸・宮田金物 初期登録版（全面貼り換え）
-- CSV不要。初期データをコード同梱。
+- CSV不要。初期データは同梱カタログ（k_catalog：catalog/*.csv を版付きでコンパイル済み）。
+- 価格履歴はローカル SQLite（k_prices.sqlite3）に保存。初回起動時に同梱データを投入、以降は追記。
 - 商品主軸で採用単価（◎）/ 最新（〇）/ 平均（▲）を計算。
 - 一覧にチェック → 下で数量入力 → 小計/税/合計を即表示（簡易見積）。
 - 履歴は任意で表示（仕入先・伝票の監査用途）。
+- 価格推移・急変アラート（任意表示）：最新伝票が直前 N 件の中央値から外れた品の一覧と、商品ごとの移動平均・中央値。
+  採用ポリシー「直近N件の中央値」は同じ計算（一時的な値上がり・値下がりの1件に引っぱられない）。
+- 仕入先比較（任意表示）：商品ごとの最安・次点の仕入先と差、商品×仕入先 の単価表。全期間の表を追記分だけ更新して持つ。
+- 同梱カタログ・価格ストア・NORM/TABLE/索引はサーバープロセスで1つを全セッションが共有（読み取り専用）。
+  セッションごとに持つのはカートと画面の入力だけ。伝票を取り込むと版が上がり、他のセッションも次の再描画で新しい単価になる。
+- カート・拾いの各節（鉄筋スラブ／ブロック／土間／立上り）は st.fragment。フォーム送信や数量の編集はその節だけ再実行し、
+  カートへ上書き反映したときだけ全体を描き直す。
+- 再描画ごとに区間別の処理時間・行数・キャッシュのヒット/ミスを計測（サイドバー最下段。JSONL に任意で追記）。
+- 見積は保存でき、単価改定のあと採用単価が変わった品を含む見積だけ一括で再計算。
 
 起動：
 $ streamlit run k_app3_full.py
+$ python k_batch.py projects.csv -o out   # 物件 CSV から一括見積（画面なし）
+$ python k_quotes.py --dry-run             # 保存見積を最新の採用単価で再計算（差額の確認）
+$ K_APP_PROFILE_LOG=k_profile.jsonl streamlit run k_app3.py   # 計測ログを既定で記録
+$ python k_profile.py --since 2025-04-01   # 区間ごとの p50 / p95
 """
-import math
+import functools
+import os
+import uuid
 from datetime import date, datetime
 import pandas as pd
 import numpy as np
+import altair as alt
 import streamlit as st
 
+import k_cutting as cutting
+import k_polygon as polygon
+import k_takeoff as takeoff
+from k_cart import QuoteCart
+from k_catalog import CATALOG_VERSION, ITEMS, ITEMS_D, PRICES_INIT, REBAR_KG_PER_M, UNITS
+from k_import import import_invoices
+from k_profile import DEFAULT_LOG as PROFILE_LOG, RerunProfiler, append_log, latency_summary, load_log
+from k_pricing import (POLICIES, RECENT_N, AsOfPriceIndex, HistoryIndex, PriceIndex, PricingCache, VendorPriceMatrix,
+                       normalize_prices, parse_price_dates, price_alerts, price_trends, rolling_prices, run_pipeline)
+from k_quotes import QuoteStore
+from k_search import CatalogSearch, PickerPages
+from k_store import PriceStore
+
+# 共有の DataFrame を画面側の加工で書き換えないよう copy-on-write にする（pandas 3 は既定で有効）
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 # -------------------------------------
 # ページ設定
 # -------------------------------------
 st.set_page_config(page_title="原価管理MVP（商品主軸・宮田金物 初期登録）", layout="wide")
 st.title("原価管理MVP｜商品主軸・宮田金物 初期登録版")
 
-# -------------------------------------
-# 初期データ（同梱）
-# -------------------------------------
-ITEMS = pd.DataFrame([
-    ["rebar_D10_NA","鉄筋","異径鋼","D10 無規格","m",None],
-    ["rebar_D10_SD295A","鉄筋","異径鋼","SD295A D10","m",None],
-    ["rebar_D13_SD295A","鉄筋","異径鋼","SD295A D13","m",None],
-    ["rebar_D16_SD345","鉄筋","異径鋼","SD345 D16","m",None],
-    ["cdmesh_6_150","鉄筋副材","CDメッシュ","6mm×150目","枚",None],
-    ["tie_wire_band5_350","副資材","結束線","バンディ#5 350mm","kg",None],
-    ["tie_wire_black5_300","副資材","結束線","ブラックバンディ#5 300mm","kg",None],
-    ["mokkons_B200","型枠","丸セパ(5/16)","モッコンB200","本",None],
-    ["anchor_btn_1_2x240","金物","アンカーBTN","1/2×240","本",None],
-    ["conc_sykoro_4x5x6","基礎副材","コンクリートサイコロ","4×5×6","個",None],
-    ["conpa_screw_35","金物","コンパネビス","35mm","本",1000],  # 1箱=1000本
-    ["nut_chrome_M12","金物","ナット（クロメート）","M12","個",None],
-    ["nut_zinc_1_2","金物","ナット（メッキ）","1/2","個",None],
-    ["washer_zinc_1_2","金物","座金（メッキ）","1/2","個",None],
-    ["washer_zinc_16mm","金物","座金（メッキ）","16mm","個",None],
-    ["boardnail_16x32","消耗品","ボード釘","#16×32","本",None],
-    ["paint_tough_red","塗装材","タフペイント","赤","本",None],
-    ["paint_tough_white","塗装材","タフペイント","白","本",None],
-    ["paint_tough_yellow","塗装材","タフペイント","黄","本",None],
-    ["course_thread_65","金物","コーススレッド（皿）","65mm","本",50],   # 1束=50本
-    ["course_thread_75","金物","コーススレッド（皿）","75mm","本",50],
-    ["plast_hollow_menboku_15","型枠","プラスチック中空面木","15mm","本",None],
-    ["plast_hollow_menboku_20","型枠","プラスチック中空面木","20mm","本",None],
-    ["plast_hollow_menboku_30","型枠","プラスチック中空面木","30mm","本",None],
-], columns=["item_id","category","name","spec","base_unit","units_per_box"]).set_index("item_id")
-
-# ==== 中村ブロック（常時） ====
-ITEMS = pd.concat([
-    ITEMS,
-    pd.DataFrame([
-        # item_id,                 category,  name,        spec,          base_unit, units_per_box
-        ["block_C12_basic",        "ブロック材","C種12cm",   "基本",        "個", None],
-        ["block_C12_corner",       "ブロック材","C種12cm",   "隅",          "個", None],
-        ["block_C12_yokokin",      "ブロック材","C種12cm",   "横筋",        "個", None],
-        ["block_C12_half",         "ブロック材","C種12cm",   "1/2",        "個", None],
-
-        ["block_C15_basic",        "ブロック材","C種15cm",   "基本",        "個", None],
-        ["block_C15_yokokin",      "ブロック材","C種15cm",   "横筋",        "個", None],
-
-        ["block_C19_basic",        "ブロック材","C種19cm",   "基本",        "個", None],
-        ["block_C19_yokokin",      "ブロック材","C種19cm",   "横筋",        "個", None],
-
-        ["block_B10_basic",        "ブロック材","B種10cm",   "基本",        "個", None],
-        ["block_B10_corner",       "ブロック材","B種10cm",   "隅",          "個", None],
-
-        ["bag_cement",             "資材",      "袋セメント", "25kg",       "袋", None],
-        ["bag_sand",               "資材",      "袋砂",       "",           "袋", None],
-        ["bag_gravel",             "資材",      "袋砂利",     "",           "袋", None],
-
-        # 参考：棒鋼10mm×4m（“本”売り） ※既存のm換算鉄筋とは別ID
-        ["rebar_bar10_4m",         "鉄筋",      "鉄筋",       "φ10 4m棒",   "本", None],
-    ], columns=["item_id","category","name","spec","base_unit","units_per_box"]).set_index("item_id")
-])
-
-# === 生コン（品番ごと）＋ 割増類 ＋ 砕石 ===
-_items_add = pd.DataFrame([
-    # 生コン（品番）
-    ["rmx_21_15_20N", "生コン",   "レディーミクストコンクリート", "21-15-20 N", "m3", None],
-    ["rmx_24_18_20N", "生コン",   "レディーミクストコンクリート", "24-18-20 N", "m3", None],
-    ["rmx_18_18_20N", "生コン",   "レディーミクストコンクリート", "18-18-20 N", "m3", None],
-    ["rmx_18_12_20BB","生コン",   "レディーミクストコンクリート", "18-12-20 BB","m3", None],
-
-    # 生コン：割増・手数料
-    ["rmx_surcharge_smalltruck", "生コン割増", "小型車割増", "", "m3", None],   # 票ではm3計上が多いので m3 に統一
-    ["rmx_surcharge_empty",      "生コン割増", "空積料",     "", "台", None],
-    ["rmx_surcharge_remote",     "生コン割増", "遠隔地割増", "", "m3", None],
-    ["rmx_factory_truck_2t3t",   "生コン割増", "2t·3t車使用料(工場)", "", "台", None],
-
-    # 砕石（クラッシャーラン等）
-    ["agg_crusher_run_recycle",  "砕石", "再生クラッシャーラン", "", "m3", None],
-    ["agg_katama_sp",            "砕石", "カタマSP",             "", "m3", None],
-    ["agg_slag_rc30",            "砕石", "スラグ砕石RC-30",      "", "m3", None],
-    ["agg_nj_slag",              "砕石", "NJスラグ",             "", "m3", None],
-], columns=["item_id","category","name","spec","base_unit","units_per_box"]).set_index("item_id")
-
-# 追記（重複IDがあれば上書き）
-ITEMS = pd.concat([ITEMS, _items_add[~_items_add.index.isin(ITEMS.index)]], axis=0)
-ITEMS_D = ITEMS.to_dict(orient="index")
-
-
-
-ITEMS_D = ITEMS.to_dict(orient="index")  # 追記後に再生成
-
-
-
-# 径→kg/m（JIS実務値）
-REBAR_KG_PER_M = {
-    "D6":0.222,"D10":0.617,"D13":0.995,"D16":1.560,"D19":2.250,
-    "D22":2.980,"D25":3.980,"D29":5.040,"D32":6.350,"D35":7.990,
-    "D38":9.860,"D41":11.90,
-}
-
-# 価格履歴（宮田金物）—※ ここは一度だけ定義（重複定義しない）
-PRICES_INIT = pd.DataFrame([
-    ["2025-03-21","宮田金物","rebar_D10_SD295A","SD295A","D10","kg",141,None,"伝票279300"],
-    ["2025-03-21","宮田金物","rebar_D13_SD295A","SD295A","D13","kg",139,None,"伝票279300"],
-    ["2025-03-21","宮田金物","rebar_D10_NA","無規格","D10","kg",139,None,"伝票272xxx"],
-    ["2025-02-28","宮田金物","rebar_D10_NA","無規格","D10","kg",138,None,"伝票272896"],
-    ["2024-11-30","宮田金物","rebar_D16_SD345","SD345","D16","kg",139,None,"伝票279458"],
-    ["2024-10-31","宮田金物","rebar_D16_SD345","SD345","D16","kg",134,None,"伝票273079"],
-
-    ["2024-11-30","宮田金物","cdmesh_6_150","","","枚",1300,None,"伝票279192"],
-
-    ["2025-02-28","宮田金物","tie_wire_band5_350","","","kg",290,None,"伝票279150"],
-    ["2024-09-30","宮田金物","tie_wire_band5_350","","","kg",260,None,"伝票272896"],
-    ["2025-03-31","宮田金物","tie_wire_black5_300","","","kg",290,None,"伝票279458"],
-
-    ["2024-12-18","宮田金物","mokkons_B200","","","本",23,None,"伝票275954"],
-    ["2025-03-21","宮田金物","mokkons_B200","","","本",25,None,"伝票279300"],
-
-    ["2024-11-18","宮田金物","anchor_btn_1_2x240","","","本",150,None,"伝票275036"],
-
-    ["2025-02-14","宮田金物","conc_sykoro_4x5x6","","","個",25,None,"伝票277903"],
-
-    ["2025-03-26","宮田金物","conpa_screw_35","","","箱",2500,1000,"伝票279290"],
-    ["2025-02-10","宮田金物","conpa_screw_35","","","箱",2200,1000,"伝票277660"],
-
-    ["2024-11-18","宮田金物","nut_chrome_M12","","","個",14,None,"伝票275036"],
-    ["2025-03-27","宮田金物","nut_zinc_1_2","","","個",13,None,"伝票279394"],
-    ["2025-03-27","宮田金物","washer_zinc_1_2","","","個",17,None,"伝票279394"],
-    ["2024-11-18","宮田金物","washer_zinc_16mm","","","個",15,None,"伝票275036"],
-
-    ["2025-02-18","宮田金物","paint_tough_white","","","本",220,None,"伝票278032"],
-    ["2025-02-18","宮田金物","paint_tough_red","","","本",220,None,"伝票278032"],
-    ["2025-02-14","宮田金物","paint_tough_yellow","","","本",220,None,"伝票277903"],
-
-    ["2025-02-18","宮田金物","course_thread_65","","","束",1000,50,"伝票278032"],
-    ["2025-02-18","宮田金物","course_thread_75","","","束",1100,50,"伝票278032"],
-
-    ["2025-02-14","宮田金物","boardnail_16x32","","","本",6,None,"伝票277903"],
-], columns=[
-    "date","vendor","item_id","standard","diameter","invoice_unit","unit_price","qty_per_invoice_unit","source"
-])
-
-# ==== 中村ブロック 初期価格（伝票ベースの代表単価） ====
-PRICES_INIT = pd.concat([
-    PRICES_INIT,
-    pd.DataFrame([
-        # date,       vendor,        item_id,               standard, diameter, invoice_unit, unit_price, qty_per_invoice_unit, source
-        ["2025-03-01","中村ブロック","block_C12_basic",     "",       "",       "個",          180,        None,                "伝票写し"],
-        ["2025-03-01","中村ブロック","block_C12_corner",    "",       "",       "個",          180,        None,                "伝票写し"],
-        ["2025-03-01","中村ブロック","block_C12_yokokin",   "",       "",       "個",          180,        None,                "伝票写し"],
-        ["2025-03-01","中村ブロック","block_C12_half",      "",       "",       "個",          180,        None,                "伝票写し"],
-
-        ["2025-03-01","中村ブロック","block_C15_basic",     "",       "",       "個",          210,        None,                "伝票写し"],
-        ["2025-03-01","中村ブロック","block_C15_yokokin",   "",       "",       "個",          210,        None,                "伝票写し"],
-
-        ["2025-03-01","中村ブロック","block_C19_basic",     "",       "",       "個",          295,        None,                "伝票写し"],
-        ["2025-03-01","中村ブロック","block_C19_yokokin",   "",       "",       "個",          295,        None,                "伝票写し"],
-
-        ["2025-03-01","中村ブロック","block_B10_basic",     "",       "",       "個",          145,        None,                "伝票写し"],
-        ["2025-03-01","中村ブロック","block_B10_corner",    "",       "",       "個",          145,        None,                "伝票写し"],
-
-        ["2025-03-01","中村ブロック","bag_cement",          "",       "",       "袋",          780,        None,                "伝票写し"],
-        ["2025-03-01","中村ブロック","bag_sand",            "",       "",       "袋",          280,        None,                "伝票写し"],
-        ["2025-03-01","中村ブロック","bag_gravel",          "",       "",       "袋",          280,        None,                "伝票写し"],
-
-        ["2025-03-01","中村ブロック","rebar_bar10_4m",      "",       "",       "本",          370,        None,                "伝票写し"],
-    ], columns=["date","vendor","item_id","standard","diameter","invoice_unit","unit_price","qty_per_invoice_unit","source"])
-])
-
-_prices_add = pd.DataFrame([
-    # 生コン 単価（円/m3）
-    ["2025-03-10","某生コンプラント","rmx_18_18_20N","", "", "m3", 22800, None, "伝票"],
-    ["2025-03-10","某生コンプラント","rmx_21_15_20N","", "", "m3", 23300, None, "伝票"],
-    ["2025-03-10","某生コンプラント","rmx_24_18_20N","", "", "m3", 23800, None, "伝票"],
-    ["2025-03-01","某生コンプラント","rmx_18_12_20BB","", "", "m3", 22200, None, "伝票"],
-
-    # 生コン 割増（票に合わせて）
-    ["2025-03-10","某生コンプラント","rmx_surcharge_smalltruck","", "", "m3", 2000, None, "小型車割増"],
-    ["2025-03-10","某生コンプラント","rmx_surcharge_empty",     "", "", "台", 2000, None, "空積料"],
-    ["2025-03-01","某生コンプラント","rmx_surcharge_remote",    "", "", "m3", 3500, None, "遠隔地割増"],
-    ["2025-03-10","某生コンプラント","rmx_factory_truck_2t3t",  "", "", "台", 5000, None, "2t·3t車使用料(工場)"],
-
-    # 砕石（通知書：令和7年10月1日実施／土場渡し 円/m3）
-    ["2025-10-01","上野石材","agg_crusher_run_recycle","", "", "m3", 1700, None, "価格改定通知"],
-    ["2025-10-01","上野石材","agg_katama_sp",          "", "", "m3", 1600, None, "価格改定通知"],
-    ["2025-10-01","上野石材","agg_slag_rc30",          "", "", "m3", 1500, None, "価格改定通知"],
-    ["2025-10-01","上野石材","agg_nj_slag",            "", "", "m3", 1000, None, "価格改定通知"],
-], columns=["date","vendor","item_id","standard","diameter","invoice_unit","unit_price","qty_per_invoice_unit","source"])
-
-PRICES_INIT = pd.concat([PRICES_INIT, _prices_add], ignore_index=True)
-
-
-
 # -------------------------------------
 # セッション初期化
 # -------------------------------------
-if "prices_raw" not in st.session_state:
-    st.session_state["prices_raw"] = PRICES_INIT.copy()
-
-# 商品辞書（以降の関数で参照）
-ITEMS_D = ITEMS.to_dict(orient="index")
-
-# ★ 自動投入の追跡用（鉄筋/メッシュを上書き管理）
-st.session_state.setdefault("auto_injected", {"rebar": {}, "mesh": {}})
-
-# ★ 見積カート（選択/数量）
-st.session_state.setdefault("pick_state", {"selected": set(), "qty": {}})
+# 価格履歴はローカルの SQLite に保存（初回だけ同梱の PRICES_INIT を投入）
+@st.cache_resource
+def get_price_store():
+    store = PriceStore()
+    store.seed(PRICES_INIT)
+    return store
+
+STORE = get_price_store()
+
+# 保存見積（価格履歴と同じ SQLite ファイル）
+@st.cache_resource
+def get_quote_store():
+    return QuoteStore()
+
+QUOTES = get_quote_store()
+
+# 価格パイプライン（ストア→期間抽出→NORM→TABLE）はストアの版・期間・ポリシーが変わった時だけ再計算
+# キャッシュはプロセスで1つ（全セッション共有）。同じ期間・ポリシーなら2人目以降は計算しない
+@st.cache_resource
+def get_pricing_cache():
+    return PricingCache(maxsize=64)
+
+PC = get_pricing_cache()
+
+# 商品×仕入先 の最新単価（全期間）。プロセスで1つ、伝票取込のあとは追記分だけ足す
+@st.cache_resource
+def get_vendor_matrix():
+    return VendorPriceMatrix()
+
+VM = get_vendor_matrix()
+
+# 商品検索の索引（商品ID・カテゴリ・商品名・規格）。プロセスで1つ、商品が増えたら追加分だけ足す
+@st.cache_resource
+def get_catalog_search():
+    return CatalogSearch()
+
+SEARCH = get_catalog_search()
+SEARCH.update(ITEMS, version=CATALOG_VERSION)
+
+# 再描画の区間計測（サイドバー最下段に内訳。ログは任意で JSONL に追記）
+PROF = RerunProfiler(cache=PC)
+PROF.lap("サイドバー")
+
+
+def section_fragment(name):
+    """カート・拾いの各節を st.fragment にする（フォーム送信・入力はその節だけ再実行）。
+
+    節だけ再実行したときは全体の計測（PROF）が済んでいるので、新しく計り直してログに残す。
+    カートへ上書き反映したときだけ st.rerun() で全体を描き直す（上の一覧の✔・カートに反映するため）。
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        def run():
+            global PROF
+            alone = PROF.total is not None
+            if alone:
+                PROF = RerunProfiler(cache=PC)
+            PROF.lap(name)
+            fn()
+            if alone:
+                rec = PROF.finish(session=st.session_state.get("session_tag"), fragment=name)
+                if st.session_state.get("profile_log"):
+                    append_log(rec, PROFILE_LOG)
+        return st.fragment(run)
+    return deco
+
+# ★ 見積カート（選択/数量。手入力と自動拾いの反映を出どころ別に保持）
+CART = st.session_state.setdefault("cart", QuoteCart())
 
 
-# -------------------------------------
-# ユーティリティ
-# -------------------------------------
-def base_unit(item_id):
-    return ITEMS_D[item_id]["base_unit"]
-
-def units_per_box(item_id):
-    return ITEMS_D[item_id]["units_per_box"]
-
-def is_rebar(item_id):
-    return ITEMS_D[item_id]["category"] == "鉄筋" and ITEMS_D[item_id]["base_unit"] == "m"
-
-# 単価をベース単位に正規化
-# - 鉄筋(m基準): 円/kg→円/m（×kg/m）
-# - 箱/束: 入数で按分して本単価に統一
-
-def normalize_price(row):
-    item_id = row["item_id"]
-    inv_unit = str(row["invoice_unit"]) if row["invoice_unit"] is not None else ""
-    price = float(row["unit_price"]) if row["unit_price"] is not None else np.nan
-    qpu = row["qty_per_invoice_unit"]
-
-    bunit = base_unit(item_id)
-
-    # 箱/束 → 本に按分
-    if inv_unit in ("箱","束"):
-        n = units_per_box(item_id) or qpu
-        if n and float(n) > 0:
-            price = price / float(n)
-            inv_unit = "本"
-
-    # 鉄筋：kg→m
-    if is_rebar(item_id):
-        dia = str(row.get("diameter") or "")
-        if inv_unit == "kg" and dia in REBAR_KG_PER_M:
-            kgpm = REBAR_KG_PER_M[dia]
-            return price * kgpm, f"kg→m換算 ×{kgpm}kg/m"
-        elif inv_unit == "m":
-            return price, "m単価"
-        else:
-            return np.nan, f"未対応({inv_unit})"
-
-    # 非鉄筋：単位一致ならそのまま
-    if inv_unit == bunit:
-        return price, f"{bunit}単価"
-    if inv_unit == "本" and bunit == "本":
-        return price, "本単価(按分済)"
-
-    return np.nan, f"未対応({inv_unit}→{bunit})"
-
-
-def adopt_price(group_df, policy):
-    df = group_df.dropna(subset=["price_per_base"])  # 正規化済
-    if df.empty:
-        return np.nan, "データなし", None
-
-    if policy == "高い方（値上がり優先）":
-        idx = df["price_per_base"].idxmax()
-        r = df.loc[idx]
-        return float(r["price_per_base"]), f"高値採用｜{r['vendor']}｜{r['date'].date()}｜{r['source']}", r
-    elif policy == "最新日付":
-        lastd = df["date"].max()
-        last = df[df["date"]==lastd]
-        idx = last["price_per_base"].idxmax()
-        r = last.loc[idx]
-        return float(r["price_per_base"]), f"最新採用｜{r['vendor']}｜{r['date'].date()}｜{r['source']}", r
-    else:  # 期間平均
-        return float(np.round(df["price_per_base"].mean(),1)), f"期間平均（{len(df)}件）", None
-
 # -------------------------------------
 # サイドバー：期間 / 採用ポリシー
 # -------------------------------------
 st.sidebar.header("フィルタ / 採用ポリシー")
-policy = st.sidebar.radio("採用ポリシー", ["高い方（値上がり優先）","最新日付","期間平均"], index=0)
+policy = st.sidebar.radio("採用ポリシー", POLICIES, index=0)
 
-raw = st.session_state["prices_raw"].copy()
-raw["date"] = pd.to_datetime(raw["date"], errors="coerce")
+prices_ver = STORE.version()
+# 版が上がったら古い版の分を先に捨てる（キーの2番目が版）
+PC.retain(lambda k: k[1] == prices_ver)
+if st.session_state.setdefault("prices_ver_seen", prices_ver) != prices_ver:
+    st.sidebar.info("価格データが更新されました（新しい単価で表示しています）")
+    st.session_state["prices_ver_seen"] = prices_ver
+min_d, max_d = STORE.date_range()
 
 c1, c2 = st.sidebar.columns(2)
-min_d = raw["date"].min() if raw["date"].notna().any() else pd.to_datetime("2025-01-01")
-max_d = raw["date"].max() if raw["date"].notna().any() else pd.to_datetime("2025-12-31")
-start = c1.date_input("開始日", value=min_d.date() if not pd.isna(min_d) else date.today())
-end   = c2.date_input("終了日", value=max_d.date() if not pd.isna(max_d) else date.today())
-
-flt = raw[(raw["date"]>=pd.to_datetime(start)) & (raw["date"]<=pd.to_datetime(end))].copy()
+min_d = min_d if min_d is not None else pd.to_datetime("2025-01-01")
+max_d = max_d if max_d is not None else pd.to_datetime("2025-12-31")
+start = c1.date_input("開始日", value=min_d.date())
+end   = c2.date_input("終了日", value=max_d.date())
+
+# 正規化（列演算で一括）＋ ◎〇▲ 集計（1回のグループ集計）
+# ストアからは選択期間の行だけ読む（キャッシュミス時のみ）
+def load_window():
+    return parse_price_dates(STORE.load(start, end))[0]
+
+PROF.lap("価格パイプライン")
+NORM, TABLE = run_pipeline(PC, load_window, ITEMS, UNITS, policy, start, end, version=prices_ver,
+                           profile=PROF)
+# 採用単価の索引（拾い各フォームで共通。TABLE と同じキーで1回だけ作る）
+PRICE_IDX = PC.get(("price_index", prices_ver, policy, start, end), PROF.timed("採用単価索引", lambda: PriceIndex(TABLE)))
+PROF.rows(len(NORM))
+
+
+def price_index_for(p, s=None, e=None):
+    """ポリシー p・期間 s～e（保存見積の期間。無ければ全期間）の採用単価索引。保存見積の再計算で使う。"""
+    s = pd.Timestamp(s).date() if s else min_d.date()
+    e = pd.Timestamp(e).date() if e else max_d.date()
+    load = lambda: parse_price_dates(STORE.load(s, e))[0]
+    table = run_pipeline(PC, load, ITEMS, UNITS, p, s, e, version=prices_ver, profile=PROF)[1]
+    return PC.get(("price_index", prices_ver, p, s, e), PROF.timed("採用単価索引", lambda: PriceIndex(table)))
+st.sidebar.caption(f"価格キャッシュ（全セッション共有）：ヒット {PC.hits} ／ ミス {PC.misses}（保持 {len(PC)}/{PC.maxsize}）")
 
-# 正規化
-norm_rows = []
-for _, r in flt.iterrows():
-    p, note = normalize_price(r)
-    norm_rows.append({**r.to_dict(), "price_per_base": np.round(p,1) if not pd.isna(p) else np.nan, "detail": note})
-NORM = pd.DataFrame(norm_rows)
+# -------------------------------------
+# サイドバー：伝票の一括取込（CSV / Excel）
+# -------------------------------------
+PROF.lap("伝票取込")
+with st.sidebar.expander("伝票取込（CSV / Excel）", expanded=False):
+    st.caption("列名は 日付/仕入先/商品ID/規格/径/伝票単位/単価/入数/伝票（英語列名も可）。"
+               "未登録商品・未対応単位の行は取り込まずエラーCSVに出します"
+               "（使える単位は catalog/units.csv の換算表で増やせます）。")
+    up = st.file_uploader("伝票ファイル", type=["csv","xlsx"], key="import_file")
+    imp_vendor = st.selectbox("仕入先（空欄の行に補完）",
+                              ["（ファイルの列を使う）","宮田金物","中村ブロック","上野石材","某生コンプラント"])
+    imp_enc = st.selectbox("文字コード（CSV）", ["utf-8-sig","cp932"], index=0)
+    if st.button("取り込む", disabled=up is None):
+        try:
+            rep = import_invoices(
+                up, up.name, STORE, ITEMS, UNITS,
+                vendor=None if imp_vendor.startswith("（") else imp_vendor,
+                encoding=imp_enc,
+            )
+            st.session_state["import_report"] = rep
+        except (ValueError, ImportError, UnicodeDecodeError) as e:
+            st.error(f"取込できませんでした：{e}")
+    rep = st.session_state.get("import_report")
+    if rep is not None:
+        st.write({
+            "読込行数": rep.rows,
+            "追記": rep.appended,
+            "重複(既存)": rep.duplicates,
+            "不採用": rep.rejected,
+        })
+        if rep.error_path and os.path.exists(rep.error_path):
+            with open(rep.error_path, "rb") as f:
+                st.download_button("↓ 不採用行（エラーレポート）CSV", data=f.read(),
+                                   file_name="import_errors.csv", mime="text/csv")
 
 # -------------------------------------
 # 商品主軸：◎〇▲ まとめテーブル
 # -------------------------------------
 st.markdown("### 商品一覧（商品→採用単価→履歴の順に表示）")
 
-records = []
-for item_id, meta in ITEMS_D.items():
-    g = NORM[NORM["item_id"]==item_id]
-    price_adopt, note_adopt, _ = adopt_price(g, policy)
-    price_latest, _, _ = adopt_price(g, "最新日付")
-    price_avg, _, _ = adopt_price(g, "期間平均")
-
-    records.append({
-        "商品ID": item_id,
-        "カテゴリ": meta["category"],
-        "商品名": meta["name"],
-        "規格/仕様": meta["spec"],
-        "基準単位": meta["base_unit"],
-        "◎ 採用単価": price_adopt,
-        "〇 最新単価": price_latest,
-        "▲ 期間平均": price_avg,
-        "採用注記": note_adopt,
-    })
-
-TABLE = pd.DataFrame(records).sort_values(["カテゴリ","商品名","規格/仕様"]).reset_index(drop=True)
-
 st.caption("※ 鉄筋は 円/kg→円/m に換算済。箱/束は按分して本単価に統一。丸めは小数1位四捨五入。")
 
 # -------------------------------------
@@ -352,113 +217,220 @@ st.caption("※ 鉄筋は 円/kg→円/m に換算済。箱/束は按分して
 # ー 選択・数量はセッション保持 ー
 # -------------------------------------
 st.markdown("### 商品選択（✔だけ）")
-
-# セッション初期化
-if "pick_state" not in st.session_state:
-    st.session_state["pick_state"] = {"selected": set(), "qty": {}}
-S = st.session_state["pick_state"]
-
-# ★ 追加：auto_injected を必ず用意（KeyError防止）
-st.session_state.setdefault("auto_injected", {"rebar": {}, "mesh": {}})
-
-
-
-# 上：全商品一覧（チェックだけ／数量列は出さない）
-table_pick = TABLE[["商品ID","カテゴリ","商品名","規格/仕様","基準単位","◎ 採用単価"]].copy()
-table_pick.rename(columns={"◎ 採用単価":"単価（基準単位）"}, inplace=True)
-table_pick.insert(0, "選択", table_pick["商品ID"].isin(S["selected"]))
+PROF.lap("商品選択")
+
+# 上：商品一覧（チェックだけ／数量列は出さない）。検索・並べ替え・ページ送りはサーバー側で、画面へは1ページ分だけ渡す
+# 選択はカートが持つ（ページを替えても残る）。pick_state は表示中の条件とページの商品ID
+PICK_SORTS = {"一覧の順": None, "カテゴリ": "カテゴリ", "商品名": "商品名", "単価": "単価（基準単位）"}
+PICK_SIZES = [50, 100, 200, 500]
+pick_state = st.session_state.setdefault("pick_state", {"view": None, "ids": []})
+
+PICKER = PC.get(("picker_pages", prices_ver, policy, start, end), PROF.timed("一覧ページ索引", lambda: PickerPages(
+    TABLE[["商品ID","カテゴリ","商品名","規格/仕様","基準単位","◎ 採用単価"]].rename(
+        columns={"◎ 採用単価":"単価（基準単位）"}))))
+
+pick_query = st.text_input("商品検索（商品ID・カテゴリ・商品名・規格。空白区切りで AND）", key="pick_query",
+                           placeholder="例：ナット 1/2、D13、砕石")
+pc1, pc2, pc3, pc4 = st.columns([2, 1, 1, 1])
+with pc1:
+    pick_sort = st.selectbox("並べ替え", list(PICK_SORTS), key="pick_sort")
+with pc2:
+    pick_desc = st.checkbox("降順", key="pick_desc")
+with pc3:
+    pick_size = st.selectbox("1ページの件数", PICK_SIZES, index=1, key="pick_size")
+
+# 条件が変わったら1ページ目から
+view = (pick_query.strip(), pick_sort, pick_desc, pick_size)
+if view != pick_state["view"]:
+    st.session_state["pick_page"] = 1
+with PROF.section("ページ") as rec:
+    hits = SEARCH.search(pick_query) if pick_query.strip() else None
+    table_pick, (pick_total, pick_pages, pick_page) = PICKER.page(
+        hits, PICK_SORTS[pick_sort], pick_desc, st.session_state.get("pick_page", 1), pick_size)
+    rec["rows"] = len(table_pick)
+st.session_state["pick_page"] = pick_page
+with pc4:
+    st.number_input(f"ページ（全 {pick_pages}）", min_value=1, max_value=pick_pages, step=1, key="pick_page")
+st.caption(f"{pick_total} 件（全 {len(TABLE)} 件）・{pick_page} / {pick_pages} ページ")
+pick_state["view"] = view
+pick_state["ids"] = table_pick["商品ID"].tolist()
+PROF.rows(len(table_pick))
+
+table_pick = table_pick.copy()
+table_pick.insert(0, "選択", [iid in CART for iid in pick_state["ids"]])
 
 edited_pick = st.data_editor(
     table_pick,
     use_container_width=True,
     hide_index=True,
     num_rows="fixed",
-    key="picker_only",
+    key=f"picker_only:{view}:{pick_page}",   # 条件・ページごとに別の表（行位置の編集を他のページへ持ち越さない）
     column_config={
         "選択": st.column_config.CheckboxColumn("選択"),
         "単価（基準単位）": st.column_config.NumberColumn("単価（基準単位）", format="%.1f"),
     }
 )
 
-# 選択状態を反映：新規に✔が付いた品は数量=1を初期セット（既存は維持）
+# 選択状態を反映：新規に✔が付いた品は数量=1を初期セット（既存は維持）、✔が外れた品はカートから外す
+# 見るのはこのページの行だけ（他のページ・検索で隠れている品の選択はそのまま）
 new_selected = set(edited_pick.loc[edited_pick["選択"] == True, "商品ID"])
-newly_added = new_selected.difference(S["selected"])
-
-qty = dict(S["qty"])
-for iid in newly_added:
-    if iid not in qty or qty[iid] <= 0:
-        qty[iid] = 1.0  # 初期値
-
-# ✔が外れた品は数量も削除してスリムに
-qty = {k: v for k, v in qty.items() if k in new_selected}
-
-S["selected"] = new_selected
-S["qty"] = qty
+for iid in new_selected.difference(CART.selected):
+    CART.add_item(iid, 1.0)
+for iid in [iid for iid in pick_state["ids"] if iid in CART and iid not in new_selected]:
+    CART.remove_item(iid)
 
 st.markdown("---")
 st.subheader("選択品の数量入力（抽出表示）")
+@section_fragment("カート")
+def cart_section():
+    """選択品の数量・小計/税/合計・時点別原価・保存（数量の編集はこの節だけ再実行）。"""
+    PROF.rows(len(CART))
 
-if len(S["selected"]) == 0:
-    st.info("上の一覧で見積したい商品に ✔ を入れてください。")
-else:
-    # 下：選択品だけを抽出して数量を編集
-    picked = TABLE[TABLE["商品ID"].isin(S["selected"])][
-        ["商品ID","商品名","規格/仕様","基準単位"]
-    ].copy()
-    picked["単価（基準単位）"] = picked["商品ID"].map(TABLE.set_index("商品ID")["◎ 採用単価"])
-    picked["数量（基準単位）"] = picked["商品ID"].map(S["qty"]).fillna(1.0)
-
-    edit_sel = st.data_editor(
-        picked,
-        use_container_width=True,
-        hide_index=True,
-        num_rows="fixed",
-        key="selected_only",
-        column_config={
-            "単価（基準単位）": st.column_config.NumberColumn("単価（基準単位）", format="%.1f"),
-            "数量（基準単位）": st.column_config.NumberColumn("数量（基準単位）", step=1.0),
-        }
-    )
-
-    # 数量の編集をセッションに反映（保持）
-    S["qty"] = {
-        row["商品ID"]: float(row["数量（基準単位）"])
-        for _, row in edit_sel.iterrows() if row["数量（基準単位）"] > 0
-    }
-
-    # 計算
-    calc = edit_sel.copy()
-    calc["小計（税抜）"] = calc["数量（基準単位）"] * calc["単価（基準単位）"]
-
-    c1, c2, _ = st.columns(3)
-    tax_rate = c1.number_input("消費税率(%)", 0.0, 100.0, 10.0, 0.1)
-    rounding = c2.selectbox("端数処理", ["四捨五入","切り上げ","切り捨て"], index=0)
-
-    st.dataframe(calc, use_container_width=True, height=320)
-
-    subtotal = float(calc["小計（税抜）"].sum())
-    tax_raw = subtotal * tax_rate / 100.0
-
-    def _round(x: float) -> float:
-        if rounding == "四捨五入": return float(np.round(x, 0))
-        if rounding == "切り上げ":  return float(np.ceil(x))
-        return float(np.floor(x))
-
-    tax = _round(tax_raw)
-    grand = _round(subtotal + tax)
+    if len(CART) == 0:
+        st.info("上の一覧で見積したい商品に ✔ を入れてください。")
+    else:
+        # 下：選択品だけを抽出して数量を編集
+        picked = TABLE[TABLE["商品ID"].isin(CART.selected)][
+            ["商品ID","商品名","規格/仕様","基準単位"]
+        ].copy()
+        picked["単価（基準単位）"] = picked["商品ID"].map(TABLE.set_index("商品ID")["◎ 採用単価"])
+        picked["数量（基準単位）"] = picked["商品ID"].map(CART.totals).fillna(1.0)
+
+        edit_sel = st.data_editor(
+            picked,
+            use_container_width=True,
+            hide_index=True,
+            num_rows="fixed",
+            key="selected_only",
+            column_config={
+                "単価（基準単位）": st.column_config.NumberColumn("単価（基準単位）", format="%.1f"),
+                "数量（基準単位）": st.column_config.NumberColumn("数量（基準単位）", step=1.0),
+            }
+        )
+
+        # 数量の編集をセッションに反映（変わった行だけ。自動反映分との差は手入力分として持つ）
+        ids = edit_sel["商品ID"].to_numpy()
+        new_q = edit_sel["数量（基準単位）"].to_numpy(dtype=float)
+        cur_q = picked["数量（基準単位）"].to_numpy(dtype=float)
+        for k in np.flatnonzero((new_q != cur_q) & np.isfinite(new_q)):   # 空欄にしたセルは元の数量のまま
+            CART.set_qty(ids[k], new_q[k])
+
+        # 計算
+        calc = edit_sel.copy()
+        calc["小計（税抜）"] = calc["数量（基準単位）"] * calc["単価（基準単位）"]
+
+        c1, c2, _ = st.columns(3)
+        tax_rate = c1.number_input("消費税率(%)", 0.0, 100.0, 10.0, 0.1)
+        rounding = c2.selectbox("端数処理", ["四捨五入","切り上げ","切り捨て"], index=0)
+
+        st.dataframe(calc, use_container_width=True, height=320)
+
+        subtotal = float(calc["小計（税抜）"].sum())
+        tax_raw = subtotal * tax_rate / 100.0
+
+        def _round(x: float) -> float:
+            if rounding == "四捨五入": return float(np.round(x, 0))
+            if rounding == "切り上げ":  return float(np.ceil(x))
+            return float(np.floor(x))
+
+        tax = _round(tax_raw)
+        grand = _round(subtotal + tax)
+
+        m1, m2, m3 = st.columns(3)
+        m1.metric("小計（税抜）", f"{subtotal:,.0f} 円")
+        m2.metric(f"消費税（{tax_rate:.1f}%）", f"{tax:,.0f} 円")
+        m3.metric("合計（税込）", f"{grand:,.0f} 円")
+
+        # CSV
+        export_cols = ["商品ID","商品名","規格/仕様","基準単位","単価（基準単位）","数量（基準単位）","小計（税抜）"]
+        csv_quote = calc[export_cols].to_csv(index=False).encode("utf-8-sig")
+        st.download_button("↓ この見積明細をCSVでダウンロード",
+                           data=csv_quote,
+                           file_name=f"easy_quote_{datetime.now():%Y%m%d}.csv",
+                           mime="text/csv")
+
+        # 時点指定：履歴全体の索引（ストアの版ごとに1回）で、任意の日・日付列の原価を一括で出す
+        with st.expander("時点別の原価（この見積をある日の単価で）", expanded=False):
+            ASOF = PC.get(("asof", prices_ver), PROF.timed("時点索引", lambda: AsOfPriceIndex(
+                normalize_prices(parse_price_dates(STORE.load())[0], ITEMS, UNITS))))
+            first_d, last_d = ASOF.date_range
+            if pd.isna(first_d):
+                st.info("価格履歴がありません。")
+            else:
+                cart_q = dict(zip(calc["商品ID"], calc["数量（基準単位）"].astype(float)))
+                a1, a2, a3 = st.columns(3)
+                asof_d = a1.date_input("見積日", value=last_d.date(), key="asof_date")
+                asof_win = a2.number_input("直近何日の伝票で採用（0=その日以前の全件）", min_value=0, step=30, value=0,
+                                           key="asof_window")
+                asof_freq = a3.selectbox("推移の刻み", ["週末","月末","日"], index=0, key="asof_freq")
+                win = int(asof_win) or None
+                lines_at, missing_at = ASOF.lookup(cart_q, asof_d, policy, win)
+                st.metric(f"{asof_d} 時点の小計（税抜・{policy}）", f"{lines_at['金額'].sum():,.0f} 円",
+                          delta=f"{lines_at['金額'].sum() - subtotal:,.0f} 円（現在の採用単価比）")
+                if missing_at:
+                    st.warning("この日時点で単価が無い品（小計に含めない）：" + "、".join(missing_at))
+                st.dataframe(lines_at, use_container_width=True, hide_index=True)
+                freq = {"週末": "W", "月末": "ME", "日": "D"}[asof_freq]
+                days = pd.date_range(first_d.normalize(), last_d.normalize() + pd.offsets.Day(1), freq=freq)
+                traj = ASOF.cost_series(cart_q, days, policy, win)
+                st.line_chart(traj["小計"])
+                st.caption(f"{len(days)} 時点 × {len(cart_q)} 品を1回で計算（単価なしの品は小計に含めない）")
+
+        # 見積の保存（明細・採用単価・注記・ポリシー・期間・出どころ内訳）
+        s1, s2 = st.columns([3, 1])
+        quote_name = s1.text_input("見積名", value=f"見積 {datetime.now():%Y-%m-%d %H:%M}", key="quote_name")
+        if s2.button("この見積を保存", key="quote_save"):
+            saved_lines, _ = PRICE_IDX.lookup(dict(zip(calc["商品ID"], calc["数量（基準単位）"].astype(float))))
+            qid = QUOTES.save(quote_name, saved_lines, policy, start, end,
+                              sources={iid: CART.contributions(iid) for iid in saved_lines["商品ID"]})
+            st.success(f"保存しました（見積ID {qid}）。")
+
+cart_section()
 
-    m1, m2, m3 = st.columns(3)
-    m1.metric("小計（税抜）", f"{subtotal:,.0f} 円")
-    m2.metric(f"消費税（{tax_rate:.1f}%）", f"{tax:,.0f} 円")
-    m3.metric("合計（税込）", f"{grand:,.0f} 円")
 
-    # CSV
-    export_cols = ["商品ID","商品名","規格/仕様","基準単位","単価（基準単位）","数量（基準単位）","小計（税抜）"]
-    csv_quote = calc[export_cols].to_csv(index=False).encode("utf-8-sig")
-    st.download_button("↓ この見積明細をCSVでダウンロード",
-                       data=csv_quote,
-                       file_name=f"easy_quote_{datetime.now():%Y%m%d}.csv",
-                       mime="text/csv")
+# -------------------------------------
+# 保存見積：一覧・カートへ読込・単価改定の一括再計算
+# -------------------------------------
+PROF.lap("保存見積")
+with st.expander(f"保存見積（{QUOTES.count()} 件）", expanded=False):
+    saved = QUOTES.list()
+    if saved.empty:
+        st.info("保存した見積はまだありません。上のカートから「この見積を保存」で保存できます。")
+    else:
+        st.dataframe(saved.rename(columns={
+            "id": "見積ID", "name": "見積名", "created": "作成", "updated": "更新", "policy": "採用ポリシー",
+            "start": "期間(開始)", "end": "期間(終了)", "status": "状態", "subtotal": "小計", "missing": "単価なし"}),
+            use_container_width=True, hide_index=True, height=240)
+        q1, q2, q3 = st.columns(3)
+        pick_id = q1.selectbox("見積", saved["id"].tolist(),
+                               format_func=lambda i: f"{i}：{saved.set_index('id').at[i, 'name']}", key="quote_pick")
+        if q2.button("カートに読み込む（今のカートは置き換え）", key="quote_load"):
+            _, srcs = QUOTES.lines(pick_id)
+            books = {}
+            for iid, contrib in srcs.items():
+                for src, q in contrib.items():
+                    books.setdefault(src, {})[iid] = q
+            CART = st.session_state["cart"] = QuoteCart()
+            for src, items in books.items():
+                CART.replace(src, items)
+            st.rerun()
+        if q3.button("完了にする（再計算の対象外）", key="quote_close"):
+            QUOTES.set_status(pick_id, "closed")
+            st.rerun()
+
+        st.markdown("**単価改定の反映**（採用単価が変わった品を含む未完了の見積だけ再計算。期間・ポリシーは各見積の保存時のもの）")
+        r1, r2 = st.columns(2)
+        dry = r1.checkbox("差額の確認だけ（保存しない）", value=True, key="reprice_dry")
+        if r2.button("保存見積を再計算", key="reprice_run"):
+            report, line_deltas = QUOTES.reprice(
+                lambda p, s, e: price_index_for(p, s, e) if p in POLICIES else None, dry_run=dry)
+            if report.empty:
+                st.info("採用単価が変わった見積はありません。")
+            else:
+                st.warning(f"{len(report)} 件の見積で単価が変わりました（差額合計 {report['差額'].sum():,.0f} 円）"
+                           + ("。確認のみで保存していません。" if dry else "。再計算して保存しました。"))
+                st.dataframe(report, use_container_width=True, hide_index=True)
+                st.dataframe(line_deltas, use_container_width=True, hide_index=True, height=240)
 
 # -------------------------------------
 # 鉄筋スラブ 自動拾い（鉄筋方式 vs メッシュ方式 比較・非累積反映）
@@ -467,174 +439,326 @@ else:
 st.markdown("---")
 st.subheader("鉄筋スラブ自動拾い（鉄筋方式 vs メッシュ方式 比較）")
 
-with st.form("rebar_mesh_form"):
-    # 寸法入力（外寸）
-    c1, c2 = st.columns(2)
-    L = c1.number_input("長さ L (m)", min_value=0.0, step=0.1, value=10.0)
-    W = c2.number_input("幅 W (m)",   min_value=0.0, step=0.1, value=6.0)
-    P = 2*(L+W); A = L*W
-    st.caption(f"→ 周長 = {P:.2f} m ／ 面積 = {A:.2f} ㎡")
-
-    # かぶり・ロス
-    c_cov1, c_cov2 = st.columns(2)
-    cover_edge_mm = c_cov1.number_input("かぶり（周囲）mm", min_value=0.0, step=5.0, value=40.0)
-    waste = c_cov2.number_input("ロス率(%)", min_value=0.0, max_value=30.0, step=0.5, value=5.0)
-
-    # ピッチ & 配筋
-    c3, c4, c5 = st.columns(3)
-    pitch_x_mm = c3.number_input("X方向ピッチ(mm)", min_value=50.0, step=10.0, value=200.0)
-    pitch_y_mm = c4.number_input("Y方向ピッチ(mm)", min_value=50.0, step=10.0, value=200.0)
-    layer = c5.selectbox("配筋", ["単層(シングル)","複層(ダブル)"], index=0)
-    layers = 2 if layer.startswith("複層") else 1
-
-    # 鉄筋設定
-    c6, c7, c8 = st.columns(3)
-    stock_len = c6.number_input("定尺長 (m)", min_value=3.0, max_value=12.0, step=0.5, value=4.0)
-    rebar_choice = c7.selectbox("鉄筋種類", [
-        ("rebar_D10_NA",    "無規格 D10"),
-        ("rebar_D10_SD295A","SD295A D10"),
-        ("rebar_D13_SD295A","SD295A D13"),
-        ("rebar_D16_SD345", "SD345 D16"),
-    ], format_func=lambda x: x[1])
-    dia_hint = "D10" if "D10" in rebar_choice[0] else ("D13" if "D13" in rebar_choice[0] else "D16")
-
-    # 結束線・サイコロ（共通係数）
-    c9, c10 = st.columns(2)
-    tie_kg_per_sqm = c9.number_input("結束線係数 (kg/㎡/層)", min_value=0.0, step=0.1, value=0.4)
-    sykoro_per_sqm_layer = c10.number_input("サイコロ係数 (個/㎡/層)", min_value=0.0, step=0.1, value=4.0)
-
-    # メッシュ仕様
-    st.markdown("**メッシュ仕様（0.9×1.8m）**")
-    c11, c12 = st.columns(2)
-    mesh_lap_x = c11.number_input("メッシュ重なり(横) m", min_value=0.0, step=0.05, value=0.15)
-    mesh_lap_y = c12.number_input("メッシュ重なり(縦) m", min_value=0.0, step=0.05, value=0.15)
-
-    # 見積反映モード（排他的）
-    mode = st.radio("どちらの方式を見積に反映するか？",
-                    ["反映しない","鉄筋方式","メッシュ方式"], index=0)
-
-    submitted = st.form_submit_button("数量を計算して比較")
-
-# ------- ここから計算と表示（フォームの外）-------
-if submitted:
-    # 安全な単価取得（未登録なら0円で進め、画面に注意表示）
-    def price_of(item_id: str) -> float:
-        try:
-            v = TABLE.loc[TABLE["商品ID"]==item_id, "◎ 採用単価"].values
-            return float(v[0]) if len(v) else 0.0
-        except Exception:
-            return 0.0
-
-    cov = cover_edge_mm / 1000.0
-    L_eff, W_eff = max(0.0, L - 2*cov), max(0.0, W - 2*cov)
-    A_eff = L_eff * W_eff
-
-    if L_eff <= 0 or W_eff <= 0:
-        st.error("かぶりが大きすぎます。L-2×かぶり, W-2×かぶり が正になるようにしてください。")
-    else:
-        # 鉄筋方式
-        px, py = pitch_x_mm/1000.0, pitch_y_mm/1000.0
-        n_x = int(math.floor(W_eff / px)) + 1
-        n_y = int(math.floor(L_eff / py)) + 1
-        total_m = (n_x * L_eff + n_y * W_eff) * layers
-        total_m *= (1.0 + waste/100.0)
-
+STOCK_LENGTHS = [3.5, 4.0, 4.5, 5.0, 5.5, 6.0, 6.5, 7.0, 7.5, 8.0, 9.0, 10.0, 11.0, 12.0]
+RM_REBAR_CHOICES = [
+    ("rebar_D10_NA",    "無規格 D10"),
+    ("rebar_D10_SD295A","SD295A D10"),
+    ("rebar_D13_SD295A","SD295A D13"),
+    ("rebar_D16_SD345", "SD345 D16"),
+]
+
+@section_fragment("鉄筋スラブ")
+def rebar_mesh_section():
+    """鉄筋スラブ（比較・カート反映）と、同じ入力を使う複数棟の切断計画・パラメータスイープ。"""
+    with st.form("rebar_mesh_form"):
+        # 寸法入力（外寸）
+        shape = st.radio("形状", ["長方形","多角形（頂点入力）"], index=0, horizontal=True)
+        c1, c2 = st.columns(2)
+        L = c1.number_input("長さ L (m)", min_value=0.0, step=0.1, value=10.0)
+        W = c2.number_input("幅 W (m)",   min_value=0.0, step=0.1, value=6.0)
+        P = 2*(L+W); A = L*W
+        st.caption(f"→ 周長 = {P:.2f} m ／ 面積 = {A:.2f} ㎡（長方形のとき）")
+        c_pg1, c_pg2 = st.columns(2)
+        poly_text = c_pg1.text_area("外周の頂点（x, y を1行ずつ・m）", value="0, 0\n12, 0\n12, 5\n7, 5\n7, 10\n0, 10", height=150)
+        holes_text = c_pg2.text_area("開口（空行で区切って複数）", value="", height=150,
+                                     help="例：吹抜・設備開口。頂点は外周と同じ書き方。かぶりは開口の周囲にも取る。")
+
+        # かぶり・ロス
+        c_cov1, c_cov2 = st.columns(2)
+        cover_edge_mm = c_cov1.number_input("かぶり（周囲）mm", min_value=0.0, step=5.0, value=40.0)
+        waste = c_cov2.number_input("ロス率(%)", min_value=0.0, max_value=30.0, step=0.5, value=5.0,
+                                    help="総延長・重量・スイープの概算用。鉄筋方式の値入れ・カートは切断計画の定尺総延長（端材込み）。")
+
+        # ピッチ & 配筋
+        c3, c4, c5 = st.columns(3)
+        pitch_x_mm = c3.number_input("X方向ピッチ(mm)", min_value=50.0, step=10.0, value=200.0)
+        pitch_y_mm = c4.number_input("Y方向ピッチ(mm)", min_value=50.0, step=10.0, value=200.0)
+        layer = c5.selectbox("配筋", ["単層(シングル)","複層(ダブル)"], index=0)
+        layers = 2 if layer.startswith("複層") else 1
+
+        # 鉄筋設定
+        c6, c7, c8 = st.columns(3)
+        stocks = c6.multiselect("定尺長 (m)（複数可）", STOCK_LENGTHS, default=list(cutting.DEFAULT_STOCKS))
+        rebar_choice = c7.selectbox("鉄筋種類", RM_REBAR_CHOICES, format_func=lambda x: x[1])
+        dia_hint = takeoff.rebar_dia(rebar_choice[0])
+        splice_lap = c8.number_input("重ね継手長 (m)（最長の定尺を超える鉄筋）", min_value=0.0, step=0.05, value=0.40)
+        stocks = sorted(stocks) or [4.0]
+        stock_len = stocks[-1]
+
+        # 定尺取り（切断計画）
+        c_cut1, c_cut2 = st.columns(2)
+        cut_mode = c_cut1.radio("切断計画", ["速い（FFD）","最適化（時間指定）"], index=0, horizontal=True)
+        cut_budget = c_cut2.number_input("最適化の時間 (秒)", min_value=0.5, max_value=30.0, step=0.5, value=2.0)
+
+        # 結束線・サイコロ（共通係数）
+        c9, c10 = st.columns(2)
+        tie_kg_per_sqm = c9.number_input("結束線係数 (kg/㎡/層)", min_value=0.0, step=0.1, value=0.4)
+        sykoro_per_sqm_layer = c10.number_input("サイコロ係数 (個/㎡/層)", min_value=0.0, step=0.1, value=4.0)
+
+        # メッシュ仕様
+        st.markdown("**メッシュ仕様（0.9×1.8m）**")
+        c11, c12 = st.columns(2)
+        mesh_lap_x = c11.number_input("メッシュ重なり(横) m", min_value=0.0, step=0.05, value=0.15)
+        mesh_lap_y = c12.number_input("メッシュ重なり(縦) m", min_value=0.0, step=0.05, value=0.15)
+
+        # 見積反映モード（排他的）
+        mode = st.radio("どちらの方式を見積に反映するか？",
+                        ["反映しない","鉄筋方式","メッシュ方式"], index=0)
+
+        submitted = st.form_submit_button("数量を計算して比較")
+
+    # ------- ここから計算と表示（フォームの外）-------
+    if submitted:
+        # 数量は拾いエンジン（k_takeoff）で計算
         kgpm = REBAR_KG_PER_M.get(dia_hint, 0.0)
-        total_kg = total_m * kgpm
-        bars_stock = math.ceil(total_m / stock_len)
-        tie_kg = A_eff * tie_kg_per_sqm * layers
-        sykoro_pcs = math.ceil(A_eff * sykoro_per_sqm_layer * layers)
-
-        rebar_cost = total_m * price_of(rebar_choice[0])
-        tie_cost   = tie_kg * price_of("tie_wire_band5_350")
-        sykoro_cost= sykoro_pcs * price_of("conc_sykoro_4x5x6")
-        total_cost_rebar = rebar_cost + tie_cost + sykoro_cost
-
-        # メッシュ方式
-        mesh_w, mesh_h = 1.8, 0.9
-        def needed_sheets(target, sheet, lap):
-            if target <= 0: return 0
-            if target <= sheet: return 1
-            step = max(sheet - lap, 0.01)
-            return 1 + int(math.ceil((target - sheet)/step))
-        nxA = needed_sheets(L_eff, mesh_w, mesh_lap_x)
-        nyA = needed_sheets(W_eff, mesh_h, mesh_lap_y)
-        nxB = needed_sheets(L_eff, mesh_h, mesh_lap_x)
-        nyB = needed_sheets(W_eff, mesh_w, mesh_lap_y)
-        mesh_sheets = min(nxA*nyA, nxB*nyB) * layers
-
-        mesh_cost  = mesh_sheets * price_of("cdmesh_6_150")
-        tie_cost_m = tie_kg * price_of("tie_wire_band5_350")
-        sykoro_cost_m = sykoro_pcs * price_of("conc_sykoro_4x5x6")
-        total_cost_mesh = mesh_cost + tie_cost_m + sykoro_cost_m
-
-        # 表示
-        st.success("比較結果（税抜・原価）")
-        colA, colB = st.columns(2)
-        with colA:
-            st.markdown("#### ■ 鉄筋方式")
-            st.write({
-                "総延長(m)": round(total_m,1),
-                "重量(kg)": round(total_kg,1),
-                "定尺本数(概算)": bars_stock,
-                "結束線(kg)": round(tie_kg,2),
-                "サイコロ(個)": int(sykoro_pcs),
-                "小計(円)": round(total_cost_rebar),
-            })
-        with colB:
-            st.markdown("#### ■ メッシュ方式")
-            st.write({
-                "枚数": int(mesh_sheets),
-                "結束線(kg)": round(tie_kg,2),
-                "サイコロ(個)": int(sykoro_pcs),
-                "小計(円)": round(total_cost_mesh),
-            })
-
-        # 見積カートへ排他的に上書き
-        st.session_state.setdefault("pick_state", {"selected": set(), "qty": {}})
-        st.session_state.setdefault("auto_injected", {"rebar": {}, "mesh": {}})
-        S  = st.session_state["pick_state"]
-        AI = st.session_state["auto_injected"]
-
-        def apply_mode(mode: str, new_items: dict):
-            prev = AI.get(mode, {}) or {}
-            # 差し戻し＋上書き
-            for iid, new_q in new_items.items():
-                cur = float(S["qty"].get(iid, 0.0)); prev_q = float(prev.get(iid, 0.0))
-                nxt = cur - prev_q + float(new_q)
-                if nxt <= 0:
-                    S["qty"].pop(iid, None); S["selected"].discard(iid)
+        is_poly = shape.startswith("多角形")
+        try:
+            if is_poly:
+                outer, _ = polygon.parse_polygons(poly_text)
+                holes = []
+                if holes_text.strip():
+                    first, rest = polygon.parse_polygons(holes_text)
+                    holes = [first, *rest]
+                rm = polygon.polygon_rebar_mesh(outer, holes, cover_edge_mm, pitch_x_mm, pitch_y_mm, layers, waste, kgpm,
+                                                tie_kg_per_sqm, sykoro_per_sqm_layer, mesh_lap_x, mesh_lap_y)
+            else:
+                rm = takeoff.rebar_mesh(L, W, cover_edge_mm, pitch_x_mm, pitch_y_mm, layers, waste, kgpm,
+                                        tie_kg_per_sqm, sykoro_per_sqm_layer, mesh_lap_x, mesh_lap_y)
+        except ValueError as e:
+            st.error(f"頂点の入力を読めません：{e}")
+            rm = {"valid": False}
+
+        if not rm["valid"]:
+            st.error("かぶりが大きすぎます。有効寸法（かぶりを除いた形状）が残るようにしてください。")
+        else:
+            # 鉄筋方式
+            total_m = float(rm["total_m"])
+            total_kg = float(rm["total_kg"])
+            # 定尺本数・発注量は切断計画から（方向・層ごとの実長 → 定尺への割付け）。値入れ・カートは定尺総延長（端材込み）
+            try:
+                if is_poly:
+                    demand = cutting.bar_pieces(np.concatenate([rm["bars_x"], rm["bars_y"]]), layers, stock_len, splice_lap)
                 else:
-                    S["qty"][iid] = nxt; S["selected"].add(iid)
-            # 今回なくなった品をクリア
-            for iid in set(prev.keys()) - set(new_items.keys()):
-                cur = float(S["qty"].get(iid, 0.0)); prev_q = float(prev.get(iid, 0.0))
-                nxt = cur - prev_q
-                if nxt <= 0:
-                    S["qty"].pop(iid, None); S["selected"].discard(iid)
+                    demand = cutting.slab_pieces(rm["L_eff"], rm["W_eff"], rm["n_x"], rm["n_y"], layers, stock_len, splice_lap)
+                plan = cutting.plan_cuts(demand, stocks, mode="fast" if cut_mode.startswith("速い") else "optimize",
+                                         time_budget=cut_budget)
+            except ValueError as e:
+                st.error(f"切断計画を作れません：{e}")
+                plan = None
+            tie_kg = float(rm["tie_kg"])
+            sykoro_pcs = int(rm["sykoro_pcs"])
+
+            order_m = plan.stock_m if plan else total_m  # 切断計画が作れないときは表示だけ（カートには入れない）
+            rebar_bom = {
+                rebar_choice[0]: order_m,
+                "tie_wire_band5_350": tie_kg,
+                "conc_sykoro_4x5x6": sykoro_pcs,
+            }
+            rebar_lines, rebar_missing = PRICE_IDX.lookup(rebar_bom)
+            total_cost_rebar = float(rebar_lines["金額"].sum())
+
+            # メッシュ方式
+            mesh_sheets = int(rm["mesh_sheets"])
+
+            mesh_bom = {
+                "cdmesh_6_150": mesh_sheets,
+                "tie_wire_band5_350": tie_kg,
+                "conc_sykoro_4x5x6": sykoro_pcs,
+            }
+            mesh_lines, mesh_missing = PRICE_IDX.lookup(mesh_bom)
+            total_cost_mesh = float(mesh_lines["金額"].sum())
+
+            # 表示
+            st.success("比較結果（税抜・原価）")
+            missing = sorted(set(rebar_missing) | set(mesh_missing))
+            if missing:
+                st.warning("採用単価が無いため小計に含めていない品：" + "、".join(missing))
+            colA, colB = st.columns(2)
+            with colA:
+                st.markdown("#### ■ 鉄筋方式")
+                st.write({
+                    "総延長(m)": round(total_m,1),
+                    "重量(kg)": round(total_kg,1),
+                    "定尺本数(切断計画)": plan.bars if plan else None,
+                    "定尺総延長(m)（値入れ）": round(plan.stock_m, 2) if plan else None,
+                    "結束線(kg)": round(tie_kg,2),
+                    "サイコロ(個)": int(sykoro_pcs),
+                    "小計(円)": round(total_cost_rebar),
+                })
+            with colB:
+                st.markdown("#### ■ メッシュ方式")
+                st.write({
+                    "枚数": int(mesh_sheets),
+                    "結束線(kg)": round(tie_kg,2),
+                    "サイコロ(個)": int(sykoro_pcs),
+                    "小計(円)": round(total_cost_mesh),
+                })
+
+            if is_poly:
+                lay = rm["layout"]
+                with st.expander(f"メッシュ割付け｜{lay.sheets} 枚/層（全面 {lay.full}・切り物用 {lay.cut_sheets}）・端材 {lay.waste_pct:.1f}%", expanded=False):
+                    st.write({"有効面積(㎡)": round(rm["A_eff"], 2), "向き": lay.orientation,
+                              "切り物(個)": len(lay.pieces), "購入面積(㎡/層)": round(lay.bought_area, 2),
+                              "端材(㎡/層)": round(lay.offcut_area, 2)})
+                    cells = pd.DataFrame(
+                        [{"x": x, "y": y, "x2": x + w, "y2": y + h, "種別": "全面"} for x, y, w, h in lay.full_cells]
+                        + [{"x": x, "y": y, "x2": x + w, "y2": y + h, "種別": "切り物"} for x, y, w, h in lay.pieces])
+                    edge = pd.DataFrame([{"x": x, "y": y, "輪": k, "順": n}
+                                         for k, ring in enumerate([rm["outer"], *rm["holes"]])
+                                         for n, (x, y) in enumerate([*ring, ring[0]])])
+                    chart = (alt.Chart(cells).mark_rect(opacity=0.35, stroke="black", strokeWidth=0.5)
+                             .encode(x="x:Q", y="y:Q", x2="x2", y2="y2", color="種別:N")
+                             + alt.Chart(edge).mark_line(color="red").encode(x="x:Q", y="y:Q", detail="輪:N", order="順:Q"))
+                    st.altair_chart(chart.properties(height=360), use_container_width=True)
+
+            if plan:
+                with st.expander(f"切断計画（{plan.method}）｜定尺 {plan.bars} 本・端材 {plan.waste_pct:.1f}%", expanded=False):
+                    st.write({f"{k:g}m": v for k, v in plan.stock_counts.items()} | {
+                        "定尺総延長(m)": round(plan.stock_m, 2), "切断片合計(m)": round(plan.used_m, 2),
+                        "端材(m)": round(plan.waste_m, 2), "計算時間(s)": round(plan.elapsed, 3)})
+                    st.dataframe(pd.DataFrame(plan.rows()), use_container_width=True, hide_index=True)
+
+            # 見積カートへ排他的に上書き（もう一方の方式は差し戻す）
+            rebar_items = takeoff.lines_dict(takeoff.rebar_lines(rm, rebar_choice[0], order_m))
+            mesh_items = takeoff.lines_dict(takeoff.mesh_lines(rm))
+
+            if mode == "鉄筋方式" and plan is None:
+                st.error("切断計画が無いため、鉄筋方式はカートに反映していません。")
+            elif mode == "鉄筋方式":
+                CART.clear("mesh")
+                CART.replace("rebar", rebar_items)
+                st.success("鉄筋方式をカートに上書きしました。"); st.rerun()
+            elif mode == "メッシュ方式":
+                CART.clear("rebar")
+                CART.replace("mesh", mesh_items)
+                st.success("メッシュ方式をカートに上書きしました。"); st.rerun()
+
+    # ------- 複数棟まとめて定尺取り（かぶり・ピッチ・層・定尺・継手は上のフォームの値）-------
+    PROF.lap("切断計画")
+    with st.expander("複数棟まとめて定尺取り（切断計画）", expanded=False):
+        bldg = st.data_editor(
+            pd.DataFrame({"棟": ["A棟"], "L(m)": [float(L)], "W(m)": [float(W)], "棟数": [1]}),
+            num_rows="dynamic", use_container_width=True, hide_index=True, key="cut_buildings",
+        )
+        if st.button("まとめて切断計画", key="cut_plan_all"):
+            b = bldg.dropna(subset=["L(m)","W(m)"])
+            rb = takeoff.rebar_mesh(b["L(m)"].to_numpy(), b["W(m)"].to_numpy(), cover_edge_mm, pitch_x_mm, pitch_y_mm,
+                                    layers, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+            n_bldg = b["棟数"].fillna(1).astype(int).to_numpy()
+            try:
+                demand = cutting.merge_demands(
+                    cutting.slab_pieces(rb["L_eff"][i], rb["W_eff"][i], rb["n_x"][i], rb["n_y"][i],
+                                        layers * n_bldg[i], stock_len, splice_lap)
+                    for i in range(len(b))
+                )
+                plan = cutting.plan_cuts(demand, stocks, mode="fast" if cut_mode.startswith("速い") else "optimize",
+                                         time_budget=cut_budget)
+            except ValueError as e:
+                st.error(f"切断計画を作れません：{e}")
+            else:
+                st.success(f"{int(n_bldg.sum())} 棟・切断片 {sum(demand.values()):,} 本 → 定尺 {plan.bars:,} 本"
+                           f"（{plan.method}｜端材 {plan.waste_pct:.1f}%｜{plan.elapsed:.2f}s）")
+                st.write({f"{k:g}m": v for k, v in plan.stock_counts.items()} | {
+                    "定尺総延長(m)": round(plan.stock_m, 2), "切断片合計(m)": round(plan.used_m, 2),
+                    "下限(m)": round(cutting.lower_bound_m(demand), 2)})
+                st.dataframe(pd.DataFrame(plan.rows()), use_container_width=True, hide_index=True)
+
+    # ------- パラメータスイープ（ピッチ×層×鉄筋種類×メッシュ重なり）-------
+    # 寸法・かぶり・ロス・定尺・結束線/サイコロ係数は上のフォームの値を使う
+    PROF.lap("パラメータスイープ")
+    with st.expander("パラメータスイープ（ピッチ×層×鉄筋種類×メッシュ重なり）", expanded=False):
+        with st.form("rebar_mesh_sweep_form"):
+            s1, s2, s3 = st.columns(3)
+            sw_pmin = s1.number_input("ピッチ 最小(mm)", min_value=50.0, step=10.0, value=100.0)
+            sw_pmax = s2.number_input("ピッチ 最大(mm)", min_value=50.0, step=10.0, value=300.0)
+            sw_pstep = s3.number_input("ピッチ 刻み(mm)", min_value=1.0, step=5.0, value=5.0)
+            s4, s5, s6 = st.columns(3)
+            sw_lmin = s4.number_input("メッシュ重なり 最小(m)", min_value=0.0, step=0.05, value=0.10)
+            sw_lmax = s5.number_input("メッシュ重なり 最大(m)", min_value=0.0, step=0.05, value=0.30)
+            sw_lstep = s6.number_input("メッシュ重なり 刻み(m)", min_value=0.005, step=0.01, value=0.05, format="%.3f")
+            sw_layers = st.multiselect("配筋層", [1, 2], default=[1, 2],
+                                       format_func=lambda n: "単層(シングル)" if n == 1 else "複層(ダブル)")
+            sw_rebars = st.multiselect("鉄筋種類", RM_REBAR_CHOICES, default=RM_REBAR_CHOICES, format_func=lambda x: x[1])
+            sw_square = st.checkbox("X・Y 同じピッチだけ（外すと X×Y の全組合せ）", value=False)
+            submitted_sweep = st.form_submit_button("スイープ実行")
+
+        if submitted_sweep:
+            pitches = np.arange(sw_pmin, sw_pmax + sw_pstep/2, sw_pstep)
+            laps = np.round(np.arange(sw_lmin, sw_lmax + sw_lstep/2, sw_lstep), 3)
+            if not sw_layers or not sw_rebars or len(pitches) == 0 or len(laps) == 0:
+                st.error("層・鉄筋種類・ピッチ・重なりの範囲を指定してください。")
+            else:
+                rb_ids = [r[0] for r in sw_rebars]
+                rb_names = [r[1] for r in sw_rebars]
+                rb_kgpm = [REBAR_KG_PER_M.get(takeoff.rebar_dia(i), 0.0) for i in rb_ids]
+                sw_price = {i: PRICE_IDX.price(i, np.nan) for i in rb_ids + [takeoff.MESH_ITEM, takeoff.TIE_WIRE_ITEM, takeoff.SYKORO_ITEM]}
+                missing = [i for i, p in sw_price.items() if np.isnan(p)]
+                if missing:
+                    st.warning("採用単価が無い品を含む組合せは原価なし（比較対象外）：" + "、".join(missing))
+
+                sw = takeoff.sweep_rebar_mesh(
+                    L, W, cover_edge_mm, waste, tie_kg_per_sqm, sykoro_per_sqm_layer,
+                    sw_layers, rb_kgpm, [sw_price[i] for i in rb_ids], pitches, laps,
+                    sw_price[takeoff.MESH_ITEM], sw_price[takeoff.TIE_WIRE_ITEM], sw_price[takeoff.SYKORO_ITEM],
+                    square=sw_square,
+                )
+                if not sw["valid"]:
+                    st.error("かぶりが大きすぎます。L-2×かぶり, W-2×かぶり が正になるようにしてください。")
                 else:
-                    S["qty"][iid] = nxt; S["selected"].add(iid)
-            AI[mode] = dict(new_items)
-
-        rebar_items = {
-            rebar_choice[0]: float(total_m),
-            "tie_wire_band5_350": float(tie_kg),
-            "conc_sykoro_4x5x6": float(sykoro_pcs),
-        }
-        mesh_items = {
-            "cdmesh_6_150": float(mesh_sheets),
-            "tie_wire_band5_350": float(tie_kg),
-            "conc_sykoro_4x5x6": float(sykoro_pcs),
-        }
-
-        if mode == "鉄筋方式":
-            apply_mode("mesh", {})           # メッシュをクリア
-            apply_mode("rebar", rebar_items)
-            st.success("鉄筋方式をカートに上書きしました。"); st.rerun()
-        elif mode == "メッシュ方式":
-            apply_mode("rebar", {})          # 鉄筋をクリア
-            apply_mode("mesh", mesh_items)
-            st.success("メッシュ方式をカートに上書きしました。"); st.rerun()
+                    layer_name = {1: "単層", 2: "複層"}
+                    rc, mc = sw["rebar_cost"], sw["mesh_cost"]
+                    n_combo = rc.size + mc.size
+                    st.caption(f"組合せ {n_combo:,} 通り（鉄筋 {rc.size:,} ／ メッシュ {mc.size:,}）")
+
+                    # 最安構成（方式ごと・全体）
+                    best = []
+                    if np.isfinite(rc).any():
+                        idx = np.unravel_index(np.nanargmin(rc), rc.shape)
+                        px_b = pitches[idx[2]]; py_b = px_b if sw_square else pitches[idx[3]]
+                        best.append({"方式": "鉄筋方式", "層": layer_name[sw_layers[idx[0]]], "鉄筋/重なり": rb_names[idx[1]],
+                                     "ピッチ X×Y(mm)": f"{px_b:.0f}×{py_b:.0f}", "原価(円)": round(float(rc[idx]))})
+                    if np.isfinite(mc).any():
+                        idx = np.unravel_index(np.nanargmin(mc), mc.shape)
+                        best.append({"方式": "メッシュ方式", "層": layer_name[sw_layers[idx[0]]], "鉄筋/重なり": f"重なり {laps[idx[1]]:.3f} m",
+                                     "ピッチ X×Y(mm)": "-", "原価(円)": round(float(mc[idx]))})
+                    if best:
+                        winner = min(best, key=lambda b: b["原価(円)"])
+                        st.success(f"最安：{winner['方式']}｜{winner['層']}｜{winner['鉄筋/重なり']}｜"
+                                   f"{winner['ピッチ X×Y(mm)']}｜{winner['原価(円)']:,} 円")
+                        st.dataframe(pd.DataFrame(best), use_container_width=True, hide_index=True)
+
+                    # 原価カーブ（正方ピッチ）＋ メッシュ（フォームの重なりに最も近い値）
+                    diag = rc if sw_square else np.diagonal(rc, axis1=2, axis2=3)
+                    k = int(np.argmin(np.abs(laps - mesh_lap_x)))
+                    curve = pd.DataFrame(index=pd.Index(pitches, name="ピッチ(mm)"))
+                    for li, n in enumerate(sw_layers):
+                        for ri, name in enumerate(rb_names):
+                            curve[f"{layer_name[n]} {name}"] = diag[li, ri]
+                        curve[f"{layer_name[n]} メッシュ(重なり{laps[k]:.2f})"] = mc[li, k]
+                    st.line_chart(curve)
+
+                    # 切替点：このピッチ以上なら鉄筋方式がメッシュ以下
+                    cx = sw["crossover"]
+
+                    def _cross_note(li, ri, ki):
+                        if not (np.isfinite(mc[li, ki]) and np.isfinite(diag[li, ri]).all()):
+                            return "単価なし"
+                        p = cx[li, ri, ki]
+                        if np.isnan(p):
+                            return "範囲内は常にメッシュが安い"
+                        return "常に鉄筋が安い" if p == pitches[0] else f"{p:.0f}mm 未満はメッシュが安い"
+
+                    cross = pd.DataFrame([
+                        {"層": layer_name[n], "鉄筋": rb_names[ri], "メッシュ重なり(m)": laps[ki],
+                         "メッシュ原価(円)": round(float(mc[li, ki])) if np.isfinite(mc[li, ki]) else None,
+                         "切替ピッチ(mm)": cx[li, ri, ki], "判定": _cross_note(li, ri, ki)}
+                        for li, n in enumerate(sw_layers) for ri in range(len(rb_ids)) for ki in range(len(laps))
+                    ])
+                    st.markdown("**切替点（正方ピッチ：メッシュ方式 → 鉄筋方式）**")
+                    st.dataframe(cross, use_container_width=True, hide_index=True, height=320)
+
+rebar_mesh_section()
+
 
 # -------------------------------------
 # ブロック基礎（ブロック積） 自動拾い ＋ 見積カートへ上書き
@@ -643,160 +767,96 @@ if submitted:
 st.markdown("---")
 st.subheader("ブロック基礎（ブロック積） 自動拾い")
 
-with st.form("block_found_form"):
-    c1, c2 = st.columns(2)
-    L = c1.number_input("延長 L (m)", min_value=0.0, step=0.1, value=10.0)
-    H = c2.number_input("高さ H (m)", min_value=0.0, step=0.1, value=0.8)
-
-    # ブロック種別（厚み別）
-    block_choice = st.selectbox(
-        "ブロック種別",
-        [
-            ("block_B10_basic", "B種10cm 基本（100厚）"),
-            ("block_C12_basic", "C種12cm 基本（120厚）"),
-            ("block_C15_basic", "C種15cm 基本（150厚）"),
-            ("block_C19_basic", "C種19cm 基本（190厚）"),
-        ],
-        index=1,
-        format_func=lambda x: x[1]
-    )
-
-    st.caption("※ 隅・半マスは任意入力。未入力なら“基本”だけで計算（ロス率で吸収）。")
-
-    c3, c4, c5 = st.columns(3)
-    corners = c3.number_input("隅（コーナー）個数", min_value=0, step=1, value=0)
-    halfs   = c4.number_input("1/2ブロック個数", min_value=0, step=1, value=0)
-    joint_mm= c5.number_input("目地厚(mm)", min_value=5.0, step=1.0, value=10.0)
-
-    c6, c7 = st.columns(2)
-    loss_pct = c6.number_input("ロス率(%)", min_value=0.0, max_value=20.0, step=0.5, value=3.0)
-    block_len_mm = c7.number_input("ブロック長さ(mm)（標準390）", min_value=300.0, max_value=450.0, step=5.0, value=390.0)
-
-    st.markdown("**モルタル・鉄筋 係数（現場ごとに調整可）**")
-    c8, c9, c10 = st.columns(3)
-    cement_per_block = c8.number_input("セメント袋/ブロック（目安0.05）", min_value=0.0, step=0.01, value=0.05)
-    sand_per_cement  = c9.number_input("袋砂 / セメント1袋（例4）", min_value=0.0, step=0.5, value=4.0)
-    gravel_per_cement= c10.number_input("袋砂利 / セメント1袋（通常0）", min_value=0.0, step=0.5, value=0.0)
-
-    c11, c12, c13 = st.columns(3)
-    use_hbar = c11.checkbox("横筋を入れる（φ10 4m棒）", value=True)
-    hbar_pitch_course = c12.number_input("横筋ピッチ（段おき）", min_value=1, step=1, value=1)  # 1=毎段, 2=1段おき
-    vbar_pitch_m = c13.number_input("縦筋ピッチ（m）※任意", min_value=0.3, step=0.1, value=1.2)
-
-    st.caption("※ 縦筋は“必要なら”チェック。4m棒の使用本数で概算します。")
-    use_vbar = st.checkbox("縦筋も入れる（φ10 4m棒）", value=False)
-
-    reflect = st.radio("見積への反映", ["反映しない","上書き反映"], index=1)
-    submitted_blk = st.form_submit_button("数量を計算")
-
-# ---- 計算＆表示（フォーム外）----
-if submitted_blk:
-    # 安全な単価取得
-    def price_of(item_id: str) -> float:
-        try:
-            v = TABLE.loc[TABLE["商品ID"]==item_id, "◎ 採用単価"].values
-            return float(v[0]) if len(v) else 0.0
-        except Exception:
-            return 0.0
-
-    # --- ブロック個数 ---
-    # 実効長（目地考慮）：1ピースの有効長 ≒ (ブロック長 + 目地)
-    pitch_m = (block_len_mm + joint_mm) / 1000.0
-    courses = int(max(1, round(H / 0.2)))  # 1段 ≒ 200mm（190+目地）とみなす簡易
-    blocks_per_course = max(1, int(math.ceil(L / pitch_m)))
-    base_blocks = blocks_per_course * courses
-    # 追加（隅・半）
-    base_blocks += int(max(0, corners))
-    half_blocks = int(max(0, halfs))
-
-    # ロス加算
-    total_blocks = math.ceil(base_blocks * (1.0 + loss_pct/100.0))
-
-    # --- モルタル（袋換算） ---
-    cement_bags = total_blocks * cement_per_block
-    sand_bags   = cement_bags * sand_per_cement
-    gravel_bags = cement_bags * gravel_per_cement
-
-    # --- 鉄筋（φ10 4m棒） ---
-    rebar_id = "rebar_bar10_4m"
-    hbars = 0
-    vbars = 0
-
-    if use_hbar:
-        used_courses = math.ceil(courses / max(1, hbar_pitch_course))
-        # 1段分の必要本数（4m定尺で割り付け）
-        bars_per_course = math.ceil(L / 4.0)
-        hbars = used_courses * bars_per_course
-
-    if use_vbar and vbar_pitch_m > 0:
-        pos = math.ceil(L / vbar_pitch_m) + 1  # 端部含めて+1
-        total_len_v = pos * H                   # 全縦筋延長（m）
-        vbars = math.ceil(total_len_v / 4.0)    # 4m棒換算
-
-    # --- 結果表示 ---
-    st.success("ブロック積 計算結果（数量）")
-    st.write({
-        "段数(概算)": int(courses),
-        "ブロック基本(個)": int(total_blocks),
-        "1/2ブロック(個)": int(half_blocks),
-        "隅ブロック(個)": int(corners),
-        "セメント(袋)": round(cement_bags, 2),
-        "袋砂(袋)": round(sand_bags, 2),
-        "袋砂利(袋)": round(gravel_bags, 2),
-        "横筋 φ10 4m(本)": int(hbars),
-        "縦筋 φ10 4m(本)": int(vbars),
-    })
-
-    # --- 見積に“非累積で上書き” ---
-    if reflect == "上書き反映":
-        st.session_state.setdefault("pick_state", {"selected": set(), "qty": {}})
-        st.session_state.setdefault("auto_injected", {"block_found": {}})
-        S  = st.session_state["pick_state"]
-        AI = st.session_state["auto_injected"]
-
-        # 商品IDのマッピング（基本/隅/半）
-        item_basic = block_choice[0]
-        item_corner = {
-            "block_B10_basic":"block_B10_corner",
-            "block_C12_basic":"block_C12_corner",
-        }.get(item_basic, None)
-        item_half = {
-            "block_C12_basic":"block_C12_half",
-        }.get(item_basic, None)
-
-        new_items = { item_basic: float(total_blocks) }
-        if item_corner and corners > 0:
-            new_items[item_corner] = float(corners)
-        if item_half and half_blocks > 0:
-            new_items[item_half] = float(half_blocks)
-
-        if cement_bags > 0: new_items["bag_cement"] = float(cement_bags)
-        if sand_bags   > 0: new_items["bag_sand"]   = float(sand_bags)
-        if gravel_bags > 0: new_items["bag_gravel"] = float(gravel_bags)
-
-        if (use_hbar and hbars>0) or (use_vbar and vbars>0):
-            new_items[rebar_id] = float(hbars + vbars)
-
-        # 非累積の上書き（前回を差し戻して今回分に入れ替え）
-        prev = AI.get("block_found", {}) or {}
-        for iid, new_q in new_items.items():
-            cur = float(S["qty"].get(iid, 0.0)); prv = float(prev.get(iid, 0.0))
-            nxt = cur - prv + float(new_q)
-            if nxt <= 0:
-                S["qty"].pop(iid, None); S["selected"].discard(iid)
-            else:
-                S["qty"][iid] = nxt; S["selected"].add(iid)
-        for iid in set(prev.keys()) - set(new_items.keys()):
-            cur = float(S["qty"].get(iid, 0.0)); prv = float(prev.get(iid, 0.0))
-            nxt = cur - prv
-            if nxt <= 0:
-                S["qty"].pop(iid, None); S["selected"].discard(iid)
-            else:
-                S["qty"][iid] = nxt; S["selected"].add(iid)
-        AI["block_found"] = dict(new_items)
+@section_fragment("ブロック基礎")
+def block_found_section():
+    """ブロック基礎（ブロック積）の拾いとカート反映。"""
+    with st.form("block_found_form"):
+        c1, c2 = st.columns(2)
+        L = c1.number_input("延長 L (m)", min_value=0.0, step=0.1, value=10.0)
+        H = c2.number_input("高さ H (m)", min_value=0.0, step=0.1, value=0.8)
+
+        # ブロック種別（厚み別）
+        block_choice = st.selectbox(
+            "ブロック種別",
+            [
+                ("block_B10_basic", "B種10cm 基本（100厚）"),
+                ("block_C12_basic", "C種12cm 基本（120厚）"),
+                ("block_C15_basic", "C種15cm 基本（150厚）"),
+                ("block_C19_basic", "C種19cm 基本（190厚）"),
+            ],
+            index=1,
+            format_func=lambda x: x[1]
+        )
+
+        st.caption("※ 隅・半マスは任意入力。未入力なら“基本”だけで計算（ロス率で吸収）。")
+
+        c3, c4, c5 = st.columns(3)
+        corners = c3.number_input("隅（コーナー）個数", min_value=0, step=1, value=0)
+        halfs   = c4.number_input("1/2ブロック個数", min_value=0, step=1, value=0)
+        joint_mm= c5.number_input("目地厚(mm)", min_value=5.0, step=1.0, value=10.0)
+
+        c6, c7 = st.columns(2)
+        loss_pct = c6.number_input("ロス率(%)", min_value=0.0, max_value=20.0, step=0.5, value=3.0)
+        block_len_mm = c7.number_input("ブロック長さ(mm)（標準390）", min_value=300.0, max_value=450.0, step=5.0, value=390.0)
+
+        st.markdown("**モルタル・鉄筋 係数（現場ごとに調整可）**")
+        c8, c9, c10 = st.columns(3)
+        cement_per_block = c8.number_input("セメント袋/ブロック（目安0.05）", min_value=0.0, step=0.01, value=0.05)
+        sand_per_cement  = c9.number_input("袋砂 / セメント1袋（例4）", min_value=0.0, step=0.5, value=4.0)
+        gravel_per_cement= c10.number_input("袋砂利 / セメント1袋（通常0）", min_value=0.0, step=0.5, value=0.0)
+
+        c11, c12, c13 = st.columns(3)
+        use_hbar = c11.checkbox("横筋を入れる（φ10 4m棒）", value=True)
+        hbar_pitch_course = c12.number_input("横筋ピッチ（段おき）", min_value=1, step=1, value=1)  # 1=毎段, 2=1段おき
+        vbar_pitch_m = c13.number_input("縦筋ピッチ（m）※任意", min_value=0.3, step=0.1, value=1.2)
+
+        st.caption("※ 縦筋は“必要なら”チェック。4m棒の使用本数で概算します。")
+        use_vbar = st.checkbox("縦筋も入れる（φ10 4m棒）", value=False)
+
+        reflect = st.radio("見積への反映", ["反映しない","上書き反映"], index=1)
+        submitted_blk = st.form_submit_button("数量を計算")
+
+    # ---- 計算＆表示（フォーム外）----
+    if submitted_blk:
+        # 数量は拾いエンジン（k_takeoff）で計算
+        bf = takeoff.block_found(L, H, corners, halfs, joint_mm, loss_pct, block_len_mm,
+                                 cement_per_block, sand_per_cement, gravel_per_cement,
+                                 use_hbar, hbar_pitch_course, use_vbar, vbar_pitch_m)
+        courses = int(bf["courses"])
+        total_blocks = int(bf["total_blocks"])
+        half_blocks = int(bf["half_blocks"])
+        cement_bags = float(bf["cement_bags"])
+        sand_bags   = float(bf["sand_bags"])
+        gravel_bags = float(bf["gravel_bags"])
+
+        # --- 鉄筋（φ10 4m棒） ---
+        hbars = int(bf["hbars"])
+        vbars = int(bf["vbars"])
+
+        # --- 結果表示 ---
+        st.success("ブロック積 計算結果（数量）")
+        st.write({
+            "段数(概算)": int(courses),
+            "ブロック基本(個)": int(total_blocks),
+            "1/2ブロック(個)": int(half_blocks),
+            "隅ブロック(個)": int(corners),
+            "セメント(袋)": round(cement_bags, 2),
+            "袋砂(袋)": round(sand_bags, 2),
+            "袋砂利(袋)": round(gravel_bags, 2),
+            "横筋 φ10 4m(本)": int(hbars),
+            "縦筋 φ10 4m(本)": int(vbars),
+        })
+
+        # --- 見積に“非累積で上書き” ---
+        if reflect == "上書き反映":
+            # 隅・1/2 は対応品のある種別だけ。鉄筋は横筋＋縦筋の φ10 4m 棒
+            CART.replace("block_found", takeoff.lines_dict(takeoff.block_lines(bf, block_choice[0])))
+
+            st.success("ブロック基礎（ブロック積）を見積に上書き反映しました。")
+            st.rerun()
+
+block_found_section()
 
-        st.success("ブロック基礎（ブロック積）を見積に上書き反映しました。")
-        st.rerun()
 
 # -------------------------------------
 # 基礎：土間スラブ（ベタコン）フォーム
@@ -805,255 +865,140 @@ if submitted_blk:
 st.markdown("---")
 st.subheader("基礎 土間スラブ（ベタコン）｜生コン・配筋・砕石・周囲型枠")
 
-with st.form("slab_form"):
-    # 平面寸法
-    c1, c2 = st.columns(2)
-    L = c1.number_input("土間 長さ L (m)", min_value=0.0, step=0.1, value=12.290)
-    W = c2.number_input("土間 幅 W (m)",   min_value=0.0, step=0.1, value=5.980)
-    A = L * W
-    P = 2*(L+W)
-    st.caption(f"→ 面積 = {A:.2f} ㎡ ／ 周長 = {P:.2f} m")
-
-    # 生コン
-    c3, c4, c5 = st.columns(3)
-    t_mm = c3.number_input("土間 厚み (mm)", min_value=50.0, step=10.0, value=100.0)
-    rmx_item = c4.selectbox("生コン品番", [
-        ("rmx_18_18_20N","18-18-20 N"),
-        ("rmx_21_15_20N","21-15-20 N"),
-        ("rmx_24_18_20N","24-18-20 N"),
-        ("rmx_18_12_20BB","18-12-20 BB"),
-    ], index=1, format_func=lambda x: x[1])
-    conc_waste = c5.number_input("生コンロス率(%)", min_value=0.0, max_value=30.0, step=0.5, value=5.0)
-
-    # スラブ配筋（2方向@ピッチ）
-    st.markdown("**スラブ配筋（2方向@ピッチ）**")
-    c6, c7, c8 = st.columns(3)
-    cover_mm = c6.number_input("かぶり（外周）mm", min_value=0.0, step=5.0, value=40.0)
-    pitch_mm = c7.number_input("配筋ピッチ (mm)", min_value=75.0, step=25.0, value=200.0)
-    layers = c8.selectbox("配筋層", ["単層(シングル)","複層(ダブル)"], index=0)
-    layer_n = 2 if layers.startswith("複層") else 1
-
-    c9, c10, c11 = st.columns(3)
-    slab_rebar = c9.selectbox("スラブ主筋", [
-        ("rebar_D10_SD295A","SD295A D10"),
-        ("rebar_D13_SD295A","SD295A D13"),
-        ("rebar_D16_SD345", "SD345 D16"),
-    ], index=0, format_func=lambda x: x[1])
-    tie_kg_per_sqm = c10.number_input("結束線係数 (kg/㎡/層)", min_value=0.0, step=0.1, value=0.4)
-    chair_per_sqm  = c11.number_input("サイコロ係数 (個/㎡/層)", min_value=0.0, step=0.5, value=4.0)
-
-    # 砕石（下地）
-    st.markdown("**砕石（下地）**")
-    c12, c13 = st.columns(2)
-    subbase_t_mm = c12.number_input("砕石厚 (mm)", min_value=0.0, step=10.0, value=100.0)
-    agg_item = c13.selectbox("砕石品目", [
-        ("agg_crusher_run_recycle","再生クラッシャーラン"),
-        ("agg_katama_sp","カタマSP"),
-        ("agg_slag_rc30","スラグ砕石RC-30"),
-        ("agg_nj_slag","NJスラグ"),
-    ], index=0, format_func=lambda x: x[1])
-
-    # 周囲型枠（片面/両面切替：土間は通常片面）
-    st.markdown("**周囲型枠（土間用）**")
-    c14, c15, c16 = st.columns(3)
-    form_side = c14.selectbox("型枠面", ["片面（通常）","両面（特殊）"], index=0)
-    screws_per_sheet = c15.number_input("固定ビス 本/枚", min_value=0, step=1, value=30)
-    form_waste = c16.number_input("型枠ロス率(%)", min_value=0.0, max_value=30.0, step=0.5, value=8.0)
-    # サンギ：土間は片面想定→既定1m/か所（両面なら2m/か所）
-    s_col1, _ = st.columns(2)
-    sanki_override = s_col1.checkbox("サンギを両面換算にする（2m/か所）", value=False)
-
-    submitted_slab = st.form_submit_button("数量を計算")
-
-if submitted_slab:
-    import math
-    # 生コン
-    slab_m3 = A * (t_mm/1000.0) * (1.0 + conc_waste/100.0)
-
-    # 配筋（有効寸）
-    cov = cover_mm/1000.0
-    L_eff, W_eff = max(0.0, L-2*cov), max(0.0, W-2*cov)
-    px = py = pitch_mm/1000.0
-    n_x = int(math.floor(W_eff/px)) + 1 if px>0 else 0
-    n_y = int(math.floor(L_eff/py)) + 1 if py>0 else 0
-    total_m_slab = (n_x*L_eff + n_y*W_eff) * layer_n
-    total_m_slab *= 1.0  # ロスは配筋では別途設定が無いので0%扱い（必要なら項目追加可能）
-
-    # 重量・付帯
-    dia = "D10" if "D10" in slab_rebar[0] else ("D13" if "D13" in slab_rebar[0] else "D16")
-    kgpm = REBAR_KG_PER_M.get(dia, 0.0)
-    slab_kg = total_m_slab * kgpm
-    tie_kg  = A * tie_kg_per_sqm * layer_n
-    chairs  = math.ceil(A * chair_per_sqm * layer_n)
-
-    # 砕石
-    agg_m3 = A * (subbase_t_mm/1000.0) if subbase_t_mm>0 else 0.0
-
-    # 周囲型枠（パネル：1820×910、採用高さ＝土間厚の切上げ 200/300/450/600/900）
-    avail = [200,300,450,600,900]
-    H_use = next((x for x in avail if x>=t_mm), avail[-1])
-    side_mul = 1 if form_side.startswith("片面") else 2
-    sheet_len = 1.82
-    sheet_h_m = H_use/1000.0
-    area_per_sheet = sheet_len * sheet_h_m
-    gross_area = P * sheet_h_m * side_mul * (1.0 + form_waste/100.0)
-    sheets = math.ceil(gross_area / area_per_sheet)
-    screws = sheets * screws_per_sheet
-
-    # 土間周囲は通常「片面」でセパ/Pコン不要。サンギは 1m/か所（片面）/ 2m/か所（両面）
-    pitch = 0.45
-    cols = math.ceil(P / pitch) + 1
-    rows = max(1, math.ceil((H_use/1000.0) / pitch))
-    positions = math.ceil(cols * rows * (1.0 + form_waste/100.0))
-    sanki_m = positions * (2.0 if (sanki_override or side_mul==2) else 1.0)
-
-    st.success("土間スラブ 数量")
-    st.write({
-        "生コン(m³)": round(slab_m3,3),
-        "スラブ鉄筋 延長(m)": round(total_m_slab,1),
-        "スラブ鉄筋 重量(kg)": round(slab_kg,1),
-        "結束線(kg)": round(tie_kg,2),
-        "サイコロ(個)": int(chairs),
-        "砕石(m³)": round(agg_m3,3),
-        "周囲型枠 採用高さ(mm)": H_use,
-        "コンパネ(枚)": sheets,
-        "固定ビス(本)": screws,
-        "サンギ30角(m)": round(sanki_m,1),
-        "（注）土間周囲型枠は通常片面のためセパ/Pコンは計上しません": "必要時は両面に切替してください",
-    })
-
-# === 見積への上書き反映（スラブ） ===
-reflect_slab = st.radio(
-    "見積への反映（スラブ）",
-    ["反映しない", "上書き反映"],
-    index=0,
-    key="reflect_slab"
-)
-
-if reflect_slab == "上書き反映":
-    st.session_state.setdefault("pick_state", {"selected": set(), "qty": {}})
-    st.session_state.setdefault("auto_injected", {"foundation_slab": {}})
-    S  = st.session_state["pick_state"]
-    AI = st.session_state["auto_injected"]
-
-    # 反映する品（IDは既存マスタ）
-    new_items = {
-        rmx_item[0]: float(slab_m3),            # 生コン m3
-        agg_item[0]: float(agg_m3),             # 砕石 m3
-        slab_rebar[0]: float(total_m_slab),     # スラブ鉄筋 m（選択径）
-        "tie_wire_band5_350": float(tie_kg),    # 結束線 kg
-        "conc_sykoro_4x5x6": float(chairs),     # サイコロ 個
-        "conpa_screw_35": float(screws),        # コンパネビス 本
-        # ★ITEMS未登録のため見積反映は保留（数量は上で表示/CSVに出ています）
-        # "form_panel_1820x910": float(sheets),  # コンパネ枚
-        # "sanki_30_square": float(sanki_m),     # サンギ m
-    }
-
-    # 非累積の上書き（差し戻し→今回分に入替え）
-    prev = AI.get("foundation_slab", {}) or {}
-    for iid, new_q in new_items.items():
-        cur = float(S["qty"].get(iid, 0.0)); prv = float(prev.get(iid, 0.0))
-        nxt = cur - prv + float(new_q)
-        if nxt <= 0:
-            S["qty"].pop(iid, None); S["selected"].discard(iid)
-        else:
-            S["qty"][iid] = nxt; S["selected"].add(iid)
-    for iid in set(prev.keys()) - set(new_items.keys()):
-        cur = float(S["qty"].get(iid, 0.0)); prv = float(prev.get(iid, 0.0))
-        nxt = cur - prv
-        if nxt <= 0:
-            S["qty"].pop(iid, None); S["selected"].discard(iid)
-        else:
-            S["qty"][iid] = nxt; S["selected"].add(iid)
-
-    AI["foundation_slab"] = dict(new_items)
-    st.success("土間スラブを見積に上書き反映しました。")
-    st.rerun()
-
-
-    # ===（土間スラブの st.write(...) の直後に追記）===
-
-# 見積反映トグル
-reflect_slab = st.radio("見積への反映（スラブ）", ["反映しない","上書き反映"], index=0, key="reflect_slab")
-
-if reflect_slab == "上書き反映":
-    st.session_state.setdefault("pick_state", {"selected": set(), "qty": {}})
-    st.session_state.setdefault("auto_injected", {"foundation_slab": {}})
-    S  = st.session_state["pick_state"]
-    AI = st.session_state["auto_injected"]
-
-    # 反映する品（IDは既存マスタ準拠）
-    new_items = {
-        rmx_item[0]: float(slab_m3),                      # 生コン m3
-        agg_item[0]: float(agg_m3),                       # 砕石 m3
-        slab_rebar[0]: float(total_m_slab),               # 鉄筋 m（選択径）
-        "tie_wire_band5_350": float(tie_kg),              # 結束線 kg
-        "conc_sykoro_4x5x6": float(chairs),               # サイコロ 個
-        "conpa_screw_35": float(screws),                  # コンパネビス 本
-        # ★以下はITEMS未登録につき見積反映は保留
-        # "form_panel_1820x910": float(sheets),            # ←ITEMS追加後に有効化
-        # "sanki_30_square": float(sanki_m),              # ←ITEMS追加後に有効化
-    }
+@section_fragment("土間スラブ")
+def slab_section():
+    """土間スラブの拾い・明細CSV・カート反映。"""
+    with st.form("slab_form"):
+        # 平面寸法
+        c1, c2 = st.columns(2)
+        L = c1.number_input("土間 長さ L (m)", min_value=0.0, step=0.1, value=12.290)
+        W = c2.number_input("土間 幅 W (m)",   min_value=0.0, step=0.1, value=5.980)
+        A = L * W
+        P = 2*(L+W)
+        st.caption(f"→ 面積 = {A:.2f} ㎡ ／ 周長 = {P:.2f} m")
+
+        # 生コン
+        c3, c4, c5 = st.columns(3)
+        t_mm = c3.number_input("土間 厚み (mm)", min_value=50.0, step=10.0, value=100.0)
+        rmx_item = c4.selectbox("生コン品番", [
+            ("rmx_18_18_20N","18-18-20 N"),
+            ("rmx_21_15_20N","21-15-20 N"),
+            ("rmx_24_18_20N","24-18-20 N"),
+            ("rmx_18_12_20BB","18-12-20 BB"),
+        ], index=1, format_func=lambda x: x[1])
+        conc_waste = c5.number_input("生コンロス率(%)", min_value=0.0, max_value=30.0, step=0.5, value=5.0)
+
+        # スラブ配筋（2方向@ピッチ）
+        st.markdown("**スラブ配筋（2方向@ピッチ）**")
+        c6, c7, c8 = st.columns(3)
+        cover_mm = c6.number_input("かぶり（外周）mm", min_value=0.0, step=5.0, value=40.0)
+        pitch_mm = c7.number_input("配筋ピッチ (mm)", min_value=75.0, step=25.0, value=200.0)
+        layers = c8.selectbox("配筋層", ["単層(シングル)","複層(ダブル)"], index=0)
+        layer_n = 2 if layers.startswith("複層") else 1
+
+        c9, c10, c11 = st.columns(3)
+        slab_rebar = c9.selectbox("スラブ主筋", [
+            ("rebar_D10_SD295A","SD295A D10"),
+            ("rebar_D13_SD295A","SD295A D13"),
+            ("rebar_D16_SD345", "SD345 D16"),
+        ], index=0, format_func=lambda x: x[1])
+        tie_kg_per_sqm = c10.number_input("結束線係数 (kg/㎡/層)", min_value=0.0, step=0.1, value=0.4)
+        chair_per_sqm  = c11.number_input("サイコロ係数 (個/㎡/層)", min_value=0.0, step=0.5, value=4.0)
+
+        # 砕石（下地）
+        st.markdown("**砕石（下地）**")
+        c12, c13 = st.columns(2)
+        subbase_t_mm = c12.number_input("砕石厚 (mm)", min_value=0.0, step=10.0, value=100.0)
+        agg_item = c13.selectbox("砕石品目", [
+            ("agg_crusher_run_recycle","再生クラッシャーラン"),
+            ("agg_katama_sp","カタマSP"),
+            ("agg_slag_rc30","スラグ砕石RC-30"),
+            ("agg_nj_slag","NJスラグ"),
+        ], index=0, format_func=lambda x: x[1])
+
+        # 周囲型枠（片面/両面切替：土間は通常片面）
+        st.markdown("**周囲型枠（土間用）**")
+        c14, c15, c16 = st.columns(3)
+        form_side = c14.selectbox("型枠面", ["片面（通常）","両面（特殊）"], index=0)
+        screws_per_sheet = c15.number_input("固定ビス 本/枚", min_value=0, step=1, value=30)
+        form_waste = c16.number_input("型枠ロス率(%)", min_value=0.0, max_value=30.0, step=0.5, value=8.0)
+        # サンギ：土間は片面想定→既定1m/か所（両面なら2m/か所）
+        s_col1, _ = st.columns(2)
+        sanki_override = s_col1.checkbox("サンギを両面換算にする（2m/か所）", value=False)
+
+        reflect_slab = st.radio("見積への反映（スラブ）", ["反映しない","上書き反映"], index=0)
+        submitted_slab = st.form_submit_button("数量を計算")
+
+    if submitted_slab:
+        # 数量は拾いエンジン（k_takeoff）で計算
+        dia = takeoff.rebar_dia(slab_rebar[0])
+        kgpm = REBAR_KG_PER_M.get(dia, 0.0)
+        side_mul = 1 if form_side.startswith("片面") else 2
+        sl = takeoff.slab(L, W, t_mm, conc_waste, cover_mm, pitch_mm, layer_n, kgpm, tie_kg_per_sqm, chair_per_sqm,
+                          subbase_t_mm, side_mul, screws_per_sheet, form_waste, sanki_override)
+        slab_m3 = float(sl["slab_m3"])
+        total_m_slab = float(sl["total_m"])  # ロスは配筋では別途設定が無いので0%扱い
+        slab_kg = float(sl["slab_kg"])
+        tie_kg  = float(sl["tie_kg"])
+        chairs  = int(sl["chairs"])
+        agg_m3 = float(sl["agg_m3"])
+        H_use = int(sl["H_use"])
+        sheets = int(sl["sheets"])
+        screws = int(sl["screws"])
+        # 土間周囲は通常「片面」でセパ/Pコン不要。サンギは 1m/か所（片面）/ 2m/か所（両面）
+        sanki_m = float(sl["sanki_m"])
+
+        st.success("土間スラブ 数量")
+        st.write({
+            "生コン(m³)": round(slab_m3,3),
+            "スラブ鉄筋 延長(m)": round(total_m_slab,1),
+            "スラブ鉄筋 重量(kg)": round(slab_kg,1),
+            "結束線(kg)": round(tie_kg,2),
+            "サイコロ(個)": int(chairs),
+            "砕石(m³)": round(agg_m3,3),
+            "周囲型枠 採用高さ(mm)": H_use,
+            "コンパネ(枚)": sheets,
+            "固定ビス(本)": screws,
+            "サンギ30角(m)": round(sanki_m,1),
+            "（注）土間周囲型枠は通常片面のためセパ/Pコンは計上しません": "必要時は両面に切替してください",
+        })
+
+        df_slab = pd.DataFrame([{
+            "L(m)": L,
+            "W(m)": W,
+            "面積(㎡)": round(A, 2),
+            "周長(m)": round(P, 2),
+            "厚み(mm)": t_mm,
+            "生コン(m³)": round(slab_m3, 3),
+            "鉄筋延長(m)": round(total_m_slab, 1),
+            "鉄筋重量(kg)": round(slab_kg, 1),
+            "結束線(kg)": round(tie_kg, 2),
+            "サイコロ(個)": int(chairs),
+            "砕石(m³)": round(agg_m3, 3),
+            "型枠高さ(mm)": H_use,
+            "パネル(枚)": sheets,
+            "ビス(本)": screws,
+            "サンギ(m)": round(sanki_m, 1),
+            "型枠面": form_side
+        }])
+
+        st.download_button(
+            "↓ 土間スラブ 明細CSV",
+            data=df_slab.to_csv(index=False).encode("utf-8-sig"),
+            file_name="slab_bedacon.csv",
+            mime="text/csv"
+        )
+
+        # === 見積への上書き反映（スラブ） ===
+        # ★コンパネ・サンギは ITEMS 未登録のため見積反映は保留（数量は上で表示/CSVに出ています）
+        if reflect_slab == "上書き反映":
+            CART.replace("foundation_slab", takeoff.lines_dict(
+                takeoff.slab_lines(sl, rmx_item[0], agg_item[0], slab_rebar[0])))
+            st.success("土間スラブを見積に上書き反映しました。")
+            st.rerun()
+
+slab_section()
 
-    # 非累積の上書き
-    prev = AI.get("foundation_slab", {}) or {}
-    for iid, new_q in new_items.items():
-        cur = float(S["qty"].get(iid, 0.0)); prv = float(prev.get(iid, 0.0))
-        nxt = cur - prv + float(new_q)
-        if nxt <= 0:
-            S["qty"].pop(iid, None); S["selected"].discard(iid)
-        else:
-            S["qty"][iid] = nxt; S["selected"].add(iid)
-    # 今回なくなった品をクリア
-    for iid in set(prev.keys()) - set(new_items.keys()):
-        cur = float(S["qty"].get(iid, 0.0)); prv = float(prev.get(iid, 0.0))
-        nxt = cur - prv
-        if nxt <= 0:
-            S["qty"].pop(iid, None); S["selected"].discard(iid)
-        else:
-            S["qty"][iid] = nxt; S["selected"].add(iid)
-
-    AI["foundation_slab"] = dict(new_items)
-    st.success("土間スラブを見積に上書き反映しました。")
-    st.rerun()
-
-    # === 見積への上書き反映（スラブ） ===
-reflect_slab = st.radio(
-    "見積への反映（スラブ）",
-    ["反映しない", "上書き反映"],
-    index=0,
-    key="reflect_slab_v2"   # ← ユニークなキー名に変更
-)
-
-
-import pandas as pd   # ← 左端に置く
-
-df_slab = pd.DataFrame([{
-    "L(m)": L,
-    "W(m)": W,
-    "面積(㎡)": round(A, 2),
-    "周長(m)": round(P, 2),
-    "厚み(mm)": t_mm,
-    "生コン(m³)": round(slab_m3, 3),
-    "鉄筋延長(m)": round(total_m_slab, 1),
-    "鉄筋重量(kg)": round(slab_kg, 1),
-    "結束線(kg)": round(tie_kg, 2),
-    "サイコロ(個)": int(chairs),
-    "砕石(m³)": round(agg_m3, 3),
-    "型枠高さ(mm)": H_use,
-    "パネル(枚)": sheets,
-    "ビス(本)": screws,
-    "サンギ(m)": round(sanki_m, 1),
-    "型枠面": form_side
-}])
-
-
-st.download_button(
-    "↓ 土間スラブ 明細CSV",
-    data=df_slab.to_csv(index=False).encode("utf-8-sig"),
-    file_name="slab_bedacon.csv",
-    mime="text/csv"
-)
 
 # -------------------------------------
 # 基礎：立上り梁フォーム（生コン・配筋係数・型枠）
@@ -1062,244 +1007,242 @@ st.download_button(
 st.markdown("---")
 st.subheader("基礎 立上り梁｜生コン・配筋（係数）・型枠（両面）")
 
-with st.form("beam_form"):
-    c1, c2 = st.columns(2)
-    Lb = c1.number_input("建物長さ L (m)", min_value=0.0, step=0.1, value=12.290)
-    Wb = c2.number_input("建物幅 W (m)",   min_value=0.0, step=0.1, value=5.980)
-
-    mode = st.radio("梁延長の計算方法", [
-        "全周 (L×2+W×2)",
-        "L×1+W×2",
-        "L×2+W×1",
-        "任意入力"
-    ], index=0)
-    if mode == "全周 (L×2+W×2)":
-        beam_len = 2*(Lb+Wb)
-    elif mode == "L×1+W×2":
-        beam_len = Lb + 2*Wb
-    elif mode == "L×2+W×1":
-        beam_len = 2*Lb + Wb
-    else:
-        beam_len = st.number_input("梁延長 任意入力 (m)", min_value=0.0, step=0.1, value=10.0)
-    st.caption(f"→ 梁延長 = {beam_len:.2f} m")
-
-    c3, c4 = st.columns(2)
-    b = c3.number_input("梁幅 b (mm)", min_value=100.0, step=10.0, value=150.0)
-    h = c4.number_input("梁成 h (mm)", min_value=100.0, step=10.0, value=450.0)
-
-    # 生コン
-    rmx_item_b = st.selectbox("生コン品番（立上り）", [
-        ("rmx_18_18_20N","18-18-20 N"),
-        ("rmx_21_15_20N","21-15-20 N"),
-        ("rmx_24_18_20N","24-18-20 N"),
-        ("rmx_18_12_20BB","18-12-20 BB"),
-    ], index=1, format_func=lambda x: x[1])
-    conc_waste_b = st.number_input("生コンロス率(%)（立上り）", min_value=0.0, max_value=30.0, step=0.5, value=5.0)
-
-    # 配筋（係数）
-    c5, c6 = st.columns(2)
-    rebar_coef = c5.number_input("鉄筋係数 (kg/m³)", min_value=0.0, step=5.0, value=110.0)
-    tie_coef   = c6.number_input("結束線係数 (kg/m³)", min_value=0.0, step=0.5, value=2.0)
-
-    # 型枠（両面）＋ 金物（450×450固定）
-    st.markdown("**型枠（両面）・金物**")
-    c7, c8, c9 = st.columns(3)
-    screws_per_sheet_b = c7.number_input("固定ビス 本/枚", min_value=0, step=1, value=30)
-    form_waste_b = c8.number_input("型枠ロス率(%)", min_value=0.0, max_value=30.0, step=0.5, value=8.0)
-    sanki_both_b = c9.checkbox("サンギ両面で計上（2m/か所）", value=True)
-
-    submitted_beam = st.form_submit_button("数量を計算")
-
-if submitted_beam:
-    import math
-    # 生コン
-    beam_m3 = beam_len * (b/1000.0) * (h/1000.0) * (1.0 + conc_waste_b/100.0)
-
-    # 配筋（係数）
-    rebar_kg = beam_m3 * rebar_coef
-    tie_kg   = beam_m3 * tie_coef
-
-    # 型枠（パネル：1820×910・両面）
-    avail = [200,300,450,600,900]
-    H_use = next((x for x in avail if x>=h), avail[-1])
-    sheet_len = 1.82
-    sheet_h_m = H_use/1000.0
-    area_per_sheet = sheet_len * sheet_h_m
-    gross_area = beam_len * sheet_h_m * 2 * (1.0 + form_waste_b/100.0)
-    sheets = math.ceil(gross_area / area_per_sheet)
-    screws = sheets * screws_per_sheet_b
-
-    # Pコン・セパ・サンギ（450×450固定）
-    pitch = 0.45
-    cols = math.ceil(beam_len / pitch) + 1
-    rows = max(1, math.ceil((H_use/1000.0) / pitch))
-    positions = math.ceil(cols * rows * (1.0 + form_waste_b/100.0))
-    sepa_qty = positions               # 本（1か所=1本）
-    pcon_qty = positions * 2           # 個（両端）
-    sanki_m  = positions * (2.0 if sanki_both_b else 1.0)
-
-    st.success("立上り梁 数量")
-    st.write({
-        "生コン(m³)": round(beam_m3,3),
-        "鉄筋(kg)": round(rebar_kg,1),
-        "結束線(kg)": round(tie_kg,1),
-        "型枠 採用高さ(mm)": H_use,
-        "コンパネ(枚)": sheets,
-        "固定ビス(本)": screws,
-        "セパ(本)": sepa_qty,
-        "Pコン(個)": pcon_qty,
-        "サンギ30角(m)": round(sanki_m,1),
-        "ピッチ": "450×450（両方向）",
-    })
-
-# === 見積への上書き反映（立上り） ===
-reflect_beam = st.radio(
-    "見積への反映（立上り）",
-    ["反映しない", "上書き反映"],
-    index=0,
-    key="reflect_beam"
-)
-
-if reflect_beam == "上書き反映":
-    st.session_state.setdefault("pick_state", {"selected": set(), "qty": {}})
-    st.session_state.setdefault("auto_injected", {"foundation_beam": {}})
-    S  = st.session_state["pick_state"]
-    AI = st.session_state["auto_injected"]
-
-    # 鉄筋(kg) → D13の "m" 換算（見積の商品は m 単価のため）
-    d13_kgpm = REBAR_KG_PER_M.get("D13", 0.0)
-    rebar_d13_m = float(rebar_kg / d13_kgpm) if d13_kgpm > 0 else 0.0
-
-    new_items = {
-        rmx_item_b[0]: float(beam_m3),          # 生コン m3
-        "rebar_D13_SD295A": rebar_d13_m,        # 鉄筋 D13（m換算）
-        "tie_wire_band5_350": float(tie_kg),    # 結束線 kg
-        "conpa_screw_35": float(screws),        # コンパネビス 本
-        # ★ITEMS未登録のため見積反映は保留（数量は上で表示/CSVに出ています）
-        # "form_panel_1820x910": float(sheets),  # コンパネ枚
-        # "pcon_...": float(pcon_qty),           # Pコン
-        # "sepa_...": float(sepa_qty),           # セパ
-        # "sanki_30_square": float(sanki_m),     # サンギ m
-    }
+@section_fragment("立上り梁")
+def beam_section():
+    """立上り梁の拾い・明細CSV・カート反映。"""
+    with st.form("beam_form"):
+        c1, c2 = st.columns(2)
+        Lb = c1.number_input("建物長さ L (m)", min_value=0.0, step=0.1, value=12.290)
+        Wb = c2.number_input("建物幅 W (m)",   min_value=0.0, step=0.1, value=5.980)
+
+        mode = st.radio("梁延長の計算方法", takeoff.BEAM_MODES, index=0)
+        custom_len = 0.0
+        if mode == "任意入力":
+            custom_len = st.number_input("梁延長 任意入力 (m)", min_value=0.0, step=0.1, value=10.0)
+        beam_len = float(takeoff.beam_length(Lb, Wb, mode, custom_len))
+        st.caption(f"→ 梁延長 = {beam_len:.2f} m")
+
+        c3, c4 = st.columns(2)
+        b = c3.number_input("梁幅 b (mm)", min_value=100.0, step=10.0, value=150.0)
+        h = c4.number_input("梁成 h (mm)", min_value=100.0, step=10.0, value=450.0)
+
+        # 生コン
+        rmx_item_b = st.selectbox("生コン品番（立上り）", [
+            ("rmx_18_18_20N","18-18-20 N"),
+            ("rmx_21_15_20N","21-15-20 N"),
+            ("rmx_24_18_20N","24-18-20 N"),
+            ("rmx_18_12_20BB","18-12-20 BB"),
+        ], index=1, format_func=lambda x: x[1])
+        conc_waste_b = st.number_input("生コンロス率(%)（立上り）", min_value=0.0, max_value=30.0, step=0.5, value=5.0)
+
+        # 配筋（係数）
+        c5, c6 = st.columns(2)
+        rebar_coef = c5.number_input("鉄筋係数 (kg/m³)", min_value=0.0, step=5.0, value=110.0)
+        tie_coef   = c6.number_input("結束線係数 (kg/m³)", min_value=0.0, step=0.5, value=2.0)
+
+        # 型枠（両面）＋ 金物（450×450固定）
+        st.markdown("**型枠（両面）・金物**")
+        c7, c8, c9 = st.columns(3)
+        screws_per_sheet_b = c7.number_input("固定ビス 本/枚", min_value=0, step=1, value=30)
+        form_waste_b = c8.number_input("型枠ロス率(%)", min_value=0.0, max_value=30.0, step=0.5, value=8.0)
+        sanki_both_b = c9.checkbox("サンギ両面で計上（2m/か所）", value=True)
+
+        reflect_beam = st.radio("見積への反映（立上り）", ["反映しない","上書き反映"], index=0)
+        submitted_beam = st.form_submit_button("数量を計算")
+
+    if submitted_beam:
+        # 数量は拾いエンジン（k_takeoff）で計算
+        bm = takeoff.beam(beam_len, b, h, conc_waste_b, rebar_coef, tie_coef,
+                          screws_per_sheet_b, form_waste_b, sanki_both_b)
+        beam_m3 = float(bm["beam_m3"])
+        rebar_kg = float(bm["rebar_kg"])
+        tie_kg   = float(bm["tie_kg"])
+        H_use = int(bm["H_use"])
+        sheets = int(bm["sheets"])
+        screws = int(bm["screws"])
+        # Pコン・セパ・サンギ（450×450固定）
+        sepa_qty = int(bm["sepa_qty"])     # 本（1か所=1本）
+        pcon_qty = int(bm["pcon_qty"])     # 個（両端）
+        sanki_m  = float(bm["sanki_m"])
+
+        st.success("立上り梁 数量")
+        st.write({
+            "生コン(m³)": round(beam_m3,3),
+            "鉄筋(kg)": round(rebar_kg,1),
+            "結束線(kg)": round(tie_kg,1),
+            "型枠 採用高さ(mm)": H_use,
+            "コンパネ(枚)": sheets,
+            "固定ビス(本)": screws,
+            "セパ(本)": sepa_qty,
+            "Pコン(個)": pcon_qty,
+            "サンギ30角(m)": round(sanki_m,1),
+            "ピッチ": "450×450（両方向）",
+        })
+
+        df_beam = pd.DataFrame([{
+            "梁延長(m)": round(beam_len, 2),
+            "幅b(mm)": b,
+            "成h(mm)": h,
+            "生コン(m³)": round(beam_m3, 3),
+            "鉄筋(kg)": round(rebar_kg, 1),
+            "結束線(kg)": round(tie_kg, 1),
+            "型枠高さ(mm)": H_use,
+            "パネル(枚)": sheets,
+            "ビス(本)": screws,
+            "セパ(本)": sepa_qty,
+            "Pコン(個)": pcon_qty,
+            "サンギ(m)": round(sanki_m, 1)
+        }])
+
+        st.download_button(
+            "↓ 立上り梁 明細CSV",
+            data=df_beam.to_csv(index=False).encode("utf-8-sig"),
+            file_name="beam_uprise.csv",
+            mime="text/csv"
+        )
+
+        # === 見積への上書き反映（立上り） ===
+        # 鉄筋(kg) は D13 の m に換算（見積の商品は m 単価）。コンパネ・セパ・Pコン・サンギは ITEMS 未登録のため保留
+        if reflect_beam == "上書き反映":
+            CART.replace("foundation_beam", takeoff.lines_dict(
+                takeoff.beam_lines(bm, rmx_item_b[0], REBAR_KG_PER_M.get("D13", 0.0))))
+            st.success("立上り梁を見積に上書き反映しました。")
+            st.rerun()
+
+beam_section()
 
-    # 非累積の上書き
-    prev = AI.get("foundation_beam", {}) or {}
-    for iid, new_q in new_items.items():
-        cur = float(S["qty"].get(iid, 0.0)); prv = float(prev.get(iid, 0.0))
-        nxt = cur - prv + float(new_q)
-        if nxt <= 0:
-            S["qty"].pop(iid, None); S["selected"].discard(iid)
-        else:
-            S["qty"][iid] = nxt; S["selected"].add(iid)
-    for iid in set(prev.keys()) - set(new_items.keys()):
-        cur = float(S["qty"].get(iid, 0.0)); prv = float(prev.get(iid, 0.0))
-        nxt = cur - prv
-        if nxt <= 0:
-            S["qty"].pop(iid, None); S["selected"].discard(iid)
-        else:
-            S["qty"][iid] = nxt; S["selected"].add(iid)
-
-    AI["foundation_beam"] = dict(new_items)
-    st.success("立上り梁を見積に上書き反映しました。")
-    st.rerun()
-
-    # ===（立上り梁の st.write(...) の直後に追記）===
-
-reflect_beam = st.radio("見積への反映（立上り）", ["反映しない","上書き反映"], index=0, key="reflect_beam")
-
-if reflect_beam == "上書き反映":
-    st.session_state.setdefault("pick_state", {"selected": set(), "qty": {}})
-    st.session_state.setdefault("auto_injected", {"foundation_beam": {}})
-    S  = st.session_state["pick_state"]
-    AI = st.session_state["auto_injected"]
-
-    # 鉄筋(kg) → D13の m 換算（見積の商品は m 単価）
-    d13_kgpm = REBAR_KG_PER_M.get("D13", 0.0)
-    rebar_d13_m = float(rebar_kg / d13_kgpm) if d13_kgpm>0 else 0.0
-
-    new_items = {
-        rmx_item_b[0]: float(beam_m3),                    # 生コン m3
-        "rebar_D13_SD295A": rebar_d13_m,                  # 鉄筋 D13 を m換算で
-        "tie_wire_band5_350": float(tie_kg),              # 結束線 kg
-        "conpa_screw_35": float(screws),                  # コンパネビス 本
-        # ★以下はITEMS未登録：数量は出力済だが見積反映は保留
-        # "form_panel_1820x910": float(sheets),            # パネル枚数
-        # "pcon_..." : float(pcon_qty),                    # Pコン
-        # "sepa_..." : float(sepa_qty),                    # セパ
-        # "sanki_30_square": float(sanki_m),               # サンギ30角 m
-    }
 
-    prev = AI.get("foundation_beam", {}) or {}
-    for iid, new_q in new_items.items():
-        cur = float(S["qty"].get(iid, 0.0)); prv = float(prev.get(iid, 0.0))
-        nxt = cur - prv + float(new_q)
-        if nxt <= 0:
-            S["qty"].pop(iid, None); S["selected"].discard(iid)
-        else:
-            S["qty"][iid] = nxt; S["selected"].add(iid)
-    for iid in set(prev.keys()) - set(new_items.keys()):
-        cur = float(S["qty"].get(iid, 0.0)); prv = float(prev.get(iid, 0.0))
-        nxt = cur - prv
-        if nxt <= 0:
-            S["qty"].pop(iid, None); S["selected"].discard(iid)
-        else:
-            S["qty"][iid] = nxt; S["selected"].add(iid)
-
-    AI["foundation_beam"] = dict(new_items)
-    st.success("立上り梁を見積に上書き反映しました。")
-    st.rerun()
-
-    # === 見積への上書き反映（立上り） ===
-reflect_beam = st.radio(
-    "見積への反映（立上り）",
-    ["反映しない", "上書き反映"],
-    index=0,
-    key="reflect_beam_v2"   # ← ユニークなキー名に変更
-)
-
-
-# CSV
-import pandas as pd
+# -------------------------------------
+# 価格推移・急変アラート（任意表示）
+# -------------------------------------
+PROF.lap("価格推移")
+show_trend = st.checkbox("価格推移・急変アラートを表示する", value=False)
+if show_trend:
+    st.markdown(f"### 価格推移・急変アラート（サイドバーの期間・直近 {RECENT_N} 件）")
+    # 商品ごとの統計は NORM と同じキーで1回だけ（しきい値を変えても計算し直さない）
+    TRENDS = PC.get(("trends", prices_ver, start, end), PROF.timed("推移集計", lambda: price_trends(NORM)))
+    t1, t2 = st.columns([1, 2])
+    threshold = t1.number_input("しきい値（直前の中央値からの乖離 %）", min_value=0.5, max_value=100.0,
+                                value=5.0, step=0.5, key="trend_threshold")
+    direction = t2.radio("対象", ["both", "up", "down"], horizontal=True, key="trend_direction",
+                         format_func={"both": "値上がり・値下がり", "up": "値上がりのみ", "down": "値下がりのみ"}.get)
+    ALERTS = price_alerts(TRENDS, threshold, direction)
+    PROF.rows(len(ALERTS))
+    if ALERTS.empty:
+        st.success(f"乖離 {threshold:g}% 以上の品はありません（{len(TRENDS)} 商品）。")
+    else:
+        st.warning(f"乖離 {threshold:g}% 以上：{len(ALERTS)} 品")
+        alert_view = ALERTS.copy()
+        alert_view.insert(1, "商品", [f"{ITEMS_D[i]['name']}｜{ITEMS_D[i]['spec']}" if i in ITEMS_D else i
+                                     for i in alert_view["商品ID"]])
+        st.dataframe(alert_view.head(500), use_container_width=True, hide_index=True,
+                     column_config={"乖離(%)": st.column_config.NumberColumn("乖離(%)", format="%+.1f")})
+    trend_ids = list(ALERTS["商品ID"]) or list(TRENDS["商品ID"])
+    if trend_ids:
+        t_item = st.selectbox("推移を見る商品", trend_ids[:500], key="trend_item",
+                              format_func=lambda i: f"{ITEMS_D[i]['name']}｜{ITEMS_D[i]['spec']}" if i in ITEMS_D else i)
+        roll = rolling_prices(NORM, item_ids=[t_item])
+        st.line_chart(roll.set_index("日付")[["基準単価", "移動平均", "移動中央値"]])
+        st.dataframe(roll.drop(columns="商品ID"), use_container_width=True, hide_index=True, height=240)
 
-df_beam = pd.DataFrame([{
-    "梁延長(m)": round(beam_len, 2),
-    "幅b(mm)": b,
-    "成h(mm)": h,
-    "生コン(m³)": round(beam_m3, 3),
-    "鉄筋(kg)": round(rebar_kg, 1),
-    "結束線(kg)": round(tie_kg, 1),
-    "型枠高さ(mm)": H_use,
-    "パネル(枚)": sheets,
-    "ビス(本)": screws,
-    "セパ(本)": sepa_qty,
-    "Pコン(個)": pcon_qty,
-    "サンギ(m)": round(sanki_m, 1)
-}])
-
-st.download_button(
-    "↓ 立上り梁 明細CSV",
-    data=df_beam.to_csv(index=False).encode("utf-8-sig"),
-    file_name="beam_uprise.csv",
-    mime="text/csv"
-)
+# -------------------------------------
+# 仕入先比較（任意表示）
+# -------------------------------------
+PROF.lap("仕入先比較")
+show_vm = st.checkbox("仕入先比較を表示する", value=False)
+if show_vm:
+    st.markdown("### 仕入先比較（商品×仕入先・全期間の最新単価）")
+    # ストアの版が変わったときだけ、前回より後の行を読んで当たったセルを更新
+    with PROF.section("追記分の取込") as rec:
+        rec["rows"] = VM.sync(prices_ver, STORE.load_after,
+                              lambda raw: normalize_prices(parse_price_dates(raw)[0], ITEMS, UNITS))
+    ALL = "（すべて）"
+    v1, v2, v3 = st.columns([2, 5, 2])
+    vm_cat = v1.selectbox("カテゴリ", [ALL, *sorted(ITEMS["category"].unique())], key="vm_cat")
+    vm_vendors = v2.multiselect("仕入先（未選択＝すべて。表の列は伝票の多い順に最大 20）", VM.vendors, key="vm_vendors")
+    vm_sort = v3.selectbox("並び", ["商品一覧の順", "差額の大きい順", "差(%)の大きい順", "仕入先数の多い順"], key="vm_sort")
+
+    in_vm = set(VM.item_ids)
+    vm_ids = [i for i in (ITEMS.index if vm_cat == ALL else ITEMS.index[ITEMS["category"] == vm_cat]) if i in in_vm]
+    vendors = vm_vendors or None
+    if vm_sort != "商品一覧の順":
+        # 並べ替えは条件内の全商品で（同じ条件なら2回目からキャッシュ）
+        col = {"差額の大きい順": "差額", "差(%)の大きい順": "差(%)", "仕入先数の多い順": "仕入先数"}[vm_sort]
+        key = ("vendor_cheapest", prices_ver, VM.version, vm_cat, tuple(vm_vendors))
+        full = PC.get(key, PROF.timed("最安集計", lambda: VM.cheapest(vm_ids, vendors)))
+        vm_ids = list(full.sort_values(col, ascending=False, kind="stable")["商品ID"])
+    if not vm_ids:
+        st.info("条件に合う商品がありません。")
+    else:
+        per_page = 50
+        n_pages = (len(vm_ids) - 1) // per_page + 1
+        vm_page = st.number_input(f"ページ（全 {n_pages}・{len(vm_ids)} 商品）", min_value=1, max_value=n_pages,
+                                  value=1, step=1, key="vm_page")
+        page_ids = vm_ids[(vm_page - 1) * per_page: vm_page * per_page]
+        cheap = VM.cheapest(page_ids, vendors)
+        cheap.insert(1, "商品", [f"{ITEMS_D[i]['name']}｜{ITEMS_D[i]['spec']}" for i in cheap["商品ID"]])
+        st.dataframe(cheap, use_container_width=True, hide_index=True,
+                     column_config={"差(%)": st.column_config.NumberColumn("差(%)", format="%.1f")})
+        with st.expander("商品×仕入先 の単価表（このページの商品）", expanded=False):
+            cols = (vm_vendors or VM.vendors)[:20]
+            st.dataframe(VM.pivot(page_ids, cols), use_container_width=True)
+        PROF.rows(len(page_ids))
 
 # -------------------------------------
 # 履歴（任意表示）
 # -------------------------------------
+PROF.lap("履歴")
 show_hist = st.checkbox("仕入先ごとの履歴を表示する", value=False)
 if show_hist:
     st.markdown("### 履歴（商品別・仕入先別）")
-    for item_id, meta in ITEMS_D.items():
-        g = NORM[NORM["item_id"]==item_id].sort_values(["date","vendor"]) 
-        with st.expander(f"{meta['name']}｜{meta['spec']}（{meta['category']}）【{meta['base_unit']}】"):
-            if g.empty:
-                st.info("履歴データがありません。")
-            else:
-                show = g[["date","vendor","invoice_unit","unit_price","qty_per_invoice_unit","standard","diameter","price_per_base","detail","source"]].copy()
-                show.rename(columns={
-                    "date":"日付","vendor":"仕入先","invoice_unit":"伝票単位","unit_price":"単価","qty_per_invoice_unit":"入数",
-                    "standard":"規格","diameter":"径","price_per_base":"基準単価","detail":"換算","source":"伝票"
-                }, inplace=True)
-                st.dataframe(show, use_container_width=True, height=260)
+    # 索引は NORM と同じキーで1回だけ作る（表示は選んだ商品・ページの分だけ）
+    HIST = PC.get(("history", prices_ver, start, end), PROF.timed("履歴索引", lambda: HistoryIndex(NORM, ITEMS)))
+    ALL = "（すべて）"
+    h1, h2, h3, h4 = st.columns([2, 2, 3, 1])
+    h_cat = h1.selectbox("カテゴリ", [ALL, *HIST.categories], key="hist_cat")
+    h_vendor = h2.selectbox("仕入先", [ALL, *HIST.vendors], key="hist_vendor")
+    h_dates = h3.date_input("日付（サイドバーの期間内）", value=(start, end), key="hist_dates")
+    h_only = h4.checkbox("履歴ありのみ", value=True, key="hist_only")
+    h_from, h_to = (h_dates if isinstance(h_dates, (tuple, list)) and len(h_dates) == 2 else (start, end))
+    h_vendor = None if h_vendor == ALL else h_vendor
+
+    hist_ids = HIST.item_ids(None if h_cat == ALL else h_cat, h_vendor, with_history=h_only)
+    if not hist_ids:
+        st.info("条件に合う商品がありません。")
+    else:
+        per_page = 20
+        n_pages = (len(hist_ids) - 1) // per_page + 1
+        p1, p2 = st.columns([1, 3])
+        page = p1.number_input(f"ページ（全 {n_pages}・{len(hist_ids)} 商品）", min_value=1, max_value=n_pages,
+                               value=1, step=1, key="hist_page")
+        page_ids = hist_ids[(page - 1) * per_page: page * per_page]
+        st.dataframe(HIST.summary(page_ids, h_vendor, h_from, h_to), use_container_width=True, hide_index=True)
+
+        h_item = p2.selectbox("履歴を開く商品", page_ids, key="hist_item",
+                              format_func=lambda i: f"{ITEMS_D[i]['name']}｜{ITEMS_D[i]['spec']}（{ITEMS_D[i]['category']}）"
+                              f"【{ITEMS_D[i]['base_unit']}】" if i in ITEMS_D else i)
+        show = HIST.rows(h_item, h_vendor, h_from, h_to)
+        if show.empty:
+            st.info("履歴データがありません。")
+        else:
+            st.dataframe(show, use_container_width=True, height=260, hide_index=True)
+        PROF.rows(len(show))
+
+# -------------------------------------
+# サイドバー：処理時間（この再描画の区間別）
+# ※ 全区間の後に置く（ここまでを1回分として確定）
+# -------------------------------------
+PROF_REC = PROF.finish(session=st.session_state.setdefault("session_tag", uuid.uuid4().hex[:8]))
+with st.sidebar.expander(f"処理時間：{PROF.total:.0f} ms（区間別）", expanded=False):
+    st.dataframe(PROF.frame(), use_container_width=True, hide_index=True,
+                 column_config={"ms": st.column_config.NumberColumn("ms", format="%.1f")})
+    st.caption("ヒット/ミスは価格キャッシュ（全セッション共有）の増分。内訳（区間/…）は計算した時だけ出ます。")
+    # 環境変数 K_APP_PROFILE_LOG を指定して起動したときは既定で記録（1日の p50/p95 用）
+    if st.checkbox("計測ログに追記（JSONL）", value="K_APP_PROFILE_LOG" in os.environ, key="profile_log",
+                   help=PROFILE_LOG):
+        append_log(PROF_REC, PROFILE_LOG)
+        if st.checkbox("今日の p50 / p95 を表示", value=False, key="profile_summary"):
+            st.dataframe(latency_summary(load_log(PROFILE_LOG, since=date.today())),
+                         use_container_width=True, hide_index=True)
 
 st.caption("© VELOBI Cost — 商品→単価→仕入先履歴の順に管理。ヴェロビ思想：入力最小／内部で安全に補正／一貫フォーマット出力。")
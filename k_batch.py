@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜一括見積（CLI・物件 CSV → 見積明細＋集計）
+- 物件 CSV（1行＝1物件）を読み、土間スラブ・立上り梁・ブロック積・鉄筋スラブ（鉄筋/メッシュ）を
+  全物件まとめて計算する（k_takeoff の配列計算。物件ごとのループなし。鉄筋方式の定尺総延長も k_cutting.slab_stock_m で配列のまま）。
+- 値入れは価格ストアの採用単価（画面サイドバーと同じ 期間 × 採用ポリシー）。
+- 列が無い／空欄の項目は画面フォームの既定値。列名は下の SPEC（英字）か日本語の別名。
+- 値が読めない・商品IDが未登録の物件は計算せず、集計の「エラー」列に理由を書く。
+
+起動：
+$ python k_batch.py projects.csv -o out                # out/quote_lines.csv ＋ out/summary.csv
+$ python k_batch.py projects.csv -o out --split        # ＋ out/quotes/<物件>.csv（物件ごと）
+$ python k_batch.py projects.csv -o out --policy 最新日付 --start 2025-01-01 --end 2025-06-30
+$ python k_batch.py --template projects.csv            # 列見本（既定値1行）を書き出す
+"""
+import argparse
+import csv
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+import k_cutting as cutting
+import k_takeoff as takeoff
+from k_catalog import ITEMS, PRICES_INIT, REBAR_KG_PER_M, UNITS
+from k_pricing import POLICIES, PriceIndex, build_price_table, normalize_prices, parse_price_dates
+from k_store import DEFAULT_DB, PriceStore
+
+# 列：(既定値, 型, 日本語の別名)。既定値は各フォームの初期値
+SPEC = {
+    "project":            ("",                        "str",   ["物件","物件名","物件ID"]),
+    # 土間スラブ
+    "slab":               (True,                      "bool",  ["土間"]),
+    "L":                  (12.29,                     "float", ["建物長さ","長さ"]),
+    "W":                  (5.98,                      "float", ["建物幅","幅"]),
+    "t_mm":               (100.0,                     "float", ["土間厚","厚み"]),
+    "rmx_item":           ("rmx_21_15_20N",           "item",  ["生コン品番"]),
+    "conc_waste":         (5.0,                       "float", ["生コンロス率"]),
+    "cover_mm":           (40.0,                      "float", ["かぶり"]),
+    "pitch_mm":           (200.0,                     "float", ["配筋ピッチ","ピッチ"]),
+    "layers":             (1,                         "layers",["配筋層"]),
+    "slab_rebar":         ("rebar_D10_SD295A",        "item",  ["スラブ主筋"]),
+    "tie_kg_per_sqm":     (0.4,                       "float", ["結束線係数"]),
+    "chair_per_sqm":      (4.0,                       "float", ["サイコロ係数"]),
+    "subbase_t_mm":       (100.0,                     "float", ["砕石厚"]),
+    "agg_item":           ("agg_crusher_run_recycle", "item",  ["砕石品目"]),
+    "form_side":          (1,                         "side",  ["型枠面"]),
+    "screws_per_sheet":   (30,                        "int",   ["固定ビス"]),
+    "form_waste":         (8.0,                       "float", ["型枠ロス率"]),
+    "sanki_override":     (False,                     "bool",  ["サンギ両面換算"]),
+    # 立上り梁（建物 L・W は土間と共通）
+    "beam":               (True,                      "bool",  ["立上り"]),
+    "beam_mode":          (takeoff.BEAM_MODES[0],     "mode",  ["梁延長","延長モード"]),
+    "beam_len":           (10.0,                      "float", ["梁延長任意"]),
+    "b":                  (150.0,                     "float", ["梁幅"]),
+    "h":                  (450.0,                     "float", ["梁成"]),
+    "rmx_item_b":         ("rmx_21_15_20N",           "item",  ["生コン品番（立上り）"]),
+    "conc_waste_b":       (5.0,                       "float", ["生コンロス率（立上り）"]),
+    "rebar_coef":         (110.0,                     "float", ["鉄筋係数"]),
+    "tie_coef":           (2.0,                       "float", ["結束線係数（立上り）"]),
+    "screws_per_sheet_b": (30,                        "int",   ["固定ビス（立上り）"]),
+    "form_waste_b":       (8.0,                       "float", ["型枠ロス率（立上り）"]),
+    "sanki_both_b":       (True,                      "bool",  ["サンギ両面"]),
+    # ブロック積（block_L > 0 の物件だけ）
+    "block_L":            (0.0,                       "float", ["ブロック延長"]),
+    "block_H":            (0.8,                       "float", ["ブロック高さ"]),
+    "block_item":         ("block_C12_basic",         "item",  ["ブロック種別"]),
+    "corners":            (0,                         "int",   ["隅"]),
+    "halfs":              (0,                         "int",   ["1/2ブロック"]),
+    "joint_mm":           (10.0,                      "float", ["目地厚"]),
+    "loss_pct":           (3.0,                       "float", ["ブロックロス率"]),
+    "block_len_mm":       (390.0,                     "float", ["ブロック長さ"]),
+    "cement_per_block":   (0.05,                      "float", ["セメント袋/ブロック"]),
+    "sand_per_cement":    (4.0,                       "float", ["袋砂/セメント"]),
+    "gravel_per_cement":  (0.0,                       "float", ["袋砂利/セメント"]),
+    "use_hbar":           (True,                      "bool",  ["横筋"]),
+    "hbar_pitch_course":  (1,                         "int",   ["横筋ピッチ"]),
+    "use_vbar":           (False,                     "bool",  ["縦筋"]),
+    "vbar_pitch_m":       (1.2,                       "float", ["縦筋ピッチ"]),
+    # 鉄筋スラブ（rm_method が 鉄筋方式/メッシュ方式 の物件だけ。寸法の既定は L・W）
+    "rm_method":          ("",                        "method",["反映方式"]),
+    "rm_L":               (np.nan,                    "float", ["鉄筋スラブ長さ"]),
+    "rm_W":               (np.nan,                    "float", ["鉄筋スラブ幅"]),
+    "rm_cover_mm":        (40.0,                      "float", ["かぶり（周囲）"]),
+    "rm_waste":           (5.0,                       "float", ["鉄筋ロス率"]),
+    "rm_pitch_x_mm":      (200.0,                     "float", ["X方向ピッチ"]),
+    "rm_pitch_y_mm":      (200.0,                     "float", ["Y方向ピッチ"]),
+    "rm_layers":          (1,                         "layers",["配筋"]),
+    "rm_stock_len":       (4.0,                       "float", ["定尺長"]),
+    "rm_splice_lap":      (0.40,                      "float", ["重ね継手長"]),
+    "rm_rebar":           ("rebar_D10_NA",            "item",  ["鉄筋種類"]),
+    "rm_tie_kg_per_sqm":  (0.4,                       "float", ["結束線係数（鉄筋スラブ）"]),
+    "rm_sykoro_per_sqm":  (4.0,                       "float", ["サイコロ係数（鉄筋スラブ）"]),
+    "mesh_lap_x":         (0.15,                      "float", ["メッシュ重なり(横)"]),
+    "mesh_lap_y":         (0.15,                      "float", ["メッシュ重なり(縦)"]),
+}
+
+SECTIONS = ["土間スラブ","立上り梁","ブロック積","鉄筋スラブ"]
+LINE_COLUMNS = ["物件","区分","商品ID","カテゴリ","商品名","規格/仕様","基準単位","数量","単価","金額","採用注記"]
+ROUNDING = ["四捨五入","切り上げ","切り捨て"]
+
+_TRUE = {"1","true","yes","y","on","はい","○","◯","する"}
+_FALSE = {"0","false","no","n","off","いいえ","×","しない"}
+_MODE_ALIASES = {"全周": takeoff.BEAM_MODES[0], "L1W2": takeoff.BEAM_MODES[1],
+                 "L2W1": takeoff.BEAM_MODES[2], "任意": takeoff.BEAM_MODES[3]}
+_METHOD_ALIASES = {"": "", "なし": "", "反映しない": "", "rebar": "鉄筋方式", "鉄筋": "鉄筋方式",
+                   "mesh": "メッシュ方式", "メッシュ": "メッシュ方式"}
+
+
+# -------------------------------------
+# 物件 CSV の読み込み
+# -------------------------------------
+def _bool(v):
+    k = v.lower()
+    return True if k in _TRUE else (False if k in _FALSE else None)
+
+
+def _layers(v):
+    return 2 if v.startswith(("2","複")) else (1 if v.startswith(("1","単")) else None)
+
+
+def _side(v):
+    return 2 if v.startswith(("2","両")) else (1 if v.startswith(("1","片")) else None)
+
+
+def _mode(v):
+    if v in takeoff.BEAM_MODES:
+        return v
+    key = re.sub(r"\s", "", v)
+    return _MODE_ALIASES.get(key.split("(")[0].replace("×", "").replace("+", ""))
+
+
+def _method(v):
+    return v if v in ("鉄筋方式","メッシュ方式") else _METHOD_ALIASES.get(v.lower())
+
+
+_PARSERS = {"bool": _bool, "layers": _layers, "side": _side, "mode": _mode, "method": _method}
+
+
+def _column(raw, kind, default):
+    """文字列の列 → (値の配列, 読めなかった行のマスク)。空欄は既定値。"""
+    s = raw.astype(str).str.strip()
+    blank = (s == "").to_numpy()
+    if kind in ("float","int"):
+        v = pd.to_numeric(s.where(~blank), errors="coerce").to_numpy(dtype=float)
+        bad = np.isnan(v) & ~blank
+        v = np.where(blank, default, v)
+        if kind == "int":
+            bad |= ~np.isnan(v) & (v != np.floor(v))
+            v = np.nan_to_num(v).astype(np.int64)
+        return v, bad
+    if kind in ("str","item"):
+        return np.where(blank, default, s.to_numpy(dtype=object)).astype(object), np.zeros(len(s), bool)
+    # 選択肢系：ユニーク値ごとに解釈してから配る
+    codes, uniq = pd.factorize(s)
+    parsed = [_PARSERS[kind](u) for u in uniq]
+    bad = np.array([p is None for p in parsed], dtype=bool)[codes] & ~blank
+    vals = np.array([default if p is None else p for p in parsed], dtype=object)[codes]
+    vals = np.where(blank, default, vals)
+    if kind in ("bool","layers","side"):
+        vals = vals.astype(bool if kind == "bool" else np.int64)
+    return vals, bad
+
+
+def read_projects(src, encoding="utf-8-sig"):
+    """物件 CSV → (列ごとの配列 dict, エラー理由の配列)。"""
+    raw = pd.read_csv(src, dtype=str, keep_default_na=False, encoding=encoding)
+    alias = {a: col for col, (_, _, names) in SPEC.items() for a in [col, *names]}
+    raw = raw.rename(columns=lambda c: alias.get(str(c).strip(), str(c).strip()))
+    raw = raw.loc[:, ~raw.columns.duplicated()]
+    n = len(raw)
+    errors = np.full(n, "", dtype=object)
+    cols = {}
+    for col, (default, kind, _) in SPEC.items():
+        series = raw[col] if col in raw.columns else pd.Series([""] * n, dtype=object)
+        vals, bad = _column(series, kind, default)
+        if kind == "item":
+            bad = bad | ~pd.Series(vals).isin(ITEMS.index).to_numpy()
+        errors = np.where(bad & (errors == ""), f"{col} が不正", errors)
+        cols[col] = vals
+
+    # 物件名が空なら行番号（ヘッダを1行目とした CSV の行）
+    rows = (np.arange(n) + 2).astype(str)
+    cols["project"] = np.where(cols["project"] == "", rows, cols["project"]).astype(object)
+    dup = pd.Series(cols["project"]).duplicated(keep=False).to_numpy()
+    cols["project"] = np.where(dup, cols["project"] + "#" + rows, cols["project"]).astype(object)
+    cols["rm_L"] = np.where(np.isnan(cols["rm_L"]), cols["L"], cols["rm_L"])
+    cols["rm_W"] = np.where(np.isnan(cols["rm_W"]), cols["W"], cols["rm_W"])
+    # 鉄筋方式は切断計画を作るので、定尺・継手が使える値か先に見る
+    bad = (cols["rm_method"] == "鉄筋方式") & ~((cols["rm_stock_len"] > 0)
+                                               & (cols["rm_splice_lap"] < cols["rm_stock_len"]))
+    errors = np.where(bad & (errors == ""), "rm_stock_len / rm_splice_lap が不正（継手長は定尺未満）", errors)
+    return cols, errors
+
+
+def write_template(path):
+    """列見本（既定値の1行）を書き出す。"""
+    row = {col: default for col, (default, _, _) in SPEC.items()}
+    row.update({"project": "見本", "rm_L": "", "rm_W": ""})
+    pd.DataFrame([row]).to_csv(path, index=False, encoding="utf-8-sig")
+
+
+# -------------------------------------
+# 数量 → 明細
+# -------------------------------------
+def _long(section, idx, lines):
+    # [(商品ID, 数量)] を (物件行, 区分, 商品ID, 数量) の縦持ちへ
+    n = len(idx)
+    frames = []
+    for iid, q in lines:
+        frames.append(pd.DataFrame({
+            "row": idx,
+            "区分": section,
+            "商品ID": np.broadcast_to(np.asarray(iid, dtype=object), (n,)),
+            "数量": np.broadcast_to(np.asarray(q, dtype=float), (n,)),
+        }))
+    return frames
+
+
+def takeoff_lines(cols, ok):
+    """全物件の数量を計算し、見積に入れる明細（row / 区分 / 商品ID / 数量）を返す。"""
+    c = cols
+    frames = []
+
+    m = np.flatnonzero(ok & c["slab"])
+    if len(m):
+        dia = np.array([takeoff.rebar_dia(i) for i in c["slab_rebar"][m]], dtype=object)
+        kgpm = pd.Series(dia).map(REBAR_KG_PER_M).fillna(0.0).to_numpy()
+        r = takeoff.slab(c["L"][m], c["W"][m], c["t_mm"][m], c["conc_waste"][m], c["cover_mm"][m],
+                         c["pitch_mm"][m], c["layers"][m], kgpm, c["tie_kg_per_sqm"][m], c["chair_per_sqm"][m],
+                         c["subbase_t_mm"][m], c["form_side"][m], c["screws_per_sheet"][m], c["form_waste"][m],
+                         c["sanki_override"][m])
+        frames += _long("土間スラブ", m, takeoff.slab_lines(r, c["rmx_item"][m], c["agg_item"][m], c["slab_rebar"][m]))
+
+    m = np.flatnonzero(ok & c["beam"])
+    if len(m):
+        blen = takeoff.beam_length(c["L"][m], c["W"][m], c["beam_mode"][m].astype(str), c["beam_len"][m])
+        r = takeoff.beam(blen, c["b"][m], c["h"][m], c["conc_waste_b"][m], c["rebar_coef"][m], c["tie_coef"][m],
+                         c["screws_per_sheet_b"][m], c["form_waste_b"][m], c["sanki_both_b"][m])
+        frames += _long("立上り梁", m, takeoff.beam_lines(r, c["rmx_item_b"][m], REBAR_KG_PER_M.get("D13", 0.0)))
+
+    m = np.flatnonzero(ok & (c["block_L"] > 0))
+    if len(m):
+        r = takeoff.block_found(c["block_L"][m], c["block_H"][m], c["corners"][m], c["halfs"][m], c["joint_mm"][m],
+                                c["loss_pct"][m], c["block_len_mm"][m], c["cement_per_block"][m],
+                                c["sand_per_cement"][m], c["gravel_per_cement"][m], c["use_hbar"][m],
+                                c["hbar_pitch_course"][m], c["use_vbar"][m], c["vbar_pitch_m"][m])
+        frames += _long("ブロック積", m, takeoff.block_lines(r, c["block_item"][m]))
+
+    m = np.flatnonzero(ok & (c["rm_method"] != ""))
+    if len(m):
+        dia = np.array([takeoff.rebar_dia(i) for i in c["rm_rebar"][m]], dtype=object)
+        kgpm = pd.Series(dia).map(REBAR_KG_PER_M).fillna(0.0).to_numpy()
+        r = takeoff.rebar_mesh(c["rm_L"][m], c["rm_W"][m], c["rm_cover_mm"][m], c["rm_pitch_x_mm"][m],
+                               c["rm_pitch_y_mm"][m], c["rm_layers"][m], c["rm_waste"][m],
+                               kgpm, c["rm_tie_kg_per_sqm"][m], c["rm_sykoro_per_sqm"][m],
+                               c["mesh_lap_x"][m], c["mesh_lap_y"][m])
+        is_rebar = c["rm_method"][m] == "鉄筋方式"
+        # 鉄筋の数量は切断計画の定尺総延長（端材込み。画面と同じ）。計画は鉄筋方式の物件だけ
+        stock_m = np.zeros(len(m))
+        if is_rebar.any():
+            sub = {k: np.broadcast_to(v, m.shape)[is_rebar] for k, v in r.items() if k in ("L_eff","W_eff","n_x","n_y")}
+            stock_m[is_rebar] = cutting.slab_stock_m(sub["L_eff"], sub["W_eff"], sub["n_x"], sub["n_y"],
+                                                     c["rm_layers"][m][is_rebar], c["rm_stock_len"][m][is_rebar],
+                                                     c["rm_splice_lap"][m][is_rebar])
+        for sub, lines in ((is_rebar, takeoff.rebar_lines(r, c["rm_rebar"][m], stock_m)),
+                           (~is_rebar, takeoff.mesh_lines(r))):
+            lines = [(iid if np.ndim(iid) == 0 else iid[sub], np.broadcast_to(q, m.shape)[sub]) for iid, q in lines]
+            frames += _long("鉄筋スラブ", m[sub], lines)
+
+    if not frames:
+        return pd.DataFrame({"row": np.array([], dtype=np.int64), "区分": [], "商品ID": [], "数量": []})
+    out = pd.concat(frames, ignore_index=True)
+    keep = out["商品ID"].notna() & (out["数量"] > 0)  # 画面の上書き反映と同じく 0 以下は入れない
+    out = out[keep]
+    return out.iloc[np.argsort(out["row"].to_numpy(), kind="stable")].reset_index(drop=True)  # 物件順（区分順は保つ）
+
+
+# -------------------------------------
+# 値入れ・集計
+# -------------------------------------
+def load_price_index(store, policy, start=None, end=None):
+    """ストアの期間内の伝票から PriceIndex を作る（画面の TABLE と同じ採用単価）。"""
+    raw = parse_price_dates(store.load(start, end))[0]
+    norm = normalize_prices(raw, ITEMS, UNITS)
+    return PriceIndex(build_price_table(norm, ITEMS, policy))
+
+
+def _round(x, rounding):
+    if rounding == "四捨五入": return np.round(x, 0)
+    if rounding == "切り上げ":  return np.ceil(x)
+    return np.floor(x)
+
+
+def estimate(cols, errors, index, tax_rate=10.0, rounding="四捨五入"):
+    """(見積明細, 物件別集計) を返す。"""
+    ok = errors == ""
+    lines = index.price_lines(takeoff_lines(cols, ok))
+    lines.insert(0, "物件", cols["project"][lines["row"].to_numpy()])
+    meta = ITEMS.reindex(lines["商品ID"].to_numpy())
+    for col, src in (("カテゴリ","category"),("商品名","name"),("規格/仕様","spec"),("基準単位","base_unit")):
+        lines[col] = meta[src].to_numpy()
+
+    n = len(errors)
+    rows = lines["row"].to_numpy()
+    amount = lines["金額"].fillna(0.0).to_numpy()
+    summary = pd.DataFrame({"物件": cols["project"]})
+    sec = lines["区分"].to_numpy()
+    for s in SECTIONS:
+        summary[s] = np.bincount(rows[sec == s], weights=amount[sec == s], minlength=n)
+    summary["小計（税抜）"] = np.bincount(rows, weights=amount, minlength=n)
+    summary["消費税"] = _round(summary["小計（税抜）"].to_numpy() * tax_rate / 100.0, rounding)
+    summary["合計（税込）"] = _round(summary["小計（税抜）"].to_numpy() + summary["消費税"].to_numpy(), rounding)
+    summary["明細数"] = np.bincount(rows, minlength=n)
+    summary["単価なし"] = np.bincount(rows, weights=lines["単価"].isna().to_numpy(dtype=float), minlength=n).astype(np.int64)
+    summary["エラー"] = errors
+    return lines[LINE_COLUMNS], summary
+
+
+def write_outputs(lines, summary, out_dir, split=False):
+    """quote_lines.csv / summary.csv（＋ quotes/<物件>.csv）を書き出す。金額は円未満2桁に丸めて出す。"""
+    os.makedirs(out_dir, exist_ok=True)
+    lines = lines.round({"数量": 4, "単価": 2, "金額": 2})
+    lines.to_csv(os.path.join(out_dir, "quote_lines.csv"), index=False, encoding="utf-8-sig")
+    summary.round({s: 2 for s in SECTIONS + ["小計（税抜）"]}).to_csv(
+        os.path.join(out_dir, "summary.csv"), index=False, encoding="utf-8-sig")
+    if split:
+        # 明細は物件順に並んでいるので、1回なめて物件が変わるたびにファイルを切り替える
+        qdir = os.path.join(out_dir, "quotes")
+        os.makedirs(qdir, exist_ok=True)
+        header = LINE_COLUMNS[1:]
+        values = lines[LINE_COLUMNS].astype(object).where(lines[LINE_COLUMNS].notna(), "").to_numpy()
+        f, current = None, None
+        try:
+            for row in values:
+                if row[0] != current:
+                    if f is not None:
+                        f.close()
+                    current = row[0]
+                    name = re.sub(r'[\\/:*?"<>|]', "_", str(current))
+                    f = open(os.path.join(qdir, f"{name}.csv"), "w", encoding="utf-8-sig", newline="")
+                    w = csv.writer(f)
+                    w.writerow(header)
+                w.writerow(row[1:])
+        finally:
+            if f is not None:
+                f.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="物件 CSV から土間・立上り・ブロック・鉄筋スラブを一括見積")
+    ap.add_argument("projects", help="物件 CSV（--template のときは書き出し先）")
+    ap.add_argument("-o", "--out", default="batch_out", help="出力フォルダ")
+    ap.add_argument("--template", action="store_true", help="列見本を projects に書き出して終了")
+    ap.add_argument("--db", default=DEFAULT_DB, help="価格ストア（SQLite）")
+    ap.add_argument("--policy", default=POLICIES[0], choices=POLICIES)
+    ap.add_argument("--start", help="価格期間 開始日（既定：ストアの最古）")
+    ap.add_argument("--end", help="価格期間 終了日（既定：ストアの最新）")
+    ap.add_argument("--tax-rate", type=float, default=10.0)
+    ap.add_argument("--rounding", default=ROUNDING[0], choices=ROUNDING)
+    ap.add_argument("--split", action="store_true", help="物件ごとの見積 CSV も書き出す")
+    ap.add_argument("--encoding", default="utf-8-sig")
+    args = ap.parse_args()
+
+    if args.template:
+        write_template(args.projects)
+        raise SystemExit(0)
+
+    t0 = time.perf_counter()
+    store = PriceStore(args.db)
+    store.seed(PRICES_INIT)
+    index = load_price_index(store, args.policy, args.start, args.end)
+    cols, errors = read_projects(args.projects, encoding=args.encoding)
+    lines, summary = estimate(cols, errors, index, args.tax_rate, args.rounding)
+    write_outputs(lines, summary, args.out, split=args.split)
+    n_err = int((errors != "").sum())
+    print(f"{len(summary):,} 物件 / 明細 {len(lines):,} 行 / エラー {n_err:,} 物件 → {args.out}"
+          f"（{time.perf_counter() - t0:.2f}s）")
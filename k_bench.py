@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜ベンチマーク（合成データ）
+- 単価正規化：行単位（normalize_price）と列演算（normalize_prices）の一致確認＋速度比較。
+- 商品一覧（TABLE）：商品ごとの adopt_price ループと build_price_table の一致確認＋速度比較。
+- 時点指定（AsOfPriceIndex）：日ごとに期間を切って TABLE を作り直す方法との一致確認＋速度比較。
+- スイート（--suite）：合成の商品マスタ×価格履歴で 正規化 / 採用候補 / TABLE（3ポリシー）/ 索引 / 履歴 /
+  時点指定 / 推移 / 仕入先比較 / 商品検索 / 一覧のページ送り / カート合計 / 各拾い計算 を計って JSON に書き、しきい値（bench_thresholds.json）や前回結果より
+  遅ければ終了コード 1。
+- 同梱カタログ（--catalog）：CSV からのコンパイルと版付き pkl の読み込み、別プロセスでの import 時間。
+
+起動：
+$ python k_bench.py                          # 10k / 100k / 1M 行
+$ python k_bench.py --sizes 10000 --rowwise-limit 10000
+$ python k_bench.py --table-items 10000 --table-rows 1000000
+$ python k_bench.py --asof-dates 120
+$ python k_bench.py --catalog                # 起動時間だけ
+$ python k_bench.py --suite small medium --json bench_out.json
+$ python k_bench.py --suite medium --baseline bench_prev.json --max-ratio 1.5
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import k_catalog
+import k_cutting as cutting
+import k_polygon as polygon
+import k_takeoff as takeoff
+from k_cart import QuoteCart
+from k_catalog import REBAR_KG_PER_M, UNITS
+from k_pricing import (PRICE_COLUMNS, POLICIES, AsOfPriceIndex, HistoryIndex, PriceIndex, VendorPriceMatrix,
+                       adopt_price, adopt_prices, build_price_table, normalize_price, normalize_prices, price_alerts,
+                       price_trends, rolling_prices)
+from k_search import CatalogSearch, PickerPages
+
+
+# -------------------------------------
+# 合成データ
+# -------------------------------------
+def synth_items(n_items=200, seed=0):
+    """既存カテゴリ・単位を混ぜた商品マスタ（鉄筋m・箱/束入り・その他）。"""
+    rng = np.random.default_rng(seed)
+    dias = list(REBAR_KG_PER_M)
+    rows = []
+    for i in range(n_items):
+        k = i % 5
+        if k == 0:
+            d = dias[rng.integers(len(dias))]
+            rows.append([f"rebar_{d}_{i}", "鉄筋", "異径鋼", d, "m", None])
+        elif k == 1:
+            rows.append([f"screw_{i}", "金物", "ビス", f"{i}mm", "本", [1000, 50, None][i % 3]])
+        elif k == 2:
+            rows.append([f"block_{i}", "ブロック材", "ブロック", "基本", "個", None])
+        elif k == 3:
+            rows.append([f"rmx_{i}", "生コン", "生コン", "", "m3", None])
+        else:
+            rows.append([f"wire_{i}", "副資材", "結束線", "", "kg", None])
+    return pd.DataFrame(rows, columns=["item_id","category","name","spec","base_unit","units_per_box"]).set_index("item_id")
+
+
+def synth_prices(items, n_rows, seed=0):
+    """PRICES_INIT と同じ列の価格履歴。未対応になる単位も一定割合で混ぜる。"""
+    rng = np.random.default_rng(seed)
+    ids = items.index.to_numpy()
+    pick = rng.integers(len(ids), size=n_rows)
+    iid = ids[pick]
+    bunit = items["base_unit"].to_numpy()[pick]
+    spec = items["spec"].to_numpy()[pick]
+    r = rng.random(n_rows)
+
+    inv = bunit.astype(object).copy()
+    inv[(bunit == "m") & (r < 0.8)] = "kg"
+    inv[(bunit == "m") & (r >= 0.8) & (r < 0.85)] = "t"
+    inv[(bunit == "kg") & (r < 0.1)] = "t"
+    inv[(bunit == "本") & (r < 0.5)] = "箱"
+    inv[(bunit == "本") & (r >= 0.5) & (r < 0.7)] = "束"
+    inv[r > 0.97] = "ケース"
+
+    dia = np.where(bunit == "m", spec, "").astype(object)
+    dia[(bunit == "m") & (r > 0.9)] = ""
+    qpu = np.where(np.isin(inv, ["箱","束"]) & (r < 0.6), 100.0, np.nan)
+
+    start = np.datetime64("2023-01-01")
+    df = pd.DataFrame({
+        "date": (start + rng.integers(0, 1000, size=n_rows).astype("timedelta64[D]")).astype(str),
+        "vendor": np.array(["宮田金物","中村ブロック","上野石材","某生コンプラント"])[rng.integers(4, size=n_rows)],
+        "item_id": iid,
+        "standard": "",
+        "diameter": dia,
+        "invoice_unit": inv,
+        "unit_price": rng.integers(5, 30000, size=n_rows),
+        "qty_per_invoice_unit": qpu,
+        "source": "合成",
+    })
+    return df[PRICE_COLUMNS]
+
+
+# -------------------------------------
+# 計測
+# -------------------------------------
+def _rowwise(df, items_d):
+    rows = []
+    for _, r in df.iterrows():
+        p, note = normalize_price(r, items_d, UNITS)
+        rows.append({**r.to_dict(), "price_per_base": np.round(p,1) if not pd.isna(p) else np.nan, "detail": note})
+    return pd.DataFrame(rows)
+
+
+def check_equivalence(items, df):
+    """行単位と列演算の price_per_base / detail が完全一致するか。"""
+    a = _rowwise(df, items.to_dict(orient="index"))
+    b = normalize_prices(df, items, UNITS)
+    pd.testing.assert_series_equal(a["price_per_base"], b["price_per_base"], check_dtype=False)
+    pd.testing.assert_series_equal(a["detail"].astype(object), b["detail"].astype(object), check_dtype=False)
+
+
+def bench_normalize(sizes, rowwise_limit):
+    items = synth_items()
+    items_d = items.to_dict(orient="index")
+    check_equivalence(items, synth_prices(items, 5000, seed=1))
+    print("一致確認 OK（5,000行）")
+    print(f"{'行数':>10} {'行単位(s)':>12} {'列演算(s)':>12} {'倍率':>8}")
+    for n in sizes:
+        df = synth_prices(items, n)
+        t0 = time.perf_counter(); normalize_prices(df, items, UNITS); t_vec = time.perf_counter() - t0
+        if n <= rowwise_limit:
+            t0 = time.perf_counter(); _rowwise(df, items_d); t_row = time.perf_counter() - t0
+            print(f"{n:>10,} {t_row:>12.3f} {t_vec:>12.3f} {t_row/t_vec:>7.0f}x")
+        else:
+            print(f"{n:>10,} {'(省略)':>12} {t_vec:>12.3f} {'-':>8}")
+
+
+def _loop_table(norm, items_d, policy):
+    # 旧実装（商品ごとにマスク→adopt_price×3）
+    records = []
+    for item_id, meta in items_d.items():
+        g = norm[norm["item_id"]==item_id]
+        price_adopt, note_adopt, _ = adopt_price(g, policy)
+        price_latest, _, _ = adopt_price(g, "最新日付")
+        price_avg, _, _ = adopt_price(g, "期間平均")
+        records.append({
+            "商品ID": item_id, "カテゴリ": meta["category"], "商品名": meta["name"],
+            "規格/仕様": meta["spec"], "基準単位": meta["base_unit"],
+            "◎ 採用単価": price_adopt, "〇 最新単価": price_latest, "▲ 期間平均": price_avg,
+            "採用注記": note_adopt,
+        })
+    return pd.DataFrame(records).sort_values(["カテゴリ","商品名","規格/仕様"]).reset_index(drop=True)
+
+
+def bench_table(n_items, n_rows, loop_limit=2000):
+    items = synth_items(n_items)
+    norm = normalize_prices(synth_prices(items, n_rows).assign(date=lambda d: pd.to_datetime(d["date"])),
+                            items, UNITS)
+    small = items.iloc[:min(n_items, 300)]
+    small_norm = norm[norm["item_id"].isin(small.index)]
+    for policy in POLICIES:
+        pd.testing.assert_frame_equal(_loop_table(small_norm, small.to_dict(orient="index"), policy),
+                                      build_price_table(small_norm, small, policy), check_dtype=False)
+    print(f"一致確認 OK（{len(small)}商品 × {len(POLICIES)}ポリシー）")
+    t0 = time.perf_counter(); build_price_table(norm, items, POLICIES[0]); t_vec = time.perf_counter() - t0
+    if n_items <= loop_limit:
+        t0 = time.perf_counter(); _loop_table(norm, items.to_dict(orient="index"), POLICIES[0]); t_loop = time.perf_counter() - t0
+        print(f"TABLE {n_items:,}商品 / {n_rows:,}行：ループ {t_loop:.3f}s ／ 集計 {t_vec:.3f}s")
+    else:
+        print(f"TABLE {n_items:,}商品 / {n_rows:,}行：集計 {t_vec:.3f}s（ループは省略）")
+
+
+def bench_asof(n_items, n_rows, n_dates, n_cart=500, loop_limit=10):
+    items = synth_items(n_items)
+    norm = normalize_prices(synth_prices(items, n_rows).assign(date=lambda d: pd.to_datetime(d["date"])),
+                            items, UNITS)
+    t0 = time.perf_counter(); index = AsOfPriceIndex(norm); t_build = time.perf_counter() - t0
+    first, last = index.date_range
+    dates = pd.date_range(first, last, periods=n_dates).normalize()
+    cart = dict(zip(items.index[:n_cart], np.arange(1, n_cart + 1, dtype=float)))
+
+    # 一致確認：数時点だけ「その日以前で TABLE を作り直す」方法と比べる
+    for policy in POLICIES:
+        got = index.prices(list(cart), dates[:loop_limit], policy)
+        for d in dates[:loop_limit]:
+            want = build_price_table(norm[norm["date"] <= d], items, policy).set_index("商品ID")["◎ 採用単価"]
+            np.testing.assert_allclose(got.loc[d].to_numpy(), want.reindex(list(cart)).to_numpy())
+    print(f"一致確認 OK（{loop_limit}時点 × {len(POLICIES)}ポリシー）")
+
+    t0 = time.perf_counter()
+    for d in dates[:loop_limit]:
+        build_price_table(norm[norm["date"] <= d], items, POLICIES[0])
+    t_loop = (time.perf_counter() - t0) / loop_limit * n_dates
+    t0 = time.perf_counter(); index.cost_series(cart, dates, POLICIES[0]); t_vec = time.perf_counter() - t0
+    print(f"時点指定 {n_dates}時点 × {len(cart)}品 / {n_rows:,}行：索引 {t_build:.3f}s ／ "
+          f"日ごと作り直し {t_loop:.2f}s（推定） ／ 一括 {t_vec:.4f}s")
+
+
+_IMPORT_STMT = "import time, pandas; t = time.perf_counter(); import k_catalog; print(time.perf_counter() - t)"
+
+
+def _import_time(repeat):
+    """別プロセスで import k_catalog にかかった時間（pandas 読み込み後・最小値）。"""
+    runs = [subprocess.run([sys.executable, "-c", _IMPORT_STMT], check=True, capture_output=True, text=True,
+                           cwd=k_catalog.CATALOG_DIR.parent) for _ in range(repeat)]
+    return min(float(r.stdout) for r in runs)
+
+
+def _timed(fn):
+    t0 = time.perf_counter(); fn(); return time.perf_counter() - t0
+
+
+def bench_catalog(repeat=5):
+    t_compile = min(_timed(k_catalog.compile_catalog) for _ in range(repeat))
+    k_catalog.load_catalog()  # pkl を用意
+    t_load = min(_timed(k_catalog.load_catalog) for _ in range(repeat))
+    print(f"カタログ {len(k_catalog.ITEMS)}品 / 初期価格 {len(k_catalog.PRICES_INIT)}行（版 {k_catalog.CATALOG_VERSION}）："
+          f"CSVコンパイル {t_compile * 1e3:.1f}ms ／ pkl読み込み {t_load * 1e3:.2f}ms")
+
+    for p in k_catalog.COMPILED_DIR.glob("catalog-*.pkl"):
+        p.unlink()
+    cold = _import_time(1)
+    warm = _import_time(repeat)
+    print(f"別プロセスで import k_catalog：初回（コンパイル＋書き出し） {cold * 1e3:.1f}ms ／ 2回目以降 {warm * 1e3:.1f}ms")
+
+
+# -------------------------------------
+# スイート（機械可読の結果＋しきい値）
+# -------------------------------------
+# 規模名 → (商品数, 価格履歴の行数)
+SUITE_SCALES = {
+    "small": (1_000, 10_000),
+    "medium": (10_000, 1_000_000),
+    "large": (50_000, 5_000_000),
+}
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_thresholds.json")
+
+
+def _best(fn, repeat):
+    """repeat 回のうち最短の秒数と、最後の結果。"""
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter(); out = fn(); best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def _takeoff_cases(n, seed=0):
+    """拾い計算の入力（n 件分の配列。画面の入力範囲に収まる値）。"""
+    rng = np.random.default_rng(seed)
+    u = lambda lo, hi: rng.uniform(lo, hi, n)
+    k = lambda *vals: np.asarray(vals)[rng.integers(len(vals), size=n)]
+    return {
+        "L": u(2, 30), "W": u(2, 20), "H": u(0.4, 2.0), "t_mm": k(100, 120, 150, 200),
+        "pitch": k(150, 200, 250, 300), "layers": k(1, 2), "kgpm": k(0.617, 0.995, 1.560),
+        "stock": k(4.0, 5.5, 6.0), "lap": k(0.15, 0.2, 0.3), "b": k(120, 150, 180), "h": k(300, 450, 600),
+        "corners": rng.integers(0, 5, n), "halfs": rng.integers(0, 5, n),
+    }
+
+
+def run_suite(n_items, n_rows, repeat=3, n_cases=10_000, n_cart=500, seed=0):
+    """1規模分を計って [{case, items, rows, n, seconds}] を返す。n はその計測で処理した件数。"""
+    items = synth_items(n_items, seed=seed)
+    raw = synth_prices(items, n_rows, seed=seed).assign(date=lambda d: pd.to_datetime(d["date"]))
+    out = []
+
+    def rec(case, fn, n):
+        t, value = _best(fn, repeat)
+        out.append({"case": case, "items": n_items, "rows": n_rows, "n": int(n), "seconds": round(t, 6)})
+        print(f"  {case:<28} {t:>9.4f}s  （{n:,}）", flush=True)
+        return value
+
+    # 価格エンジン
+    norm = rec("pricing.normalize", lambda: normalize_prices(raw, items, UNITS), n_rows)
+    adopted = rec("pricing.adopt", lambda: adopt_prices(norm), len(norm))
+    tables = {}
+    for i, policy in enumerate(POLICIES):
+        tables[policy] = rec(f"pricing.table.policy{i}",
+                             lambda: build_price_table(norm, items, policy, adopted=adopted), n_items)
+    rec("pricing.table.full", lambda: build_price_table(norm, items, POLICIES[0]), len(norm))
+    index = rec("pricing.price_index", lambda: PriceIndex(tables[POLICIES[0]]), n_items)
+
+    # 履歴（索引作成と 20 品 1ページ＋1品の明細）
+    hist = rec("history.build", lambda: HistoryIndex(norm, items), len(norm))
+    page = hist.item_ids(with_history=True)[:20]
+    rec("history.page", lambda: (hist.summary(page), hist.rows(page[0]) if page else None), len(page))
+
+    # 時点指定（索引作成と 120 時点の原価系列）
+    asof = rec("asof.build", lambda: AsOfPriceIndex(norm), len(norm))
+    first, last = asof.date_range
+    dates = pd.date_range(first, last, periods=120).normalize()
+    cart_q = dict(zip(items.index[:n_cart], np.arange(1, n_cart + 1, dtype=float)))
+    rec("asof.cost_series", lambda: asof.cost_series(cart_q, dates, POLICIES[0]), len(cart_q) * len(dates))
+
+    # 推移（全商品の直近統計・1行ごとの移動統計）と急変アラート
+    trends = rec("trend.latest", lambda: price_trends(norm), len(norm))
+    rec("trend.rolling", lambda: rolling_prices(norm), len(norm))
+    rec("trend.alerts", lambda: price_alerts(trends, 5.0), len(trends))
+
+    # 仕入先比較（仕入先 300 社に振り直して作成、追記 1000 行の更新、50 品 1ページ）
+    rng = np.random.default_rng(seed)
+    vnorm = norm.assign(vendor=np.array([f"仕入先{k:03d}" for k in range(300)], dtype=object)[
+        rng.integers(300, size=len(norm))])
+    vm = rec("vendor_matrix.build", lambda: VendorPriceMatrix(vnorm), len(vnorm))
+    add = vnorm.iloc[:1000]
+    rec("vendor_matrix.update", lambda: vm.update(add), len(add))
+    vpage = list(items.index[:50])
+    rec("vendor_matrix.page", lambda: (vm.cheapest(vpage), vm.pivot(vpage, vm.vendors[:20])), len(vpage))
+
+    # 商品検索（索引作成、100 品追加の更新、1打鍵ごとの検索と一覧の絞り込み）
+    search = rec("search.build", lambda: CatalogSearch(items), n_items)
+    more = synth_items(n_items + 100, seed=seed + 1).iloc[-100:].rename(index=lambda i: f"{i}_new")
+    grown = pd.concat([items, more])
+    rec("search.update", lambda: search.update(grown), len(more))
+    queries = ["ﾋﾞｽ", "ビス 12", "てっきん d13", "ブロック 基本", "1000mm"]
+    rec("search.query", lambda: [search.mask(grown.index, q) for q in queries], len(queries))
+
+    # 商品一覧のページ送り（並べ替えの順番を作る、100 品 1ページ：単価順の中ほど・検索で絞った2ページ目）
+    def _picker():
+        pp = PickerPages(tables[POLICIES[0]])
+        pp.page(None, "◎ 採用単価")
+        return pp
+    picker = rec("picker.build", _picker, n_items)
+    hits = search.search("ビス")
+    rec("picker.page", lambda: (picker.page(None, "◎ 採用単価", True, n_items // 200 + 1, 100),
+                                picker.page(hits, "◎ 採用単価", False, 2, 100)), 200)
+
+    # カート：出どころ 5 つを上書き反映 → 合計を値付け
+    rng = np.random.default_rng(seed)
+    srcs = {f"src{j}": dict(zip(rng.choice(items.index, n_cart // 5, replace=False), rng.uniform(1, 50, n_cart // 5)))
+            for j in range(5)}
+
+    def _cart():
+        cart = QuoteCart()
+        for name, q in srcs.items():
+            cart.replace(name, q)
+        return index.lookup(cart.totals)
+    rec("cart.totals", _cart, n_cart)
+
+    # 拾い計算（n_cases 件を配列で一括）
+    c = _takeoff_cases(n_cases, seed=seed)
+    rec("takeoff.rebar_mesh", lambda: takeoff.rebar_mesh(
+        c["L"], c["W"], 60, c["pitch"], c["pitch"], c["layers"], 5, c["kgpm"], 0.01, 4, c["lap"], c["lap"]),
+        n_cases)
+    rec("takeoff.block_found", lambda: takeoff.block_found(
+        c["L"], c["H"], c["corners"], c["halfs"], 10, 3, 390, 0.1, 3, 0, True, 3, True, 0.8), n_cases)
+    rec("takeoff.slab", lambda: takeoff.slab(
+        c["L"], c["W"], c["t_mm"], 5, 60, c["pitch"], c["layers"], c["kgpm"], 0.01, 4, 100, 1, 30, 5, 0), n_cases)
+    blen = takeoff.beam_length(c["L"], c["W"], takeoff.BEAM_MODES[0])
+    rec("takeoff.beam", lambda: takeoff.beam(blen, c["b"], c["h"], 5, 100, 0.01, 30, 5, True), n_cases)
+    kg = [REBAR_KG_PER_M[d] for d in ("D10", "D13", "D16")]
+    sw_n = 3 * 4 * 2 * 3
+    rec("takeoff.sweep", lambda: takeoff.sweep_rebar_mesh(
+        12.0, 8.0, 60, 5, 0.01, 4, [1, 2], kg, [900.0, 1400.0, 2200.0], [150, 200, 250, 300], [0.15, 0.2, 0.3],
+        1300.0, 290.0, 12.0), sw_n)
+    l_shape = np.array([(0, 0), (12, 0), (12, 5), (6, 5), (6, 9), (0, 9)], dtype=float)
+    rm = rec("takeoff.polygon_mesh", lambda: polygon.polygon_rebar_mesh(
+        l_shape, [], 60, 200, 200, 2, 5, 0.995, 0.01, 4, 0.15, 0.15), 1)
+    demand = cutting.bar_pieces(np.concatenate([rm["bars_x"], rm["bars_y"]]), 2, 6.0)
+    rec("takeoff.cut_plan", lambda: cutting.plan_cuts(demand, cutting.DEFAULT_STOCKS, mode="fast"),
+        sum(demand.values()))
+    return out
+
+
+def load_thresholds(path):
+    """{規模名: {case: 上限秒}}。ファイルが無ければ空。"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# 前回比の判定で無視する差（秒）。1ms 未満の計測は揺れで倍率がすぐ跳ねるため
+MIN_DELTA = 0.01
+
+
+def check_results(results, thresholds=None, baseline=None, max_ratio=1.5):
+    """しきい値超え・前回比 max_ratio 倍超え（差が MIN_DELTA 以上）の行に status / reason を付ける。失敗件数を返す。"""
+    prev = {}
+    if baseline:
+        for r in baseline.get("results", ()):
+            prev[(r["scale"], r["case"], r["items"], r["rows"])] = r["seconds"]
+    failed = 0
+    for r in results:
+        reasons = []
+        limit = (thresholds or {}).get(r["scale"], {}).get(r["case"])
+        if limit is not None:
+            r["threshold"] = limit
+            if r["seconds"] > limit:
+                reasons.append(f"しきい値 {limit}s 超え")
+        was = prev.get((r["scale"], r["case"], r["items"], r["rows"]))
+        if was:
+            r["baseline"] = was
+            if r["seconds"] > was * max_ratio and r["seconds"] - was >= MIN_DELTA:
+                reasons.append(f"前回 {was}s の {r['seconds'] / was:.1f} 倍")
+        r["status"] = "fail" if reasons else "ok"
+        if reasons:
+            r["reason"] = "・".join(reasons)
+            failed += 1
+    return failed
+
+
+def bench_suite(scales, repeat=3, json_path=None, thresholds_path=THRESHOLDS_PATH, baseline_path=None,
+                max_ratio=1.5):
+    """スイートを回して結果を JSON に書く。遅くなった計測があれば 1、無ければ 0 を返す。"""
+    results = []
+    for scale in scales:
+        n_items, n_rows = SUITE_SCALES[scale]
+        print(f"[{scale}] {n_items:,}商品 / {n_rows:,}行", flush=True)
+        for r in run_suite(n_items, n_rows, repeat=repeat):
+            results.append({"scale": scale, **r})
+
+    baseline = None
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+    failed = check_results(results, load_thresholds(thresholds_path), baseline, max_ratio)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "platform": platform.platform(), "repeat": repeat, "max_ratio": max_ratio,
+        },
+        "failed": failed,
+        "results": results,
+    }
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"結果：{json_path}")
+    for r in results:
+        if r["status"] == "fail":
+            print(f"遅くなった：[{r['scale']}] {r['case']} {r['seconds']}s（{r['reason']}）")
+    print(f"{len(results)}件中 {failed}件 NG" if failed else f"{len(results)}件 すべて OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="単価正規化のベンチマーク")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--rowwise-limit", type=int, default=1_000_000, help="行単位で計測する最大行数（重いので調整用）")
+    ap.add_argument("--table-items", type=int, default=10_000)
+    ap.add_argument("--table-rows", type=int, default=1_000_000)
+    ap.add_argument("--asof-dates", type=int, default=120)
+    ap.add_argument("--catalog", action="store_true", help="同梱カタログの起動時間だけ計測する")
+    ap.add_argument("--suite", nargs="+", choices=list(SUITE_SCALES), help="スイートだけ回す（規模名）")
+    ap.add_argument("--json", default=None, help="スイートの結果を書く JSON")
+    ap.add_argument("--thresholds", default=THRESHOLDS_PATH, help="しきい値 JSON（{規模名: {case: 上限秒}}）")
+    ap.add_argument("--baseline", default=None, help="比べる前回のスイート結果 JSON")
+    ap.add_argument("--max-ratio", type=float, default=1.5, help="前回比でこの倍率を超えたら NG")
+    ap.add_argument("--repeat", type=int, default=3, help="スイートの各計測の繰り返し（最短を採る）")
+    args = ap.parse_args()
+    if args.catalog:
+        bench_catalog()
+        sys.exit(0)
+    if args.suite:
+        sys.exit(bench_suite(args.suite, args.repeat, args.json, args.thresholds, args.baseline, args.max_ratio))
+    bench_normalize(args.sizes, args.rowwise_limit)
+    bench_table(args.table_items, args.table_rows)
+    bench_asof(args.table_items, args.table_rows, args.asof_dates)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜見積カート（出どころ別の数量台帳）
+- 数量は「出どころ（source）」ごとの内訳で持つ：manual（一覧で✔・数量入力）、rebar / mesh / block_found /
+  foundation_slab / foundation_beam …（自動拾いの上書き反映）。
+- replace(source, items) は1回で差し替え：前回分と今回分で変わった品だけ合計を更新（差し戻し＋上書き）。
+- 合計は品ごとに内訳から出し直すので、何度反映しても浮動小数の誤差がたまらない。
+- 合計が 0 以下になった品は一覧から隠すだけ（内訳は残す。自動拾いを反映し直せば手動の調整ごと戻る）。
+  内訳ごと消すのは ✔ を外したとき（remove_item）と数量 0 の入力（set_qty）だけ。
+"""
+import math
+
+_EPS = 1e-9
+
+MANUAL = "manual"
+
+
+class QuoteCart:
+    """{source: {商品ID: 数量}} の台帳と {商品ID: 合計} を一緒に持つ。"""
+
+    def __init__(self):
+        self._by_source = {}   # source -> {商品ID: 数量}
+        self._sources = {}     # 商品ID -> {source, ...}（その品に内訳を持つ出どころ）
+        self._total = {}       # 商品ID -> 合計（> 0 のものだけ）
+
+    # ---- 参照 ----
+    def __len__(self):
+        return len(self._total)
+
+    def __contains__(self, iid):
+        return iid in self._total
+
+    @property
+    def selected(self):
+        """カートに入っている商品ID（合計 > 0）。"""
+        return self._total.keys()
+
+    @property
+    def totals(self):
+        """{商品ID: 合計}（読み取り専用のつもりで使う）。"""
+        return self._total
+
+    def qty(self, iid):
+        return self._total.get(iid, 0.0)
+
+    def source(self, name):
+        """出どころ1つ分の {商品ID: 数量} の写し。"""
+        return dict(self._by_source.get(name, {}))
+
+    def contributions(self, iid):
+        """品1つの {source: 数量}。"""
+        return {s: self._by_source[s][iid] for s in self._sources.get(iid, ())}
+
+    # ---- 更新 ----
+    def _refresh(self, iid):
+        # 内訳から合計を出し直す（出どころ数ぶんだけ）。0 以下なら隠す（内訳は残す）
+        total = sum(self._by_source[s][iid] for s in self._sources.get(iid, ()))
+        if total > _EPS:
+            self._total[iid] = total
+        else:
+            self._total.pop(iid, None)
+
+    def _put(self, source, iid, q):
+        book = self._by_source.setdefault(source, {})
+        if abs(q) > _EPS:
+            book[iid] = q
+            self._sources.setdefault(iid, set()).add(source)
+        else:
+            book.pop(iid, None)
+            srcs = self._sources.get(iid)
+            if srcs is not None:
+                srcs.discard(source)
+                if not srcs:
+                    del self._sources[iid]
+
+    def replace(self, source, items):
+        """出どころの内訳を items（{商品ID: 数量}）に差し替える。変わった商品IDの集合を返す。"""
+        old = self._by_source.get(source, {})
+        new = {iid: float(q) for iid, q in items.items() if iid is not None and float(q) > 0}
+        changed = {iid for iid in old.keys() | new.keys() if abs(old.get(iid, 0.0) - new.get(iid, 0.0)) > _EPS}
+        for iid in changed:
+            self._put(source, iid, new.get(iid, 0.0))
+        for iid in changed:
+            self._refresh(iid)
+        return changed
+
+    def clear(self, source):
+        return self.replace(source, {})
+
+    def add_item(self, iid, qty=1.0):
+        """一覧で✔：まだカートに無ければ manual に qty を入れる。"""
+        if iid not in self._total:
+            self._put(MANUAL, iid, self.contributions(iid).get(MANUAL, 0.0) + float(qty))
+            self._refresh(iid)
+
+    def set_qty(self, iid, qty):
+        """数量入力：合計が qty になるよう manual 分で調整（自動分はそのまま）。0 以下ならカートから外す。
+
+        NaN・無限大は ValueError。
+        """
+        qty = float(qty)
+        if not math.isfinite(qty):
+            raise ValueError(f"数量が数値ではありません：{iid} {qty}")
+        if qty <= 0:
+            self.remove_item(iid)
+            return
+        auto = sum(q for s, q in self.contributions(iid).items() if s != MANUAL)
+        self._put(MANUAL, iid, qty - auto)
+        self._refresh(iid)
+
+    def remove_item(self, iid):
+        """✔を外す：全ての出どころからその品を消す。"""
+        for s in self._sources.pop(iid, ()):
+            self._by_source[s].pop(iid, None)
+        self._total.pop(iid, None)
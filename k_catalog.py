@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜商品マスタ・初期価格（同梱データ）
+- ITEMS：商品マスタ（item_id を index）。ITEMS_D：{商品ID: 行dict}（画面の format_func・正規化用）。
+- REBAR_KG_PER_M：鉄筋 径→kg/m。
+- PRICES_INIT：価格ストアが空のときに投入する初期価格（伝票ベース）。
+- UNIT_EDGES：単位換算の辺（1 A = 係数 B。全商品/カテゴリ/商品別）。UNITS：それと REBAR_KG_PER_M からの単位グラフ
+  （k_units.UnitGraph。normalize_prices・伝票取込に渡す）。
+- 元データは catalog/items.csv・catalog/prices_init.csv・catalog/units.csv（商品・単位の追加は CSV に行を足すだけ）。
+- 初回 import 時に検証・型そろえをして catalog/.compiled/catalog-<版>.pkl に書き出す。
+  版（CATALOG_VERSION）は元CSVのハッシュなので、CSV を直せば次の import で作り直し、以後はそのまま読む。
+- import はプロセスで1回（モジュールとして共有）。画面（k_app3）・一括見積（k_batch）・ベンチから共通で使う。
+
+起動時間の計測：
+$ python k_bench.py --catalog
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from k_units import SCOPES, UNIT_EDGE_COLUMNS, UnitGraph
+
+CATALOG_DIR = Path(__file__).resolve().parent / "catalog"
+ITEMS_CSV = CATALOG_DIR / "items.csv"
+PRICES_CSV = CATALOG_DIR / "prices_init.csv"
+UNITS_CSV = CATALOG_DIR / "units.csv"
+COMPILED_DIR = CATALOG_DIR / ".compiled"
+
+_FORMAT = 3  # 書き出し形式を変えたら上げる（古い pkl を読まない）
+
+ITEM_COLUMNS = ["item_id", "category", "name", "spec", "base_unit", "units_per_box"]
+PRICE_INIT_COLUMNS = ["date", "vendor", "item_id", "standard", "diameter", "invoice_unit",
+                      "unit_price", "qty_per_invoice_unit", "source"]
+
+# 径→kg/m（JIS実務値）
+REBAR_KG_PER_M = {
+    "D6":0.222,"D10":0.617,"D13":0.995,"D16":1.560,"D19":2.250,
+    "D22":2.980,"D25":3.980,"D29":5.040,"D32":6.350,"D35":7.990,
+    "D38":9.860,"D41":11.90,
+}
+
+
+# -------------------------------------
+# 版・コンパイル
+# -------------------------------------
+def catalog_version(paths=(ITEMS_CSV, PRICES_CSV, UNITS_CSV)):
+    """元CSVの中身から版（16桁）を作る。"""
+    h = hashlib.sha256(str(_FORMAT).encode())
+    for p in paths:
+        h.update(Path(p).read_bytes())
+    return h.hexdigest()[:16]
+
+
+def _read_csv(path, columns, numeric):
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    missing = [c for c in columns if c not in df.columns]
+    if missing:
+        raise ValueError(f"{Path(path).name}: 列がありません {missing}")
+    df = df[columns]
+    for c in numeric:
+        df[c] = pd.to_numeric(df[c].replace("", None), errors="raise")
+    return df
+
+
+def compile_catalog(items_csv=ITEMS_CSV, prices_csv=PRICES_CSV, units_csv=UNITS_CSV):
+    """CSV → (ITEMS, PRICES_INIT, UNIT_EDGES)。商品IDの重複・初期価格の未登録商品・空/負の単価・使えない単位の辺は ValueError。"""
+    items = _read_csv(items_csv, ITEM_COLUMNS, ["units_per_box"])
+    dup = items["item_id"][items["item_id"].duplicated()]
+    if len(dup):
+        raise ValueError(f"items.csv: 商品IDが重複しています {sorted(set(dup))}")
+    if (items["item_id"] == "").any():
+        raise ValueError("items.csv: 商品IDが空の行があります")
+    items = items.set_index("item_id")
+
+    prices = _read_csv(prices_csv, PRICE_INIT_COLUMNS, ["unit_price", "qty_per_invoice_unit"])
+    unknown = prices["item_id"][~prices["item_id"].isin(items.index)]
+    if len(unknown):
+        raise ValueError(f"prices_init.csv: 商品マスタに無い商品IDです {sorted(set(unknown))}")
+    if prices["unit_price"].isna().any():
+        raise ValueError("prices_init.csv: unit_price が空の行があります")
+    if (prices["unit_price"] < 0).any():
+        raise ValueError("prices_init.csv: unit_price が負の行があります")
+    prices["unit_price"] = prices["unit_price"].astype(float)  # 小数の単価もそのまま（丸めない）
+
+    edges = _read_csv(units_csv, UNIT_EDGE_COLUMNS, ["factor"])
+    bad = edges[~edges["scope"].isin(SCOPES)]
+    if len(bad):
+        raise ValueError(f"units.csv: scope は {SCOPES} のどれかです {sorted(set(bad['scope']))}")
+    if (edges["factor"].isna() | ~(edges["factor"] > 0)).any():
+        raise ValueError("units.csv: factor は正の数です")
+    if ((edges["from_unit"] == "") | (edges["to_unit"] == "") | (edges["from_unit"] == edges["to_unit"])).any():
+        raise ValueError("units.csv: from_unit / to_unit が空か同じ単位の行があります")
+    unknown = edges.loc[(edges["scope"] == "item") & ~edges["key"].isin(items.index), "key"]
+    if len(unknown):
+        raise ValueError(f"units.csv: 商品マスタに無い商品IDです {sorted(set(unknown))}")
+    unknown = edges.loc[(edges["scope"] == "category") & ~edges["key"].isin(items["category"]), "key"]
+    if len(unknown):
+        raise ValueError(f"units.csv: 商品マスタに無いカテゴリです {sorted(set(unknown))}")
+    edges["factor"] = edges["factor"].astype(float)
+    return items, prices, edges
+
+
+def _write_atomic(path, obj):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".pkl")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load_catalog(rebuild=False):
+    """版が合う pkl があれば読む。無ければコンパイルして書き出す（書けない環境ならメモリ上だけ）。"""
+    version = catalog_version()
+    path = COMPILED_DIR / f"catalog-{version}.pkl"
+    if not rebuild and path.exists():
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") == version:
+                return data
+        except Exception:
+            pass  # 壊れていたら作り直す
+    items, prices, edges = compile_catalog()
+    data = {
+        "version": version,
+        "items": items,
+        "items_d": items.to_dict(orient="index"),
+        "prices_init": prices,
+        "unit_edges": edges,
+    }
+    try:
+        _write_atomic(path, data)
+        for old in COMPILED_DIR.glob("catalog-*.pkl"):
+            if old != path:
+                old.unlink(missing_ok=True)
+    except OSError:
+        pass
+    return data
+
+
+# -------------------------------------
+# 同梱データ（import 時に1回だけ）
+# -------------------------------------
+_DATA = load_catalog()
+CATALOG_VERSION = _DATA["version"]
+ITEMS = _DATA["items"]
+ITEMS_D = _DATA["items_d"]
+PRICES_INIT = _DATA["prices_init"]
+UNIT_EDGES = _DATA["unit_edges"]
+UNITS = UnitGraph(UNIT_EDGES, REBAR_KG_PER_M)
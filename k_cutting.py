@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜鉄筋の定尺取り（1次元カッティングストック）
+- 切断片：方向・層ごとの実際の鉄筋長（X 方向 n_x 本 × L_eff、Y 方向 n_y 本 × W_eff）。
+  最長の定尺より長い鉄筋は重ね継手（lap）を取りながら定尺＋端材に分ける。
+- 定尺は複数（例 4 / 5.5 / 6 / 8 m）から選ぶ。目的は購入する定尺の総延長（＝材料費）最小。
+- fast：FFD（長い順に最初に入る棒へ。足りなければ最長の定尺を開き、最後に入る最短の定尺へ詰め替え）。
+- optimize：FFD/BFD/パターン法（残りの最長片＋有界ナップサックで最も詰まる切り方を取れるだけ繰り返す）の最良から、
+  端材の多い棒をばらして詰め直す改善を time_budget 秒まで回す。
+- 長さは内部で mm の整数。複数棟の切断片をまとめて1つの発注にできる（何千本でも可）。
+- slab_stock_m：定尺1種類・スラブ配筋の FFD の定尺総延長を、物件の配列のまま閉じた式で（一括見積用）。
+"""
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+DEFAULT_STOCKS = (4.0, 5.5, 6.0, 8.0)
+
+
+def _mm(x):
+    return np.ceil(np.round(np.asarray(x, dtype=float) * 1000.0, 6)).astype(np.int64)
+
+
+# -------------------------------------
+# 切断片
+# -------------------------------------
+def splice(length_m, max_stock_m, lap_m):
+    """1本の鉄筋 → 切断片の長さ(m) のリスト。max_stock より長ければ重ね継手 lap を取って分割。"""
+    if length_m <= max_stock_m:
+        return [length_m]
+    if max_stock_m <= lap_m:
+        raise ValueError("重ね継手長が定尺以上です")
+    k = int(np.ceil((length_m - lap_m) / (max_stock_m - lap_m)))
+    last = length_m - (k - 1) * (max_stock_m - lap_m)
+    return [max_stock_m] * (k - 1) + [last]
+
+
+def slab_pieces(L_eff, W_eff, n_x, n_y, layers, max_stock_m, lap_m=0.0):
+    """スラブ配筋 → {切断片長(m): 本数}。X 方向は L_eff × n_x 本、Y 方向は W_eff × n_y 本（層数倍）。mm 単位で同じ長さは合算。"""
+    demand = {}
+    for length, n in ((float(L_eff), int(n_x)), (float(W_eff), int(n_y))):
+        if length <= 0 or n <= 0:
+            continue
+        for piece in splice(length, max_stock_m, lap_m):
+            key = int(_mm(piece))
+            demand[key] = demand.get(key, 0) + n * int(layers)
+    return {k / 1000.0: n for k, n in demand.items()}
+
+
+def bar_pieces(lengths, layers, max_stock_m, lap_m=0.0):
+    """長さがまちまちの鉄筋（多角形スラブの走査線など）→ {切断片長(m): 本数}。mm 単位で同じ長さは合算。"""
+    demand = {}
+    for length in lengths:
+        for piece in splice(float(length), max_stock_m, lap_m):
+            key = int(_mm(piece))
+            demand[key] = demand.get(key, 0) + int(layers)
+    return {k / 1000.0: n for k, n in demand.items()}
+
+
+def merge_demands(demands):
+    """棟ごとの {長さ: 本数} をまとめる（mm 単位で同じ長さは合算）。"""
+    out = {}
+    for d in demands:
+        for length, n in d.items():
+            key = int(_mm(length))
+            out[key] = out.get(key, 0) + int(n)
+    return {k / 1000.0: n for k, n in out.items() if n > 0}
+
+
+# -------------------------------------
+# 切断計画
+# -------------------------------------
+@dataclass
+class CutPlan:
+    patterns: list = field(default_factory=list)  # [(定尺 m, (切断片 m, ...), 本数)]
+    method: str = ""
+    elapsed: float = 0.0
+
+    @property
+    def stock_counts(self):
+        """{定尺 m: 本数}"""
+        out = {}
+        for stock, _, n in self.patterns:
+            out[stock] = out.get(stock, 0) + n
+        return dict(sorted(out.items()))
+
+    @property
+    def bars(self):
+        return sum(n for _, _, n in self.patterns)
+
+    @property
+    def stock_m(self):
+        return sum(stock * n for stock, _, n in self.patterns)
+
+    @property
+    def used_m(self):
+        return sum(sum(pieces) * n for _, pieces, n in self.patterns)
+
+    @property
+    def waste_m(self):
+        return self.stock_m - self.used_m
+
+    @property
+    def waste_pct(self):
+        return 100.0 * self.waste_m / self.stock_m if self.stock_m else 0.0
+
+    def rows(self):
+        """表示用：1パターン1行（定尺 / 切断片 / 本数 / 端材）。"""
+        return [
+            {"定尺(m)": stock, "切断片(m)": " + ".join(f"{p:g}" for p in pieces), "本数": n,
+             "端材(m)": round(stock - sum(pieces), 3)}
+            for stock, pieces, n in self.patterns
+        ]
+
+
+def _plan_from_bins(bins, stocks_mm, method, t0):
+    # bins：[(定尺 mm, (切断片 mm, ...))] → 同じ切り方をまとめた CutPlan
+    counts = {}
+    for stock, pieces in bins:
+        key = (stock, tuple(sorted(pieces, reverse=True)))
+        counts[key] = counts.get(key, 0) + 1
+    patterns = sorted(((s / 1000.0, tuple(p / 1000.0 for p in ps), n) for (s, ps), n in counts.items()),
+                      key=lambda r: (-r[0], -r[2]))
+    return CutPlan(patterns, method, time.perf_counter() - t0)
+
+
+def _prepare(demand, stocks, kerf_m):
+    lengths = _mm(list(demand.keys()))
+    counts = np.asarray(list(demand.values()), dtype=np.int64)
+    stocks_mm = np.sort(_mm(stocks))
+    kerf = int(_mm(kerf_m))
+    if len(lengths) and lengths.max() > stocks_mm[-1]:
+        raise ValueError("最長の定尺より長い切断片があります（splice で分割してください）")
+    return lengths, counts, stocks_mm, kerf
+
+
+def _downsize(used, stocks_mm):
+    # 中身が収まる最短の定尺
+    return stocks_mm[np.searchsorted(stocks_mm, used, side="left")]
+
+
+def _ffd(pieces, stocks_mm, kerf, best_fit=False):
+    """pieces（mm, 並び順どおりに入れる）→ [(定尺 mm, (切断片 mm, ...))]"""
+    cap = int(stocks_mm[-1]) + kerf
+    rem = np.empty(len(pieces), dtype=np.int64)
+    contents = []
+    n_open = 0
+    for p in pieces:
+        need = int(p) + kerf
+        fits = np.flatnonzero(rem[:n_open] >= need)
+        if len(fits):
+            i = fits[np.argmin(rem[fits])] if best_fit else fits[0]
+        else:
+            i = n_open
+            rem[i] = cap
+            contents.append([])
+            n_open += 1
+        rem[i] -= need
+        contents[i].append(int(p))
+    used = cap - rem[:n_open] - kerf
+    stock = _downsize(used, stocks_mm)
+    return [(int(s), tuple(c)) for s, c in zip(stock, contents)]
+
+
+def _best_pattern(lengths, remaining, cap, kerf):
+    """残り需要の範囲で cap に最も多く詰める切り方（有界ナップサック）→ (使用 mm, 各長さの本数)"""
+    size = lengths + kerf
+    limit = cap + kerf
+    reach = np.zeros(limit + 1, dtype=bool)
+    reach[0] = True
+    steps = []  # (長さの番号, 本数のかたまり, かける前の reach)
+    for t in np.argsort(-size):
+        c = int(min(remaining[t], limit // size[t]))
+        k = 1
+        while c > 0:
+            take = min(k, c)
+            shift = take * int(size[t])
+            if shift <= limit:
+                prev = reach.copy()
+                reach[shift:] |= prev[:limit + 1 - shift]
+                steps.append((t, take, prev))
+            c -= take
+            k *= 2
+    pos = int(np.flatnonzero(reach)[-1])
+    used = pos
+    pattern = np.zeros(len(lengths), dtype=np.int64)
+    for t, take, prev in reversed(steps):
+        if not prev[pos]:
+            pos -= take * int(size[t])
+            pattern[t] += take
+    return used - int(pattern.sum()) * kerf, pattern
+
+
+def _pattern_heuristic(lengths, counts, stocks_mm, kerf, rng=None, deadline=None):
+    """パターン法：残りの最長片を必ず入れ、残りの長さを最も詰まる切り方で埋める（定尺は無駄率最小）。
+    同じ切り方は需要の範囲で取れるだけ繰り返し、需要が尽きるまで続ける。
+    deadline（perf_counter の時刻）を過ぎたら、残りの切断片は FFD で詰める。"""
+    remaining = counts.copy()
+    bins = []
+    while remaining.sum() > 0:
+        if deadline is not None and time.perf_counter() >= deadline:
+            rest = np.repeat(lengths, remaining)
+            bins.extend(_ffd(rest[np.argsort(-rest, kind="stable")], stocks_mm, kerf))
+            break
+        t = int(np.flatnonzero(remaining)[np.argmax(lengths[remaining > 0])])  # 残りの最長片
+        rest = remaining.copy()
+        rest[t] -= 1
+        best = None
+        for s in stocks_mm:
+            room = int(s) - int(lengths[t])
+            if room < 0:
+                continue
+            used, pat = _best_pattern(lengths, rest, room - kerf, kerf) if room > kerf else (0, np.zeros_like(rest))
+            pat[t] += 1
+            waste = (s - used - lengths[t] - kerf * (pat.sum() - 1)) / s
+            if rng is not None:
+                waste *= 1.0 + 0.25 * rng.random()  # やり直しごとに少し揺らす
+            if best is None or waste < best[0]:
+                best = (waste, int(s), pat)
+        _, s, pat = best
+        mask = pat > 0
+        reps = int((remaining[mask] // pat[mask]).min())
+        if rng is not None and reps > 1 and rng.random() < 0.3:
+            reps = int(rng.integers(1, reps + 1))
+        remaining -= pat * reps
+        pieces = tuple(np.repeat(lengths, pat).tolist())
+        bins.extend([(s, pieces)] * reps)
+    # 中身が収まるなら短い定尺へ
+    return [(int(_downsize(sum(p) + kerf * (len(p) - 1), stocks_mm)), p) for _, p in bins]
+
+
+def _stock_total(bins):
+    return sum(s for s, _ in bins), len(bins)
+
+
+def plan_cuts(demand, stocks=DEFAULT_STOCKS, kerf_m=0.0, mode="fast", time_budget=2.0, seed=0):
+    """{切断片 m: 本数} と定尺候補(m) → CutPlan。
+
+    mode="fast"：FFD（対話用。数千本でも数十ms）。
+    mode="optimize"：FFD/BFD/パターン法の最良から、端材の多い棒の詰め直しを time_budget 秒まで続ける。
+    BFD・パターン法も time_budget の内（FFD の時点で使い切っていれば FFD の結果を返す）。
+    """
+    t0 = time.perf_counter()
+    lengths, counts, stocks_mm, kerf = _prepare(demand, stocks, kerf_m)
+    if counts.sum() == 0:
+        return CutPlan([], mode, 0.0)
+    pieces = np.repeat(lengths, counts)
+    order = np.argsort(-pieces, kind="stable")
+    best = _ffd(pieces[order], stocks_mm, kerf)
+    if mode == "fast":
+        return _plan_from_bins(best, stocks_mm, "FFD", t0)
+
+    label = "FFD"
+    deadline = t0 + time_budget
+    candidates = [("BFD", lambda: _ffd(pieces[order], stocks_mm, kerf, best_fit=True)),
+                  ("パターン法", lambda: _pattern_heuristic(lengths, counts, stocks_mm, kerf, deadline=deadline))]
+    for name, make in candidates:
+        if time.perf_counter() >= deadline:
+            break
+        bins = make()
+        if _stock_total(bins) < _stock_total(best):
+            best, label = bins, name
+    rng = np.random.default_rng(seed)
+    lower = int(np.sum(lengths * counts))
+    while time.perf_counter() < deadline and _stock_total(best)[0] > lower:
+        bins = _repack_worst(best, stocks_mm, kerf, rng, deadline)
+        if _stock_total(bins) < _stock_total(best):
+            best, label = bins, "最適化"
+    return _plan_from_bins(best, stocks_mm, label, t0)
+
+
+def _repack_worst(bins, stocks_mm, kerf, rng, deadline=None):
+    """端材の多い棒（＋ランダムに数本）をばらして詰め直す。良くなったかは呼び出し側で判定。"""
+    waste = np.array([s - sum(p) - kerf * (len(p) - 1) for s, p in bins])
+    k = min(len(bins), int(rng.integers(4, 40)))
+    pick = np.argsort(-waste * (1.0 + rng.random(len(bins))))[:k]
+    pick = np.union1d(pick, rng.choice(len(bins), size=min(len(bins), int(rng.integers(0, 8))), replace=False))
+    keep = np.ones(len(bins), dtype=bool)
+    keep[pick] = False
+    lengths, counts = np.unique(np.concatenate([bins[i][1] for i in pick]), return_counts=True)
+    if rng.random() < 0.7:
+        repacked = _pattern_heuristic(lengths, counts, stocks_mm, kerf, rng, deadline)
+    else:
+        pieces = np.repeat(lengths, counts)
+        noisy = pieces * (1.0 + 0.05 * rng.random(len(pieces)))
+        repacked = _ffd(pieces[np.argsort(-noisy)], stocks_mm, kerf, best_fit=True)
+    old = sum(bins[i][0] for i in pick)
+    if sum(s for s, _ in repacked) >= old:
+        return bins
+    return [b for b, k_ in zip(bins, keep) if k_] + repacked
+
+
+def lower_bound_m(demand):
+    """定尺の総延長の下限（切断片の合計）。"""
+    return float(sum(length * n for length, n in demand.items()))
+
+
+def slab_stock_m(L_eff, W_eff, n_x, n_y, layers, stock_m, lap_m=0.0):
+    """スラブ配筋（配列）→ 定尺1種類の FFD（plan_cuts(slab_pieces(...), [stock_m])）の定尺総延長 m を配列で。
+
+    切断片は 定尺ちょうど（1本で1棒）と X・Y 方向の残り片の2種類だけなので、FFD は閉じた式になる：
+    長い方の片を 定尺 // 片 本ずつ詰め、短い方の片は その棒の残りへ、入らない分は新しい棒へ。
+    """
+    L_eff, W_eff, n_x, n_y, layers, stock_m, lap_m = np.broadcast_arrays(
+        *(np.asarray(v, dtype=float) for v in (L_eff, W_eff, n_x, n_y, layers, stock_m, lap_m)))
+    S = _mm(stock_m)
+    full = np.zeros(S.shape, dtype=np.int64)
+    last, cnt = [], []
+    for length, n in ((L_eff, n_x), (W_eff, n_y)):
+        # splice() と同じ分け方：定尺 × (k-1) 本 ＋ 残り片
+        n = np.where(length > 0, np.maximum(n.astype(np.int64), 0), 0) * layers.astype(np.int64)
+        over = length > stock_m
+        with np.errstate(divide="ignore", invalid="ignore"):
+            k = np.where(over, np.ceil((length - lap_m) / (stock_m - lap_m)), 1.0)
+            rest = np.where(over, length - (k - 1) * (stock_m - lap_m), length)
+        piece = np.where(n > 0, _mm(np.where(n > 0, rest, 0.0)), 0)
+        whole = piece >= S
+        full += n * (k.astype(np.int64) - 1) + np.where(whole, n, 0)
+        last.append(np.where(whole, 0, piece))
+        cnt.append(np.where(whole, 0, n))
+    # 長い方 p・短い方 q（同じ長さなら合算）
+    swap = last[1] > last[0]
+    p, q = np.where(swap, last[1], last[0]), np.where(swap, last[0], last[1])
+    cp, cq = np.where(swap, cnt[1], cnt[0]), np.where(swap, cnt[0], cnt[1])
+    same = p == q
+    cp, cq = np.where(same, cp + cq, cp), np.where(same, 0, cq)
+    p, q = np.maximum(p, 1), np.maximum(q, 1)
+    f1 = S // p
+    b1 = -(-cp // f1)
+    r = cp - np.maximum(b1 - 1, 0) * f1                       # 最後の棒の p の本数
+    room = np.maximum(b1 - 1, 0) * ((S - f1 * p) // q) + np.where(b1 > 0, (S - r * p) // q, 0)
+    b2 = -(-np.maximum(cq - room, 0) // (S // q))
+    return (full + b1 + b2) * S / 1000.0
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜伝票一括取込（CSV / Excel）
+- 大きなファイルも chunk 単位で読む（メモリはファイルサイズに依らず一定）。
+- 仕入先ごとの列名（日付/商品ID/単価/入数…）を PRICES_INIT の列へ対応付け。
+- item_id は商品マスタ、単位は normalize_prices（単位グラフ k_units）で検証。未登録・未対応(...)・日付/単価不正は不採用。
+- 日付は行ごとに読む（同じファイルに「2025-11-01」「2025/11/02」「2025年11月3日」が混ざってよい）。
+- 不採用行はエラーレポート CSV へ逐次書き出し、採用行は chunk ごとにストアへ一括追記。
+"""
+import csv
+import os
+import tempfile
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from k_pricing import PRICE_COLUMNS, normalize_prices
+
+# 列名の別名（左がストアの列）。仕入先の伝票で見かける表記を並べる
+COLUMN_ALIASES = {
+    "date": ["date","日付","伝票日付","納品日","売上日"],
+    "vendor": ["vendor","仕入先","業者","仕入先名"],
+    "item_id": ["item_id","商品ID","商品コード"],
+    "standard": ["standard","規格"],
+    "diameter": ["diameter","径"],
+    "invoice_unit": ["invoice_unit","伝票単位","単位"],
+    "unit_price": ["unit_price","単価"],
+    "qty_per_invoice_unit": ["qty_per_invoice_unit","入数"],
+    "source": ["source","伝票","伝票番号","伝票No"],
+}
+
+ERROR_COLUMNS = ["行","理由"] + PRICE_COLUMNS
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0         # 読んだ行数
+    accepted: int = 0     # 検証OK
+    appended: int = 0     # 実際にストアへ増えた行（重複は除く）
+    rejected: int = 0     # 不採用（エラーレポート行数）
+    error_path: str = ""  # エラーレポート CSV（不採用 0 件なら空）
+
+    @property
+    def duplicates(self):
+        return self.accepted - self.appended
+
+
+def map_columns(columns, column_map=None):
+    """ファイルの列名 → ストアの列名 の対応表。column_map（ファイル列名→ストア列名）を優先。"""
+    mapping = dict(column_map or {})
+    taken = set(mapping.values())
+    for col in columns:
+        if col in mapping:
+            continue
+        key = str(col).strip()
+        for target, aliases in COLUMN_ALIASES.items():
+            if target not in taken and key in aliases:
+                mapping[col] = target
+                taken.add(target)
+                break
+    return mapping
+
+
+def iter_chunks(src, filename, chunksize=20000, encoding="utf-8-sig"):
+    """CSV/XLSX を文字列の DataFrame として chunk ごとに返す。"""
+    if str(filename).lower().endswith((".xlsx",".xlsm")):
+        try:
+            from openpyxl import load_workbook
+        except ImportError as e:
+            raise ImportError("Excel の取込には openpyxl が必要です（pip install openpyxl）") from e
+        wb = load_workbook(src, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = [str(c) if c is not None else "" for c in next(rows, [])]
+            buf = []
+            for r in rows:
+                buf.append(r)
+                if len(buf) >= chunksize:
+                    yield pd.DataFrame(buf, columns=header, dtype=object)
+                    buf = []
+            if buf:
+                yield pd.DataFrame(buf, columns=header, dtype=object)
+        finally:
+            wb.close()
+    else:
+        yield from pd.read_csv(src, chunksize=chunksize, dtype=str, encoding=encoding, keep_default_na=False)
+
+
+def parse_dates(values):
+    """伝票の日付 → Timestamp（読めなければ NaT）。行ごとに書式が違ってよい。
+
+    年→月→日 の順だけ受け付ける：「2025-11-01」「2025/11/2」「2025.11.3」「2025年11月4日」「20251105」、
+    Excel の日付セル。区切りを「-」にそろえてから ISO 8601 として読む（chunk の先頭行の書式に決め打ちしない）。
+    """
+    s = pd.Series(values, dtype=object)
+    text = s.where(s.notna(), "").astype(str).str.strip()
+    text = text.str.replace(r"\s*(?:年|月|/|\.)\s*", "-", regex=True).str.replace(r"日$", "", regex=True)
+    return pd.to_datetime(text, errors="coerce", format="ISO8601")
+
+
+def validate_chunk(df, items, units):
+    """(採用行, 不採用行) に分ける。採用行の date は Timestamp、不採用行は元の値のまま「理由」列を付ける。"""
+    ok = pd.Series(True, index=df.index)
+    reason = pd.Series("", index=df.index, dtype=object)
+
+    def reject(mask, why):
+        nonlocal ok
+        mask = mask & ok
+        reason[mask] = why
+        ok = ok & ~mask
+
+    dates = parse_dates(df["date"])
+    price = pd.to_numeric(df["unit_price"], errors="coerce")
+    reject(dates.isna(), "日付不正")
+    reject(price.isna() | (price < 0), "単価不正")
+    reject(~df["item_id"].isin(items.index), "未登録商品")
+
+    # 単位：正規化して未対応(...)になる行は採用しない
+    norm = normalize_prices(df.assign(date=dates), items, units)
+    ng = norm["price_per_base"].isna().to_numpy()
+    reason[ok & ng] = norm["detail"].to_numpy()[(ok & ng).to_numpy()]
+    ok = ok & ~ng
+    return df[ok].assign(date=dates[ok]), df[~ok].assign(理由=reason[~ok])
+
+
+def _prepare(chunk, mapping, vendor, source):
+    df = chunk.rename(columns=mapping)
+    df = df.loc[:, ~df.columns.duplicated()].reindex(columns=PRICE_COLUMNS)
+    for c in ("vendor","standard","diameter","invoice_unit","source"):
+        df[c] = df[c].astype(object).where(df[c].notna(), "").astype(str).str.strip()
+    df["item_id"] = df["item_id"].astype(object).where(df["item_id"].notna(), "").astype(str).str.strip()
+    if vendor:
+        df.loc[df["vendor"] == "", "vendor"] = vendor
+    if source:
+        df.loc[df["source"] == "", "source"] = source
+    df["qty_per_invoice_unit"] = pd.to_numeric(df["qty_per_invoice_unit"], errors="coerce")
+    return df
+
+
+def import_invoices(src, filename, store, items, units, vendor=None, column_map=None,
+                    chunksize=20000, encoding="utf-8-sig", error_path=None):
+    """伝票ファイルを検証してストアへ追記し、ImportReport を返す。
+
+    vendor / 伝票名（ファイル名）はファイル側が空欄の行にだけ補う。
+    """
+    report = ImportReport()
+    err_file = None
+    mapping = None
+    source = os.path.splitext(os.path.basename(str(filename)))[0]
+    try:
+        for chunk in iter_chunks(src, filename, chunksize=chunksize, encoding=encoding):
+            if mapping is None:
+                mapping = map_columns(chunk.columns, column_map)
+                missing = {"date","item_id","invoice_unit","unit_price"} - set(mapping.values())
+                if missing:
+                    raise ValueError(f"必須列が見つかりません：{', '.join(sorted(missing))}")
+            df = _prepare(chunk, mapping, vendor, source)
+            df.insert(0, "行", np.arange(len(df)) + report.rows + 2)  # ヘッダ行を1行目とした元ファイルの行番号
+            good, bad = validate_chunk(df, items, units)
+            report.rows += len(df)
+            report.accepted += len(good)
+            report.appended += store.append(good[PRICE_COLUMNS])
+            if len(bad):
+                if err_file is None:
+                    if error_path is None:
+                        fd, error_path = tempfile.mkstemp(prefix="import_errors_", suffix=".csv")
+                        os.close(fd)
+                    err_file = open(error_path, "w", encoding="utf-8-sig", newline="")
+                    csv.writer(err_file).writerow(ERROR_COLUMNS)
+                bad[ERROR_COLUMNS].to_csv(err_file, index=False, header=False)
+                report.rejected += len(bad)
+    finally:
+        if err_file is not None:
+            err_file.close()
+    report.error_path = error_path if report.rejected else ""
+    return report
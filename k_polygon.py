@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜多角形スラブ（L字・切り欠き・開口）の配筋とメッシュ割付け
+- 入力：外周の頂点列（m）＋開口（穴）の頂点列。かぶり分だけ内側へオフセットして有効形状にする。
+- 鉄筋方式：ピッチごとの走査線で形状を切り、1区間＝1本の鉄筋（長さは切断計画 k_cutting にそのまま渡せる）。
+- メッシュ方式：0.9×1.8 のシートを重なり込みの格子で敷き、形状が全部かかるマスは1枚、
+  かかりが一部のマスは必要な大きさの切り物にして、切り物どうしは端材から取る（ギロチン詰め）。
+  向き2通り × 格子の寄せ4通り から最少枚数を採用。長方形なら needed_sheets と同じ枚数かそれ以下。
+- 頂点数十・数百マスで数十 ms（全面マス／外側マスは配列で判定し、境界マスだけ多角形を切り抜く）。
+"""
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from k_takeoff import MESH_H, MESH_W
+
+_EPS = 1e-9
+
+
+# -------------------------------------
+# 入力・基本図形
+# -------------------------------------
+def parse_polygons(text):
+    """「x, y」を1行1頂点、空行で区切って複数の多角形。1つ目が外周、2つ目以降が開口。"""
+    rings, cur = [], []
+    for line in unicodedata.normalize("NFKC", str(text)).splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            if cur:
+                rings.append(cur); cur = []
+            continue
+        parts = [p for p in re.split(r"[,\s]+", line) if p]
+        if len(parts) != 2:
+            raise ValueError(f"頂点は「x, y」で入力してください：{line}")
+        try:
+            cur.append((float(parts[0]), float(parts[1])))
+        except ValueError:
+            raise ValueError(f"数値ではありません：{line}") from None
+    if cur:
+        rings.append(cur)
+    if not rings:
+        raise ValueError("頂点がありません")
+    out = []
+    for r in rings:
+        p = np.asarray(r, dtype=float)
+        if len(p) > 1 and np.allclose(p[0], p[-1]):
+            p = p[:-1]  # 始点を繰り返して閉じた入力
+        if len(p) < 3:
+            raise ValueError("多角形は3頂点以上必要です")
+        out.append(p)
+    return out[0], out[1:]
+
+
+def rect_polygon(L, W):
+    return np.array([[0.0, 0.0], [L, 0.0], [L, W], [0.0, W]])
+
+
+def signed_area(p):
+    x, y = p[:, 0], p[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def net_area(outer, holes=()):
+    return abs(signed_area(outer)) - sum(abs(signed_area(h)) for h in holes)
+
+
+def offset_polygon(p, d):
+    """d>0 で内側へ、d<0 で外側へ平行移動した多角形。潰れたら None。"""
+    if d == 0:
+        return p.copy()
+    if signed_area(p) < 0:
+        p = p[::-1]
+    e = np.roll(p, -1, axis=0) - p
+    n = np.stack([-e[:, 1], e[:, 0]], axis=1) / np.linalg.norm(e, axis=1)[:, None]  # 左法線＝内側（反時計回り）
+    a = p + n * d                 # 辺 i の移動後の始点
+    prev_a, prev_e = np.roll(a, 1, axis=0), np.roll(e, 1, axis=0)
+    cross = prev_e[:, 0] * e[:, 1] - prev_e[:, 1] * e[:, 0]
+    diff = a - prev_a
+    t = np.where(np.abs(cross) > _EPS, (diff[:, 0] * e[:, 1] - diff[:, 1] * e[:, 0]) / np.where(np.abs(cross) > _EPS, cross, 1.0), 1.0)
+    q = np.where((np.abs(cross) > _EPS)[:, None], prev_a + prev_e * t[:, None], a)  # 平行な隣辺はそのまま
+    if signed_area(q) <= _EPS:
+        return None
+    return q
+
+
+def inset(outer, holes, cover_m):
+    """かぶり分：外周は内側へ、開口は外側へ。外周が潰れたら None。"""
+    o = offset_polygon(outer, cover_m)
+    if o is None:
+        return None, []
+    return o, [offset_polygon(h, -cover_m) for h in holes]
+
+
+def _clip(pts, axis, bound, keep_le):
+    # 半平面1つで切る（pts は (x, y) のリスト）
+    out = []
+    if not pts:
+        return out
+    prev = pts[-1]
+    prev_in = prev[axis] <= bound if keep_le else prev[axis] >= bound
+    for cur in pts:
+        cur_in = cur[axis] <= bound if keep_le else cur[axis] >= bound
+        if cur_in != prev_in:
+            t = (bound - prev[axis]) / (cur[axis] - prev[axis])
+            out.append((prev[0] + (cur[0] - prev[0]) * t, prev[1] + (cur[1] - prev[1]) * t))
+        if cur_in:
+            out.append(cur)
+        prev, prev_in = cur, cur_in
+    return out
+
+
+def clip_rect(p, x0, y0, x1, y1):
+    """Sutherland–Hodgman：多角形を矩形で切り抜く（凸でない多角形も可。結果は1つの輪）。"""
+    pts = [tuple(v) for v in np.asarray(p, dtype=float).tolist()]
+    for axis, bound, keep_le in ((0, x0, False), (0, x1, True), (1, y0, False), (1, y1, True)):
+        pts = _clip(pts, axis, bound, keep_le)
+    return np.asarray(pts, dtype=float).reshape(-1, 2)
+
+
+def _area(pts):
+    # リストのままの面積（絶対値）
+    n = len(pts)
+    return abs(sum(pts[i][0] * pts[(i + 1) % n][1] - pts[(i + 1) % n][0] * pts[i][1] for i in range(n))) / 2.0
+
+
+def _edges(rings):
+    a = np.concatenate([r for r in rings])
+    b = np.concatenate([np.roll(r, -1, axis=0) for r in rings])
+    return a, b
+
+
+def points_inside(pts, rings):
+    """偶奇則（開口は自動的に外）。pts は (n, 2)。"""
+    a, b = _edges(rings)
+    x, y = pts[:, 0:1], pts[:, 1:2]
+    ya, yb = a[:, 1][None, :], b[:, 1][None, :]
+    cross = (ya > y) != (yb > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xi = a[:, 0][None, :] + (y - ya) * (b[:, 0] - a[:, 0])[None, :] / (yb - ya)
+    return (np.sum(cross & (x < xi), axis=1) % 2) == 1
+
+
+# -------------------------------------
+# 鉄筋方式：走査線
+# -------------------------------------
+def scan_bars(rings, coord, pitch, axis):
+    """axis=0：x 方向の鉄筋（y=一定の走査線）、axis=1：y 方向。
+
+    coord：走査線の位置の配列。戻り値は区間長(m) の配列（1区間＝1本）。
+    """
+    a, b = _edges(rings)
+    u = 1 - axis                       # 走査線の位置を測る軸
+    ua, ub = a[:, u][None, :], b[:, u][None, :]
+    c = coord[:, None]
+    hit = (ua <= c) != (ub <= c)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        v = a[:, axis][None, :] + (c - ua) * (b[:, axis] - a[:, axis])[None, :] / (ub - ua)
+    v = np.sort(np.where(hit, v, np.nan), axis=1)
+    seg = v[:, 1::2] - v[:, 0:-1:2] if v.shape[1] > 1 else np.empty((len(coord), 0))
+    seg = seg[np.isfinite(seg)]
+    return seg[seg > _EPS]
+
+
+def scan_positions(lo, hi, pitch):
+    """端から pitch ごと（長方形の floor(幅/ピッチ)+1 本と同じ）。端の線は少し内側で切る。"""
+    n = int(np.floor((hi - lo) / pitch + _EPS)) + 1
+    c = lo + np.arange(n) * pitch
+    return np.clip(c, lo + 1e-7, hi - 1e-7)
+
+
+# -------------------------------------
+# メッシュ方式：割付け
+# -------------------------------------
+@dataclass
+class MeshLayout:
+    sheets: int = 0                 # 購入枚数（全面 + 切り物用）
+    full: int = 0                   # 全面マス
+    cut_sheets: int = 0             # 切り物を取るのに使った枚数
+    pieces: list = field(default_factory=list)  # 切り物 [(x, y, w, h)]（敷き位置）
+    full_cells: list = field(default_factory=list)  # 全面マス [(x, y, w, h)]
+    orientation: str = ""
+    sheet_w: float = MESH_W
+    sheet_h: float = MESH_H
+    area: float = 0.0               # 有効面積(㎡)
+
+    @property
+    def bought_area(self):
+        return self.sheets * self.sheet_w * self.sheet_h
+
+    @property
+    def offcut_area(self):
+        used = self.full * self.sheet_w * self.sheet_h + sum(w * h for _, _, w, h in self.pieces)
+        return max(0.0, self.bought_area - used)
+
+    @property
+    def waste_pct(self):
+        """端材率：買ったシートのうち、どこにも敷かれない切れ端の割合。"""
+        return 100.0 * self.offcut_area / self.bought_area if self.bought_area else 0.0
+
+
+def _pack(pieces, sw, sh):
+    """切り物 (w, h) をシート sw×sh にギロチンで詰める（回転可・面積の大きい順・空き矩形は面積最小の当てはめ）。
+    戻り値は使ったシート枚数。"""
+    free = []   # [(シート番号, w, h)]
+    n_sheets = 0
+    for w, h in sorted(pieces, key=lambda r: -r[0] * r[1]):
+        best = None
+        for k, (s, fw, fh) in enumerate(free):
+            for pw, ph in ((w, h), (h, w)):
+                if pw <= fw + _EPS and ph <= fh + _EPS:
+                    left = fw * fh - pw * ph
+                    if best is None or left < best[0]:
+                        best = (left, k, pw, ph)
+        if best is None:
+            pw, ph = (w, h) if (w <= sw + _EPS and h <= sh + _EPS) else (h, w)
+            free.append((n_sheets, sw, sh))
+            n_sheets += 1
+            best = (0.0, len(free) - 1, pw, ph)
+        _, k, pw, ph = best
+        s, fw, fh = free.pop(k)
+        # 短い方の辺で切る（残りの大きい矩形を残す）
+        if fw - pw > fh - ph:
+            rest = [(s, fw - pw, fh), (s, pw, fh - ph)]
+        else:
+            rest = [(s, fw, fh - ph), (s, fw - pw, ph)]
+        free.extend(r for r in rest if r[1] > _EPS and r[2] > _EPS)
+    return n_sheets
+
+
+def _grid(lo, hi, sheet, lap, align_end):
+    # 格子の原点と列数（長方形なら needed_sheets と同じ列数）。align_end=True で終端側にそろえる
+    step = max(sheet - lap, 0.01)
+    extent = hi - lo
+    n = 1 if extent <= sheet else 1 + int(np.ceil((extent - sheet) / step - _EPS))
+    cover = (n - 1) * step + sheet
+    origin = lo - (cover - extent) if align_end else lo
+    return origin, step, n
+
+
+def _layout(rings, outer, holes, sw, sh, lap_x, lap_y, align_x, align_y):
+    (xmin, ymin), (xmax, ymax) = outer.min(axis=0), outer.max(axis=0)
+    ox, sx, nx = _grid(xmin, xmax, sw, lap_x, align_x)
+    oy, sy, ny = _grid(ymin, ymax, sh, lap_y, align_y)
+
+    # 各マスが受け持つ範囲（最後の列・行だけシート幅いっぱい）
+    x0 = ox + np.arange(nx) * sx
+    x1 = np.where(np.arange(nx) == nx - 1, x0 + sw, x0 + sx)
+    y0 = oy + np.arange(ny) * sy
+    y1 = np.where(np.arange(ny) == ny - 1, y0 + sh, y0 + sy)
+    X0, Y0 = np.meshgrid(x0, y0, indexing="ij")
+    X1, Y1 = np.meshgrid(x1, y1, indexing="ij")
+
+    # 境界マス：どれかの辺が通るマス（辺の外接矩形とマスが重なるかで粗く判定）
+    a, b = _edges(rings)
+    ex0, ex1 = np.minimum(a[:, 0], b[:, 0]), np.maximum(a[:, 0], b[:, 0])
+    ey0, ey1 = np.minimum(a[:, 1], b[:, 1]), np.maximum(a[:, 1], b[:, 1])
+    touch = ((ex0[None, None, :] < X1[..., None]) & (ex1[None, None, :] > X0[..., None])
+             & (ey0[None, None, :] < Y1[..., None]) & (ey1[None, None, :] > Y0[..., None])).any(axis=-1)
+    centers = np.stack([(X0 + X1).ravel() / 2, (Y0 + Y1).ravel() / 2], axis=1)
+    inside = points_inside(centers, rings).reshape(nx, ny)
+    full = ~touch & inside
+
+    # 境界マスは切り抜いて、必要な範囲（外接矩形）を出す。行ごとに帯で切ってからマスを切る
+    outer_pts = [tuple(v) for v in outer.tolist()]
+    hole_pts = [[tuple(v) for v in h.tolist()] for h in holes]
+    need = {}
+    strips = {}
+    for i, j in zip(*np.nonzero(touch)):
+        if j not in strips:
+            strips[j] = [_clip(_clip(r, 1, Y0[0, j], False), 1, Y1[0, j], True) for r in [outer_pts, *hole_pts]]
+        cx0_, cx1_ = X0[i, j], X1[i, j]
+        c, *hc = [_clip(_clip(r, 0, cx0_, False), 0, cx1_, True) for r in strips[j]]
+        if len(c) < 3:
+            continue
+        area = _area(c) - sum(_area(h) for h in hc if len(h) >= 3)
+        if area <= 1e-6:
+            continue
+        xs, ys = [v[0] for v in c], [v[1] for v in c]
+        cx0, cx1, cy0, cy1 = min(xs), max(xs), min(ys), max(ys)
+        if cx0 - X0[i, j] < 1e-6 and X1[i, j] - cx1 < 1e-6 and cy0 - Y0[i, j] < 1e-6 and Y1[i, j] - cy1 < 1e-6 \
+                and area >= (X1[i, j] - X0[i, j]) * (Y1[i, j] - Y0[i, j]) - 1e-6:
+            full[i, j] = True
+            continue
+        need[(i, j)] = (cx0, cy0, cx1, cy1)
+
+    occupied = full.copy()
+    for i, j in need:
+        occupied[i, j] = True
+
+    # 切り物：右・上の隣マスに敷くなら重なり分を足す（左・下は隣のシートが重なってくる）
+    pieces = []
+    for (i, j), (cx0, cy0, cx1, cy1) in need.items():
+        w, h = cx1 - cx0, cy1 - cy0
+        if i < nx - 1 and X1[i, j] - cx1 < 1e-6 and occupied[i + 1, j]:
+            w += lap_x
+        if j < ny - 1 and Y1[i, j] - cy1 < 1e-6 and occupied[i, j + 1]:
+            h += lap_y
+        pieces.append((cx0, cy0, min(w, sw), min(h, sh)))
+
+    cut_sheets = _pack([(w, h) for _, _, w, h in pieces], sw, sh)
+    full_cells = [(X0[i, j], Y0[i, j], sw, sh) for i, j in zip(*np.nonzero(full))]
+    return MeshLayout(
+        sheets=int(full.sum()) + cut_sheets, full=int(full.sum()), cut_sheets=cut_sheets,
+        pieces=pieces, full_cells=full_cells, sheet_w=sw, sheet_h=sh,
+        orientation=f"{sw:g}m を X 方向" + ("・右寄せ" if align_x else "") + ("・上寄せ" if align_y else ""),
+        area=net_area(outer, holes),
+    )
+
+
+def mesh_layout(outer, holes=(), lap_x=0.15, lap_y=0.15, sheet=(MESH_W, MESH_H)):
+    """有効形状に 0.9×1.8 を敷く。向き2通り × 寄せ4通りのうち枚数（同数なら端材）が最小の割付け。"""
+    rings = [outer, *holes]
+    best = None
+    for sw, sh in (sheet, sheet[::-1]):
+        for ax in (False, True):
+            for ay in (False, True):
+                lay = _layout(rings, outer, list(holes), sw, sh, lap_x, lap_y, ax, ay)
+                if best is None or (lay.sheets, lay.offcut_area) < (best.sheets, best.offcut_area):
+                    best = lay
+    return best
+
+
+# -------------------------------------
+# まとめ（k_takeoff.rebar_mesh と同じキー）
+# -------------------------------------
+def polygon_rebar_mesh(outer, holes, cover_edge_mm, pitch_x_mm, pitch_y_mm, layers, waste, kgpm,
+                       tie_kg_per_sqm, sykoro_per_sqm_layer, mesh_lap_x, mesh_lap_y):
+    """多角形版の鉄筋方式・メッシュ方式。bars_x / bars_y（1層分の鉄筋長の配列）と layout も返す。"""
+    o, hs = inset(outer, holes, cover_edge_mm / 1000.0)
+    if o is None:
+        return {"valid": False}
+    hs = [h for h in hs if h is not None]
+    rings = [o, *hs]
+    (xmin, ymin), (xmax, ymax) = o.min(axis=0), o.max(axis=0)
+    px, py = pitch_x_mm / 1000.0, pitch_y_mm / 1000.0
+    bars_x = scan_bars(rings, scan_positions(ymin, ymax, px), px, axis=0)   # X 方向の鉄筋（Y 方向に px ごと）
+    bars_y = scan_bars(rings, scan_positions(xmin, xmax, py), py, axis=1)   # Y 方向の鉄筋（X 方向に py ごと）
+    A_eff = net_area(o, hs)
+    total_m = (bars_x.sum() + bars_y.sum()) * layers * (1.0 + waste / 100.0)
+    layout = mesh_layout(o, hs, mesh_lap_x, mesh_lap_y)
+    return {
+        "valid": A_eff > 0,
+        "outer": o, "holes": hs, "A_eff": A_eff,
+        "n_x": len(bars_x), "n_y": len(bars_y), "bars_x": bars_x, "bars_y": bars_y,
+        "total_m": total_m, "total_kg": total_m * kgpm,
+        "tie_kg": A_eff * tie_kg_per_sqm * layers,
+        "sykoro_pcs": int(np.ceil(A_eff * sykoro_per_sqm_layer * layers)),
+        "mesh_sheets": layout.sheets * layers,
+        "layout": layout,
+    }
@@ -0,0 +1,1019 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜価格エンジン（列演算版）
+- 伝票単価 → 基準単位単価（price_per_base）への正規化を DataFrame 一括で行う。
+  換算は単位グラフ（k_units.UnitGraph）で、商品・伝票単位・径 の組ごとに1回だけ経路を引いて配列で掛ける。
+- 商品ごとの ◎〇▲（採用/最新/平均）を1回のグループ集計で求め、商品一覧（TABLE）を作る。
+- 商品ID → 採用単価・注記 の索引（PriceIndex）。拾い各フォームで共通に使う（1件/一括）。
+- 仕入履歴の索引（HistoryIndex）。商品ごとの行範囲で、開いた商品の分だけ切り出す。
+- 任意の日時点の採用単価（AsOfPriceIndex）。商品ごとに日付順に並べて二分探索、何日分でも一括。
+- 商品×仕入先 の最新単価・最終日・件数（VendorPriceMatrix）。新しい行は当たったセルだけ更新。
+- 商品ごとの推移（直近 N 件の移動平均・中央値・前回比・変動率）と、最新伝票が直前の中央値から外れた品のアラート。
+  1回の並べ替え＋配列演算で全商品分。直近 N 件の中央値は採用ポリシー（MEDIAN_POLICY）にもなる。
+- 生データ→期間抽出→NORM→TABLE の各段を（データ版, 期間, ポリシー）で LRU キャッシュする。
+  キャッシュはスレッド安全で、同じキーの同時ミスは1回だけ計算（画面では全セッションで1つを共有）。
+- 行単位の normalize_price / adopt_price は照合用の基準実装として残す（結果は一致させること）。
+- Streamlit には依存しない（CLI・ベンチから import 可）。
+"""
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+from k_units import as_unit_graph
+
+# 価格履歴の列（伝票1行＝1レコード）
+PRICE_COLUMNS = [
+    "date","vendor","item_id","standard","diameter","invoice_unit","unit_price","qty_per_invoice_unit","source"
+]
+
+# 「直近中央値」ポリシー・推移の既定件数（伝票の件数で数える）
+RECENT_N = 5
+MEDIAN_POLICY = f"直近{RECENT_N}件の中央値"
+
+# 採用ポリシー（サイドバーの選択肢と同じ並び）
+POLICIES = ["高い方（値上がり優先）","最新日付","期間平均",MEDIAN_POLICY]
+
+# 商品一覧（TABLE）の列
+TABLE_COLUMNS = ["商品ID","カテゴリ","商品名","規格/仕様","基準単位","◎ 採用単価","〇 最新単価","▲ 期間平均","採用注記"]
+
+
+# -------------------------------------
+# 行単位（基準実装）
+# -------------------------------------
+# 単価をベース単位に正規化（換算の経路は units：k_units.UnitGraph。dict なら 径→kg/m だけ）
+# - 鉄筋(m基準): 円/kg→円/m（×kg/m）、t→kg→m も同じグラフで
+# - 箱/束: 入数で按分して本単価に統一（商品マスタの入数を優先、無ければ伝票の入数）
+# - その他：units.csv の辺（t↔kg、かさ比重 t↔m3、ケース入数 …）
+
+def normalize_price(row, items_d, units):
+    item_id = row["item_id"]
+    meta = items_d.get(item_id)
+    if meta is None:
+        return np.nan, "未登録商品"
+    inv_unit = str(row["invoice_unit"]) if row["invoice_unit"] is not None else ""
+    price = float(row["unit_price"]) if row["unit_price"] is not None else np.nan
+    dia = str(row.get("diameter") or "")
+    qpu = row["qty_per_invoice_unit"]
+    return as_unit_graph(units).convert(price, item_id, meta["category"], meta["base_unit"], meta["units_per_box"],
+                                        inv_unit, dia, qty=qpu)
+
+
+def adopt_price(group_df, policy):
+    df = group_df.dropna(subset=["price_per_base"])  # 正規化済
+    if df.empty:
+        return np.nan, "データなし", None
+
+    if policy == "高い方（値上がり優先）":
+        idx = df["price_per_base"].idxmax()
+        r = df.loc[idx]
+        return float(r["price_per_base"]), f"高値採用｜{r['vendor']}｜{r['date'].date()}｜{r['source']}", r
+    elif policy == "最新日付":
+        lastd = df["date"].max()
+        last = df[df["date"]==lastd]
+        idx = last["price_per_base"].idxmax()
+        r = last.loc[idx]
+        return float(r["price_per_base"]), f"最新採用｜{r['vendor']}｜{r['date'].date()}｜{r['source']}", r
+    elif policy == MEDIAN_POLICY:
+        recent = df.sort_values("date", kind="stable", na_position="first").tail(RECENT_N)
+        return float(np.round(recent["price_per_base"].median(),1)), f"直近中央値（{len(recent)}件）", None
+    else:  # 期間平均
+        return float(np.round(df["price_per_base"].mean(),1)), f"期間平均（{len(df)}件）", None
+
+
+# -------------------------------------
+# 列演算（本番用）
+# -------------------------------------
+def _factorize(values):
+    codes, uniq = pd.factorize(values)
+    return codes, list(uniq)
+
+
+def normalize_prices(df, items, units):
+    """価格履歴 df を一括正規化し、price_per_base（小数1位丸め）と detail を付けて返す。
+
+    items は item_id を index に持つ商品マスタ（category / base_unit / units_per_box）。
+    units は単位グラフ（k_units.UnitGraph。dict なら 径→kg/m だけのグラフ）。
+    マスタに無い item_id は NaN ＋「未登録商品」。換算できない単位は NaN ＋「未対応(伝票単位→基準単位)」。
+    換算が同じになる商品（商品別の辺が無ければ カテゴリ×基準単位×入数）・伝票単位・径 の組ごとに1回だけ経路を引き、
+    行には 分子/分母（と伝票の入数）を配列で掛ける。
+    """
+    graph = as_unit_graph(units)
+    out = df.reset_index(drop=True).copy()
+    if out.empty:
+        out["price_per_base"] = pd.Series(dtype=float)
+        out["detail"] = pd.Series(dtype=object)
+        return out
+
+    item_c, item_u = _factorize(out["item_id"])
+    inv_c, inv_names = _factorize(out["invoice_unit"].fillna("").astype(str))
+    dia_c, dia_names = _factorize(out["diameter"].fillna("").astype(str))
+    pos = items.index.get_indexer(pd.Index(item_u, dtype=object))
+    meta = items.iloc[np.where(pos >= 0, pos, 0)]
+
+    # 換算が同じになる商品をまとめる：商品別の辺がある品だけ商品IDで分け、他は カテゴリ×基準単位×入数
+    item_arr = np.asarray(item_u, dtype=object)
+    prof = pd.DataFrame({
+        "known": pos >= 0,
+        "own": np.where(np.isin(item_arr, list(graph.item_keys)), item_arr, ""),
+        "category": meta["category"].astype(object).to_numpy(),
+        "base_unit": meta["base_unit"].astype(object).to_numpy(),
+        "upb": pd.to_numeric(meta["units_per_box"], errors="coerce").to_numpy(float),
+    })
+    prof_c = prof.groupby(list(prof.columns), sort=False, dropna=False).ngroup().to_numpy()
+    rep = np.unique(prof_c, return_index=True)[1]   # 各まとまりの代表の商品
+
+    # 組（まとまり, 伝票単位, 径）ごとに換算を1回だけ引く
+    key = (prof_c[item_c].astype(np.int64) * len(inv_names) + inv_c) * len(dia_names) + dia_c
+    inverse, combo = pd.factorize(key)
+    k_prof, rest = np.divmod(combo, len(inv_names) * len(dia_names))
+    k_inv, k_dia = np.divmod(rest, len(dia_names))
+    num, den, qnum, qden = (np.full(len(combo), np.nan) for _ in range(4))
+    notes = [""] * (2 * len(combo))   # 組ごとに [直接の換算, 伝票の入数で按分]
+    for j, (g, u, d) in enumerate(zip(k_prof, k_inv, k_dia)):
+        i = rep[g]
+        if pos[i] < 0:
+            notes[2 * j] = notes[2 * j + 1] = "未登録商品"
+            continue
+        r = prof.iloc[i]
+        num[j], den[j], notes[2 * j], qnum[j], qden[j], notes[2 * j + 1] = graph.resolve(
+            item_arr[i], r["category"], r["base_unit"], None if np.isnan(r["upb"]) else r["upb"],
+            inv_names[u], dia_names[d])
+
+    price = pd.to_numeric(out["unit_price"], errors="coerce").to_numpy(float)
+    qpu = pd.to_numeric(out["qty_per_invoice_unit"], errors="coerce").to_numpy(float)
+    direct = ~np.isnan(num[inverse])
+    via_qty = ~direct & ~np.isnan(qnum[inverse]) & (qpu > 0)
+
+    p = np.full(len(out), np.nan)
+    p[direct] = price[direct] * num[inverse[direct]] / den[inverse[direct]]
+    p[via_qty] = price[via_qty] * qnum[inverse[via_qty]] / (qden[inverse[via_qty]] * qpu[via_qty])
+
+    out["price_per_base"] = np.round(p, 1)
+    # 注記は組の数しか種類がないので、小さな文字列配列から取り出す
+    out["detail"] = pd.array(notes, dtype="str").take(inverse * 2 + via_qty)
+    return out
+
+
+def _first_where(mask, codes, n_groups):
+    # グループごとに mask が立つ最初の行位置（無ければ -1）
+    pos = np.arange(len(codes))
+    first = np.full(n_groups, len(codes))
+    np.minimum.at(first, codes[mask], pos[mask])
+    return np.where(first < len(codes), first, -1)
+
+
+def _recent(p, last, first, n):
+    # p[last - k]（k = 0..n-1）を最後の軸に並べる。first より前（別の商品・範囲外）は NaN
+    # last / first は同じ形の行位置の配列。p は商品→日付の順に並んでいること
+    k = np.arange(n)
+    idx = np.asarray(last)[..., None] - k
+    out = p[np.clip(idx, 0, max(len(p) - 1, 0))] if len(p) else np.full(idx.shape, np.nan)
+    out[idx < np.asarray(first)[..., None]] = np.nan
+    return out
+
+
+def _nan_median(v):
+    # 最後の軸の中央値（NaN は除く・全部 NaN なら NaN）。偶数件は中央2つの平均（Series.median と同じ）
+    s = np.sort(v, axis=-1)   # NaN は後ろへ
+    k = (~np.isnan(s)).sum(axis=-1)
+    lo = np.take_along_axis(s, np.maximum(k - 1, 0)[..., None] // 2, axis=-1)[..., 0]
+    hi = np.take_along_axis(s, (k // 2)[..., None], axis=-1)[..., 0]
+    return np.where(k > 0, (lo + hi) / 2, np.nan)
+
+
+def _provenance(rows, label):
+    return (label + "｜" + rows["vendor"].astype(str) + "｜" + rows["date"].dt.strftime("%Y-%m-%d")
+            + "｜" + rows["source"].astype(str))
+
+
+def adopt_prices(norm):
+    """正規化済み履歴から商品ごとの採用候補を1パスで集計する（item_id を index に持つ DataFrame）。
+
+    - 高値：price_per_base 最大の行（同値は先に出た行）
+    - 最新：日付最大の行、同日複数なら高値（adopt_price の「最新日付」と同じ）
+    - 平均：小数1位丸めの平均と件数
+    - 直近中央値：日付順（同日は元の順）で最後の RECENT_N 件の中央値（小数1位丸め）
+    各採用行の注記（仕入先｜日付｜伝票）も付ける。
+    """
+    df = norm.loc[norm["price_per_base"].notna(), ["item_id","date","vendor","source","price_per_base"]]
+    df = df.reset_index(drop=True)
+    cols = ["price_max","note_max","price_latest","note_latest","price_avg","note_avg","price_median","note_median","n"]
+    if df.empty:
+        return pd.DataFrame(columns=cols, index=pd.Index([], name="item_id"))
+
+    item_c, item_u = pd.factorize(df["item_id"])
+    G = len(item_u)
+    price = df["price_per_base"].to_numpy(float)
+    d = df["date"].to_numpy("datetime64[ns]").view("int64")
+    d = np.where(df["date"].isna().to_numpy(), np.iinfo(np.int64).min + 1, d)
+
+    # 高値：最大値に一致する最初の行
+    p_max = np.full(G, -np.inf)
+    np.maximum.at(p_max, item_c, price)
+    hi = _first_where(price == p_max[item_c], item_c, G)
+
+    # 最新：最終日の行の中で最大値に一致する最初の行
+    d_max = np.full(G, np.iinfo(np.int64).min)
+    np.maximum.at(d_max, item_c, d)
+    on_last = d == d_max[item_c]
+    p_last = np.full(G, -np.inf)
+    np.maximum.at(p_last, item_c[on_last], price[on_last])
+    lt = _first_where(on_last & (price == p_last[item_c]), item_c, G)
+
+    # 平均（各商品は 1 行以上あるので区切りは狭義増加）
+    n = np.bincount(item_c, minlength=G)
+    by_item = price[np.argsort(item_c, kind="stable")]
+    bounds = np.r_[0, np.cumsum(n)]
+    avg = np.add.reduceat(by_item, bounds[:-1]) / n
+    # 0.05 の丸め境界の近くだけは Series.mean と同じ足し順で出し直す（adopt_price と一致させる）
+    frac = avg * 10 % 1
+    for g in np.flatnonzero(np.abs(frac - 0.5) < 1e-6):
+        avg[g] = by_item[bounds[g]:bounds[g + 1]].sum() / n[g]
+
+    # 直近中央値：商品→日付の順に並べ、各商品の最後の RECENT_N 行
+    by_date = price[np.lexsort((d, item_c))]
+    med = _nan_median(_recent(by_date, bounds[1:] - 1, bounds[:-1], RECENT_N))
+
+    out = pd.DataFrame({
+        "price_max": price[hi],
+        "note_max": _provenance(df.iloc[hi], "高値採用").to_numpy(),
+        "price_latest": price[lt],
+        "note_latest": _provenance(df.iloc[lt], "最新採用").to_numpy(),
+        "price_avg": np.round(avg, 1),
+        "price_median": np.round(med, 1),
+        "n": n,
+    }, index=pd.Index(np.asarray(item_u, dtype=object), name="item_id"))
+    out["note_avg"] = "期間平均（" + out["n"].astype(str) + "件）"
+    out["note_median"] = "直近中央値（" + np.minimum(out["n"], RECENT_N).astype(str) + "件）"
+    return out[cols]
+
+
+def build_price_table(norm, items, policy, adopted=None):
+    """商品マスタ全件について ◎〇▲ をまとめた商品一覧（TABLE）を返す。
+
+    adopted に adopt_prices の結果を渡せば集計を使い回す（ポリシー切替時など）。
+    """
+    if adopted is None:
+        adopted = adopt_prices(norm)
+    a = adopted.reindex(items.index)
+    if policy == "高い方（値上がり優先）":
+        p, note = a["price_max"], a["note_max"]
+    elif policy == "最新日付":
+        p, note = a["price_latest"], a["note_latest"]
+    elif policy == MEDIAN_POLICY:
+        p, note = a["price_median"], a["note_median"]
+    else:  # 期間平均
+        p, note = a["price_avg"], a["note_avg"]
+
+    table = pd.DataFrame({
+        "商品ID": items.index.to_numpy(),
+        "カテゴリ": items["category"].to_numpy(),
+        "商品名": items["name"].to_numpy(),
+        "規格/仕様": items["spec"].to_numpy(),
+        "基準単位": items["base_unit"].to_numpy(),
+        "◎ 採用単価": p.to_numpy(float),
+        "〇 最新単価": a["price_latest"].to_numpy(float),
+        "▲ 期間平均": a["price_avg"].to_numpy(float),
+        "採用注記": note.fillna("データなし").to_numpy(object),
+    })
+    return table.sort_values(["カテゴリ","商品名","規格/仕様"]).reset_index(drop=True)
+
+
+# -------------------------------------
+# 採用単価の索引
+# -------------------------------------
+class PriceIndex:
+    """商品ID → (◎ 採用単価, 採用注記)。TABLE の版ごとに1回だけ作り、引くのは辞書1回。
+
+    採用単価が無い（データなし/未登録）商品は「欠品」として扱い、0円にはしない。
+    """
+
+    def __init__(self, table):
+        priced = table["◎ 採用単価"].notna()
+        self._price = dict(zip(table.loc[priced, "商品ID"], table.loc[priced, "◎ 採用単価"].astype(float)))
+        self._note = dict(zip(table["商品ID"], table["採用注記"]))
+
+    def __contains__(self, item_id):
+        return item_id in self._price
+
+    def __len__(self):
+        return len(self._price)
+
+    def get(self, item_id):
+        """(単価, 注記)。単価が無ければ None。"""
+        p = self._price.get(item_id)
+        return None if p is None else (p, self._note[item_id])
+
+    def price(self, item_id, default=None):
+        return self._price.get(item_id, default)
+
+    def lookup(self, quantities):
+        """{商品ID: 数量} をまとめて値付けし、(明細 DataFrame, 欠品の商品ID リスト) を返す。
+
+        明細の列：商品ID / 数量 / 単価 / 金額 / 採用注記（欠品は単価・金額 NaN）。
+        """
+        lines = self.price_lines(pd.DataFrame({"商品ID": list(quantities),
+                                               "数量": [float(q) for q in quantities.values()]}))
+        missing = lines.loc[lines["単価"].isna(), "商品ID"].tolist()
+        return lines, missing
+
+    def price_lines(self, lines):
+        """商品ID・数量 列を持つ明細（何行でも）に 単価 / 金額 / 採用注記 を付けて返す。"""
+        codes, uniq = pd.factorize(lines["商品ID"])
+        price = pd.Series(uniq).map(self._price).to_numpy(dtype=float)
+        note = pd.Series(uniq).map(self._note).fillna("未登録商品").to_numpy(dtype=object)
+        lines = lines.copy()
+        lines["単価"] = price[codes]
+        lines["金額"] = lines["数量"].to_numpy(dtype=float) * lines["単価"].to_numpy()
+        lines["採用注記"] = note[codes]
+        return lines
+
+
+# -------------------------------------
+# 仕入履歴の索引（画面の履歴表示用）
+# -------------------------------------
+# 履歴表示の列（NORM の列 → 表示名）
+HISTORY_COLUMNS = {
+    "date":"日付","vendor":"仕入先","invoice_unit":"伝票単位","unit_price":"単価","qty_per_invoice_unit":"入数",
+    "standard":"規格","diameter":"径","price_per_base":"基準単価","detail":"換算","source":"伝票",
+}
+
+
+class HistoryIndex:
+    """NORM を（商品, 日付, 仕入先）順に1回並べ、商品ごとの行範囲を持つ。
+
+    商品は商品一覧（TABLE）と同じ並びに番号を振り、カテゴリ・仕入先の絞り込みはその番号の配列演算で行う。
+    1商品の履歴は行範囲の切り出し＋日付の二分探索で取るので、表示のたびに NORM 全体を走査しない。
+    """
+
+    def __init__(self, norm, items):
+        df = norm.reset_index(drop=True)
+        # 商品の並び：カテゴリ → 商品名 → 規格。マスタに無い商品（履歴だけある）は末尾
+        catalog = items.sort_values(["category","name","spec"], kind="stable")
+        extra = pd.Index(df["item_id"].unique()).difference(catalog.index)
+        self._ids = np.concatenate([catalog.index.to_numpy(object), extra.to_numpy(object)])
+        pos = pd.Index(self._ids).get_indexer(df["item_id"])
+        vcode, vendors = pd.factorize(df["vendor"].astype(str).to_numpy(), sort=True)
+        self._vendors = pd.Index(vendors)
+
+        order = np.lexsort((vcode, df["date"].to_numpy("datetime64[ns]"), pos))
+        self._rows = df.iloc[order].reset_index(drop=True)
+        self._dates = self._rows["date"].to_numpy("datetime64[ns]")
+        self._vcode = vcode[order]
+        self._price = self._rows["price_per_base"].to_numpy(float)
+        spos = pos[order]
+        n = len(self._ids)
+        self._lo = np.searchsorted(spos, np.arange(n), side="left")
+        self._hi = np.searchsorted(spos, np.arange(n), side="right")
+        self._where = dict(zip(self._ids, range(n)))
+
+        self._has_vendor = np.zeros((len(self._vendors), n), dtype=bool)   # [仕入先, 商品]
+        self._has_vendor[self._vcode, spos] = True
+        cat = catalog["category"].astype(str).to_numpy()
+        self._cat_code, cats = pd.factorize(np.concatenate([cat, np.full(len(extra), "")]), sort=True)
+        self._categories = pd.Index(cats)
+        self._meta = items.reindex(self._ids)
+
+    @property
+    def vendors(self):
+        return list(self._vendors)
+
+    @property
+    def categories(self):
+        return [c for c in self._categories if c]
+
+    def item_ids(self, category=None, vendor=None, with_history=False):
+        """条件に合う商品ID（商品一覧の並び）。vendor を指定すればその仕入先の伝票がある商品だけ。"""
+        keep = np.ones(len(self._ids), dtype=bool)
+        if category is not None:
+            keep &= self._cat_code == (self._categories.get_loc(category) if category in self._categories else -2)
+        if vendor is not None:
+            keep &= self._has_vendor[self._vendors.get_loc(vendor)] if vendor in self._vendors else False
+        if with_history:
+            keep &= self._hi > self._lo
+        return self._ids[keep].tolist()
+
+    def _slice(self, item_id, vendor, start, end):
+        # 1商品の行位置（日付は両端含む・仕入先で絞る）
+        k = self._where.get(item_id)
+        if k is None:
+            return np.empty(0, dtype=np.int64)
+        lo, hi = int(self._lo[k]), int(self._hi[k])
+        if start is not None:
+            lo += int(np.searchsorted(self._dates[lo:hi], np.datetime64(pd.Timestamp(start)), side="left"))
+        if end is not None:
+            hi = lo + int(np.searchsorted(self._dates[lo:hi], np.datetime64(pd.Timestamp(end)), side="right"))
+        idx = np.arange(lo, max(lo, hi))
+        if vendor is not None:
+            v = self._vendors.get_loc(vendor) if vendor in self._vendors else -1
+            idx = idx[self._vcode[idx] == v]
+        return idx
+
+    def rows(self, item_id, vendor=None, start=None, end=None):
+        """1商品の履歴（日付・仕入先順。表示名の列）。"""
+        g = self._rows.iloc[self._slice(item_id, vendor, start, end)]
+        return g[list(HISTORY_COLUMNS)].rename(columns=HISTORY_COLUMNS)
+
+    def summary(self, item_ids, vendor=None, start=None, end=None):
+        """商品ごとの 件数 / 仕入先数 / 最終日 / 最新の基準単価（渡した商品だけ計算する）。"""
+        n, nv, last_d, last_p = [], [], [], []
+        for iid in item_ids:
+            idx = self._slice(iid, vendor, start, end)
+            n.append(len(idx))
+            nv.append(len(np.unique(self._vcode[idx])))
+            last_d.append(self._dates[idx[-1]] if len(idx) else np.datetime64("NaT"))
+            last_p.append(self._price[idx[-1]] if len(idx) else np.nan)
+        meta = self._meta.reindex(list(item_ids))
+        return pd.DataFrame({
+            "商品ID": list(item_ids),
+            "カテゴリ": meta["category"].fillna("").to_numpy(),
+            "商品名": meta["name"].fillna(pd.Series(list(item_ids), index=meta.index)).to_numpy(),
+            "規格/仕様": meta["spec"].fillna("").to_numpy(),
+            "件数": np.asarray(n, dtype=np.int64),
+            "仕入先数": np.asarray(nv, dtype=np.int64),
+            "最終日": pd.to_datetime(np.asarray(last_d, dtype="datetime64[ns]")),
+            "最新の基準単価": np.asarray(last_p, dtype=float),
+        })
+
+
+# -------------------------------------
+# 時点指定（as-of）の採用単価
+# -------------------------------------
+_DAY_SHIFT = 1 << 32     # キー = 商品番号 × 2^32 + (日番号 + 2^31)
+_DAY_BIAS = 1 << 31
+
+
+class AsOfPriceIndex:
+    """価格履歴全体から「ある日時点」の採用単価を引く索引（何日分でも1回の配列演算）。
+
+    履歴は（商品, 日）ごとに 最高値・合計・件数 へ畳み、(商品, 日) の昇順に並べる。
+    d 日時点の対象は d 日以前（window_days を渡せば直近 window_days 日）の行で、範囲は二分探索で求める。
+    - 最新日付：範囲の最後の日の最高値
+    - 高い方　：範囲の最高値（スパーステーブルで O(1)。初回だけ作る）
+    - 期間平均：累積和の差 ÷ 件数（小数1位丸め。price_per_base は 0.1 円単位なので和は整数で持つ）
+    - 直近中央値：範囲の最後の RECENT_N 行（日付順・同日は元の順）の中央値
+    日付は日単位（同じ日の伝票は同じ日として扱う）。
+    """
+
+    def __init__(self, norm):
+        df = norm.loc[norm["price_per_base"].notna() & norm["date"].notna(),
+                      ["item_id","date","vendor","source","price_per_base"]].reset_index(drop=True)
+        code, uniq = pd.factorize(df["item_id"])
+        self._code = {iid: k for k, iid in enumerate(uniq)}
+        day = df["date"].to_numpy("datetime64[D]").astype(np.int64)
+        price = df["price_per_base"].to_numpy(float)
+
+        # （商品, 日）で並べ、同じ組をまとめる（同値は元の並び順を保つ）
+        order = np.lexsort((np.arange(len(df)), day, code))
+        key = code[order].astype(np.int64) * _DAY_SHIFT + (day[order] + _DAY_BIAS)
+        p = price[order]
+        start = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])[:len(key)]
+        size = np.diff(np.r_[start, len(p)])
+        self._keys = key[start]
+        self._rows = df
+        self._sparse = None
+        self._order, self._bounds = order, np.r_[start, len(p)]   # 組 g の行は order[bounds[g]:bounds[g+1]]
+        self._sorted = p                                            # 商品→日付 の順の単価（直近中央値用）
+        if not len(p):
+            self._max, self._row = np.empty(0), np.empty(0, dtype=np.int64)
+            self._csum, self._ccnt = np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+            return
+        gmax = np.maximum.reduceat(p, start)
+        gid = np.repeat(np.arange(len(start)), size)
+        self._max = gmax
+        self._row = order[_first_where(p == gmax[gid], gid, len(start))]   # 同じ日の最高値の行
+        # 平均用の累積和は 0.1 円単位の整数で持つ（差をとっても丸め境界がずれない）
+        self._csum = np.r_[0, np.cumsum(np.add.reduceat(np.round(p * 10).astype(np.int64), start))]
+        self._ccnt = np.r_[0, np.cumsum(size)]
+
+    def __len__(self):
+        return len(self._code)
+
+    def __contains__(self, item_id):
+        return item_id in self._code
+
+    @property
+    def date_range(self):
+        """履歴の最初と最後の日（無ければ NaT）。"""
+        if not len(self._rows):
+            return pd.NaT, pd.NaT
+        return self._rows["date"].min(), self._rows["date"].max()
+
+    def _range_max(self, lo, hi):
+        # [lo, hi) の最高値の位置（同値は元の行順で先の方。adopt_price の idxmax と同じ）。スパーステーブルは初回だけ作る
+        # （共有中に2セッションが同時に作っても中身は同じで、代入は1回なので壊れない）
+        if self._sparse is None:
+            levels = [np.arange(len(self._max), dtype=np.int32)]
+            k = 1
+            while 2 * k <= len(self._max):
+                prev = levels[-1]
+                levels.append(self._better(prev[:-k], prev[k:]))
+                k *= 2
+            self._sparse = levels
+        n = np.maximum(hi - lo, 1)
+        lvl = np.floor(np.log2(n)).astype(np.int64)
+        out = np.empty(lo.shape, dtype=np.int64)
+        for k in np.unique(lvl):
+            m = lvl == k
+            table = self._sparse[k]
+            a = table[np.minimum(lo[m], len(table) - 1)]
+            b = table[np.minimum(hi[m] - (1 << int(k)), len(table) - 1)]
+            out[m] = self._better(a, b)
+        return out
+
+    def _better(self, a, b):
+        # 組 a・b のうち 最高値が高い方（同値なら代表行が元の行順で先の方）
+        mx, row = self._max, self._row
+        return np.where((mx[b] > mx[a]) | ((mx[b] == mx[a]) & (row[b] < row[a])), b, a)
+
+    def _query(self, item_ids, dates, policy, window_days=None):
+        # → (単価 [日付, 商品], 代表行の位置 [日付, 商品]（無ければ -1）, 件数 [日付, 商品])
+        days = pd.to_datetime(pd.Index(dates)).to_numpy("datetime64[D]").astype(np.int64)
+        codes = np.array([self._code.get(i, -1) for i in item_ids], dtype=np.int64)
+        base = np.where(codes >= 0, codes, 0) * _DAY_SHIFT
+        hi = np.searchsorted(self._keys, base[None, :] + (days[:, None] + _DAY_BIAS), side="right")
+        if window_days is None:
+            lo = np.broadcast_to(np.searchsorted(self._keys, base, side="left")[None, :], hi.shape)
+        else:
+            lo = np.searchsorted(self._keys, base[None, :] + (days[:, None] - int(window_days) + _DAY_BIAS),
+                                 side="right")
+        lo = np.minimum(lo, hi)
+        has = (hi > lo) & (codes >= 0)[None, :]
+        n = np.where(has, self._ccnt[hi] - self._ccnt[lo], 0)
+        if not has.any():
+            return np.full(hi.shape, np.nan), np.full(hi.shape, -1), n
+        if policy == "最新日付":
+            g = np.where(has, hi - 1, 0)
+        elif policy == "高い方（値上がり優先）":
+            g = self._range_max(np.where(has, lo, 0), np.where(has, hi, 1))
+        elif policy == MEDIAN_POLICY:
+            recent = _recent(self._sorted, self._bounds[hi] - 1, self._bounds[lo], RECENT_N)
+            price = np.round(_nan_median(recent), 1)
+            return np.where(has, price, np.nan), np.full(hi.shape, -1), np.minimum(n, RECENT_N)
+        else:  # 期間平均
+            total = self._csum[hi] - self._csum[lo]
+            d = np.maximum(n, 1)
+            price = np.round(total / (d * 10.0), 1)
+            # ちょうど 0.05 の丸め境界だけは adopt_price と同じ足し順（元の行順）で出し直す
+            tie = has & ((total * 10) % d == 0) & ((total * 10 // d) % 10 == 5)
+            for k in zip(*np.nonzero(tie)):
+                rows = np.sort(self._order[self._bounds[lo[k]]:self._bounds[hi[k]]])
+                price[k] = np.round(self._rows["price_per_base"].to_numpy()[rows].sum() / n[k], 1)
+            return np.where(has, price, np.nan), np.full(hi.shape, -1), n
+        return np.where(has, self._max[g], np.nan), np.where(has, self._row[g], -1), n
+
+    def prices(self, item_ids, dates, policy, window_days=None):
+        """商品 × 日付 の採用単価表（index=日付, columns=商品ID。単価が無ければ NaN）。"""
+        item_ids = list(item_ids)
+        price, _, _ = self._query(item_ids, dates, policy, window_days)
+        return pd.DataFrame(price, index=pd.DatetimeIndex(pd.to_datetime(pd.Index(dates)), name="date"),
+                            columns=pd.Index(item_ids, name="item_id"))
+
+    def lookup(self, quantities, date, policy, window_days=None):
+        """PriceIndex.lookup の時点指定版：{商品ID: 数量} → (明細 DataFrame, 欠品の商品ID リスト)。"""
+        item_ids = list(quantities)
+        price, row, n = self._query(item_ids, [date], policy, window_days)
+        label = {"最新日付": "最新採用", "高い方（値上がり優先）": "高値採用"}.get(policy)
+        if label is None:
+            head = "直近中央値" if policy == MEDIAN_POLICY else "期間平均"
+            notes = [f"{head}（{int(k)}件）" if k else "データなし" for k in n[0]]
+        else:
+            r = row[0]
+            prov = _provenance(self._rows.iloc[r[r >= 0]], label).to_numpy() if (r >= 0).any() else []
+            notes = np.full(len(item_ids), "データなし", dtype=object)
+            notes[r >= 0] = prov
+        lines = pd.DataFrame({"商品ID": item_ids, "数量": [float(q) for q in quantities.values()],
+                              "単価": price[0], "採用注記": notes})
+        lines["金額"] = lines["数量"] * lines["単価"]
+        lines = lines[["商品ID","数量","単価","金額","採用注記"]]
+        return lines, lines.loc[lines["単価"].isna(), "商品ID"].tolist()
+
+    def cost_series(self, quantities, dates, policy, window_days=None):
+        """見積（{商品ID: 数量}）の日付ごとの原価（index=日付、列：小計 / 単価なし）。単価が無い品は小計に含めない。"""
+        item_ids = list(quantities)
+        qty = np.array([float(q) for q in quantities.values()])
+        price, _, _ = self._query(item_ids, dates, policy, window_days)
+        priced = ~np.isnan(price)
+        return pd.DataFrame({
+            "小計": np.where(priced, price, 0.0) @ qty if len(qty) else np.zeros(len(price)),
+            "単価なし": (~priced).sum(axis=1),
+        }, index=pd.DatetimeIndex(pd.to_datetime(pd.Index(dates)), name="date"))
+
+
+# -------------------------------------
+# 推移（直近 N 件の移動統計）・急変アラート
+# -------------------------------------
+ROLLING_COLUMNS = ["商品ID","日付","仕入先","伝票","基準単価","移動平均","移動中央値","前回比(%)","変動率(%)","乖離(%)"]
+TREND_COLUMNS = ["商品ID","件数","最終日","仕入先","伝票","最新単価","前回単価","前回比(%)","移動平均","直近中央値",
+                 "変動率(%)","乖離(%)"]
+ALERT_COLUMNS = ["商品ID","判定","最終日","仕入先","伝票","前回単価","最新単価","直近中央値","乖離(%)","件数"]
+
+_ROLL_CHUNK = 1 << 20   # 窓の行列を作る行数の上限（メモリを抑える）
+
+
+def _pct(a, b):
+    # (a / b - 1) × 100（b が 0 以下・NaN なら NaN）
+    ok = b > 0
+    return np.where(ok, (a / np.where(ok, b, 1.0) - 1.0) * 100.0, np.nan)
+
+
+def _sorted_history(norm):
+    # 正規化できた行と、商品→日付（同日は元の順）の並び順・その順の単価・各行の商品の先頭位置・各商品の先頭位置
+    # 並べ替えるのは数値の配列だけ（文字列の列は呼び出し側で要る行だけ取り出す）
+    df = norm.loc[norm["price_per_base"].notna() & norm["date"].notna(),
+                  ["item_id","date","vendor","source","price_per_base"]].reset_index(drop=True)
+    code = pd.factorize(df["item_id"])[0]
+    d = df["date"].to_numpy("datetime64[ns]").view("int64")
+    order = np.lexsort((d, code))
+    code = code[order]
+    start = np.flatnonzero(np.r_[True, code[1:] != code[:-1]]) if len(df) else np.empty(0, dtype=np.int64)
+    first = np.repeat(start, np.diff(np.r_[start, len(df)]))
+    return df, order, df["price_per_base"].to_numpy(float)[order], first, start
+
+
+def _take(df, rows, columns):
+    # df の rows 行（位置）を、列の型のまま新しい列名で
+    return {new: df[old].iloc[rows].reset_index(drop=True) for new, old in columns.items()}
+
+
+def _window_stats(p, rows, first, n):
+    # rows 行それぞれについて、その行までの直近 n 件の統計（dict of 配列）
+    w = _recent(p, rows, first, n + 1)           # [:, 0] が当の行、[:, 1:] がそれより前
+    cur, win, prev = w[:, 0], w[:, :n], w[:, 1:]
+    cnt = (~np.isnan(win)).sum(axis=1)
+    chg = _pct(w[:, :-1], w[:, 1:])              # 1件ごとの前回比（窓の中の n-1 個を使う）
+    chg = chg[:, :max(n - 1, 1)]
+    k = (~np.isnan(chg)).sum(axis=1)
+    mean_chg = np.nansum(chg, axis=1) / np.maximum(k, 1)
+    var = np.nansum((chg - mean_chg[:, None]) ** 2, axis=1) / np.maximum(k - 1, 1)
+    return {
+        "移動平均": np.round(np.nansum(win, axis=1) / np.maximum(cnt, 1), 1),
+        "移動中央値": np.round(_nan_median(win), 1),
+        "前回比(%)": np.round(_pct(cur, w[:, 1]), 1),
+        "変動率(%)": np.round(np.where(k >= 2, np.sqrt(var), np.nan), 1),
+        "乖離(%)": np.round(_pct(cur, _nan_median(prev)), 1),
+        "前回単価": w[:, 1],
+    }
+
+
+def rolling_prices(norm, n=RECENT_N, item_ids=None):
+    """正規化済み履歴の1行ごとに、その伝票までの直近 n 件の統計を付けた表（商品→日付の順）。
+
+    - 移動平均・移動中央値：当の行を含む直近 n 件
+    - 前回比(%)：同じ商品の1つ前の伝票との比
+    - 変動率(%)：直近 n 件の中の前回比（n-1 個）の標準偏差（2個以上あるとき）
+    - 乖離(%)：当の行と、その前の n 件の中央値との比（急変の判定に使う）
+    日付の無い行・正規化できなかった行は除く。item_ids を渡せばその商品の行だけ先に絞ってから計算する。
+    """
+    if item_ids is not None:
+        norm = norm[norm["item_id"].isin(list(item_ids))]
+    df, order, p, first, _ = _sorted_history(norm)
+    rows = np.arange(len(df))
+    parts = [_window_stats(p, rows[a:a + _ROLL_CHUNK], first[a:a + _ROLL_CHUNK], n)
+             for a in range(0, len(rows), _ROLL_CHUNK)] or [_window_stats(p, rows, first, n)]
+    out = pd.DataFrame({
+        **_take(df, order, {"商品ID": "item_id", "日付": "date", "仕入先": "vendor", "伝票": "source"}),
+        "基準単価": p,
+        **{c: np.concatenate([s[c] for s in parts]) for c in ROLLING_COLUMNS[5:]},
+    })
+    return out[ROLLING_COLUMNS]
+
+
+def price_trends(norm, n=RECENT_N):
+    """商品ごとの最新伝票の時点の統計（rolling_prices の各商品の最後の行。計算は最後の行の分だけ）。
+
+    直近中央値は当の行を含む n 件（MEDIAN_POLICY の採用単価と同じ値）、乖離(%) はその前の n 件の中央値との比。
+    """
+    df, order, p, _, start = _sorted_history(norm)
+    if not len(df):
+        return pd.DataFrame(columns=TREND_COLUMNS)
+    last = np.r_[start[1:], len(df)] - 1
+    stats = _window_stats(p, last, start, n)
+    return pd.DataFrame({
+        **_take(df, order[last], {"商品ID": "item_id", "最終日": "date", "仕入先": "vendor", "伝票": "source"}),
+        "件数": last - start + 1,
+        "最新単価": p[last],
+        "前回単価": stats["前回単価"],
+        "前回比(%)": stats["前回比(%)"],
+        "移動平均": stats["移動平均"],
+        "直近中央値": stats["移動中央値"],
+        "変動率(%)": stats["変動率(%)"],
+        "乖離(%)": stats["乖離(%)"],
+    }, columns=TREND_COLUMNS)
+
+
+def price_alerts(trends, threshold=5.0, direction="both"):
+    """最新伝票の乖離(%) が threshold 以上の商品（乖離の大きい順）。direction は "up" / "down" / "both"。"""
+    dev = trends["乖離(%)"].astype(float)
+    hit = {"up": dev >= threshold, "down": dev <= -threshold}.get(direction, dev.abs() >= threshold)
+    out = trends.loc[hit.fillna(False).to_numpy()].copy()
+    out["判定"] = np.where(out["乖離(%)"] > 0, "値上がり", "値下がり")
+    out = out.iloc[np.argsort(-out["乖離(%)"].abs().to_numpy(), kind="stable")]
+    return out[ALERT_COLUMNS].reset_index(drop=True)
+
+
+# -------------------------------------
+# 商品×仕入先 の最新単価（増分更新）
+# -------------------------------------
+VENDOR_COLUMNS = ["商品ID","仕入先","最新の基準単価","最終日","件数"]
+CHEAPEST_COLUMNS = ["商品ID","最安の仕入先","最安単価","次点の仕入先","次点単価","差額","差(%)","仕入先数","最終日"]
+
+_NO_DATE = np.iinfo(np.int64).min
+
+
+class VendorPriceMatrix:
+    """商品×仕入先 のセルごとに 最新の基準単価・最終日・件数 を持つ（全期間・正規化できた行だけ）。
+
+    最新は adopt_prices と同じ決め方（最終日の行、同日複数なら高値）なので、行の順番によらず
+    全件から作っても1行ずつ足しても同じになる。update() は新しい行が当たったセルだけ書き換える。
+    セルは配列（容量を倍々で確保）＋ {商品ID: {仕入先: 位置}} の辞書。複数セッションから共有してよい。
+    """
+
+    def __init__(self, norm=None):
+        self._pos = {}          # 商品ID -> {仕入先: 位置}
+        self._vendors = {}      # 仕入先 -> セル数
+        self._item = np.empty(0, dtype=object)
+        self._vendor = np.empty(0, dtype=object)
+        self._price = np.empty(0)
+        self._date = np.empty(0, dtype=np.int64)
+        self._n = np.empty(0, dtype=np.int64)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.version = 0        # update で変わるたびに 1 上がる（派生表のキャッシュキー用）
+        self.synced = None      # sync() で取り込んだストアの版
+        self.cursor = 0         # sync() で取り込んだストアの最終行ID
+        if norm is not None:
+            self.update(norm)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vendors(self):
+        """仕入先（セル数の多い順）。"""
+        return sorted(self._vendors, key=lambda v: (-self._vendors[v], v))
+
+    @property
+    def item_ids(self):
+        return list(self._pos)
+
+    def _grow(self, need):
+        cap = len(self._price)
+        if need <= cap:
+            return
+        cap = max(need, 2 * cap, 1024)
+        for name, fill in (("_item", None), ("_vendor", None), ("_price", np.nan), ("_date", _NO_DATE), ("_n", 0)):
+            old = getattr(self, name)
+            new = np.full(cap, fill, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def update(self, norm):
+        """正規化済みの行（item_id, vendor, date, price_per_base）を足す。当たったセルの数を返す。"""
+        df = norm.loc[norm["price_per_base"].notna(), ["item_id","vendor","date","price_per_base"]]
+        if df.empty:
+            return 0
+        # 今回の行を先にセルごとに1行へ（最終日 → 同日は高値、件数）
+        item = df["item_id"].to_numpy(dtype=object)
+        vendor = df["vendor"].astype(object).where(df["vendor"].notna(), "").to_numpy()
+        d = pd.to_datetime(df["date"]).to_numpy("datetime64[ns]").view("int64")  # NaT は _NO_DATE
+        p = df["price_per_base"].to_numpy(float)
+        ci, iu = pd.factorize(item)
+        cv, vu = pd.factorize(vendor)
+        o = np.argsort(ci.astype(np.int64) * len(vu) + cv, kind="stable")   # 商品順 → 仕入先順
+        cs = ci[o].astype(np.int64) * len(vu) + cv[o]
+        start = np.r_[0, np.flatnonzero(cs[1:] != cs[:-1]) + 1]
+        cnt = np.diff(np.r_[start, len(cs)])
+        ds, ps = d[o], p[o]
+        d = np.maximum.reduceat(ds, start)
+        p = np.maximum.reduceat(np.where(ds == np.repeat(d, cnt), ps, -np.inf), start)
+        cell_i, cell_v = ci[o[start]], vu[cv[o[start]]]
+        # 商品ごとの区切り（セルは商品順に並んでいる）
+        bounds = np.r_[0, np.flatnonzero(cell_i[1:] != cell_i[:-1]) + 1, len(cell_i)]
+
+        with self._lock:
+            # 既存セルの位置（無ければ末尾に新設）
+            pos = np.empty(len(cell_i), dtype=np.int64)
+            for a, b in zip(bounds[:-1], bounds[1:]):
+                book = self._pos.get(iu[cell_i[a]])
+                pos[a:b] = [book.get(v, -1) for v in cell_v[a:b]] if book else -1
+            new = np.flatnonzero(pos < 0)
+            if len(new):
+                pos[new] = np.arange(self._size, self._size + len(new))
+                self._grow(self._size + len(new))
+                self._item[pos[new]] = iu[cell_i[new]]
+                self._vendor[pos[new]] = cell_v[new]
+                self._size += len(new)
+                nb = np.r_[0, np.flatnonzero(cell_i[new][1:] != cell_i[new][:-1]) + 1, len(new)]
+                for a, b in zip(nb[:-1], nb[1:]):
+                    k = new[a:b]
+                    self._pos.setdefault(iu[cell_i[k[0]]], {}).update(zip(cell_v[k].tolist(), pos[k].tolist()))
+                for v, k in pd.Series(cell_v[new]).value_counts().items():
+                    self._vendors[v] = self._vendors.get(v, 0) + int(k)
+            # 件数は足し、最新は（日付, 単価）が大きい方
+            self._n[pos] += cnt
+            cur_d, cur_p = self._date[pos], self._price[pos]
+            newer = np.isnan(cur_p) | (d > cur_d) | ((d == cur_d) & (p > cur_p))
+            self._date[pos[newer]], self._price[pos[newer]] = d[newer], p[newer]
+            self.version += 1
+        return len(pos)
+
+    def sync(self, version, load_after, normalize):
+        """ストアの版が変わっていたら、前回より後の行だけ読んで取り込む。取り込んだ行数を返す。
+
+        load_after(行ID) → (その行より後の生データ, 最終行ID)、normalize(生データ) → 正規化済み。
+        同時に呼ばれても取り込みは1回ずつ（同じ行を2回数えない）。
+        """
+        with self._sync_lock:
+            if self.synced == version:
+                return 0
+            raw, last = load_after(self.cursor)
+            if len(raw):
+                self.update(normalize(raw))
+            self.cursor = max(self.cursor, last)
+            self.synced = version
+            return len(raw)
+
+    # ---- 参照 ----
+    def _take(self, item_ids=None, vendors=None):
+        # 指定の商品（順）・仕入先のセルを写し取る（更新中でも崩れないようロック内で）
+        with self._lock:
+            if item_ids is None:
+                pos = np.arange(self._size)
+            else:
+                pos = np.fromiter((q for i in item_ids for q in self._pos.get(i, {}).values()), dtype=np.int64)
+            if vendors is not None:
+                pos = pos[np.isin(self._vendor[pos], list(vendors))]
+            return self._item[pos], self._vendor[pos], self._price[pos], self._date[pos], self._n[pos]
+
+    def cell(self, item_id, vendor):
+        """1セル（dict）。無ければ None。"""
+        with self._lock:
+            pos = self._pos.get(item_id, {}).get(vendor)
+            if pos is None:
+                return None
+            d, p, n = self._date[pos], self._price[pos], self._n[pos]
+        return {"最新の基準単価": float(p), "最終日": pd.Timestamp(d.view("datetime64[ns]")), "件数": int(n)}
+
+    def frame(self, item_ids=None, vendors=None):
+        """縦長の表（商品ID・仕入先・最新の基準単価・最終日・件数）。商品は指定順（省略時は登録順）、商品内は安い順。"""
+        item, vendor, price, d, n = self._take(item_ids, vendors)
+        o = np.lexsort((price, pd.factorize(item)[0]))
+        return pd.DataFrame({
+            "商品ID": item[o], "仕入先": vendor[o], "最新の基準単価": price[o],
+            "最終日": pd.to_datetime(d[o].view("datetime64[ns]")), "件数": n[o],
+        }, columns=VENDOR_COLUMNS)
+
+    def pivot(self, item_ids, vendors=None, value="最新の基準単価"):
+        """商品（行）× 仕入先（列）の表。無いセルは NaN。仕入先は指定順（省略時はセル数の多い順）。"""
+        vendors = list(vendors) if vendors is not None else self.vendors
+        wide = self.frame(item_ids, vendors).pivot(index="商品ID", columns="仕入先", values=value)
+        return wide.reindex(index=pd.Index(list(item_ids), name="商品ID"), columns=pd.Index(vendors, name="仕入先"))
+
+    def cheapest(self, item_ids=None, vendors=None):
+        """商品ごとの最安・次点の仕入先と差（仕入先が1つの品は次点なし）。商品は指定順（省略時は登録順）。"""
+        item, vendor, price, d, _ = self._take(item_ids, vendors)
+        if not len(item):
+            return pd.DataFrame(columns=CHEAPEST_COLUMNS)
+        item_c, item_u = pd.factorize(item)
+        order = np.lexsort((price, item_c))
+        ic = item_c[order]
+        start = np.r_[0, np.flatnonzero(ic[1:] != ic[:-1]) + 1]
+        n = np.diff(np.r_[start, len(ic)])
+        has2 = n > 1
+        first, second = order[start], order[np.where(has2, start + 1, start)]
+        p1, p2 = price[first], np.where(has2, price[second], np.nan)
+        last_d = np.full(len(item_u), _NO_DATE)
+        np.maximum.at(last_d, item_c, d)
+        return pd.DataFrame({
+            "商品ID": np.asarray(item_u, dtype=object),
+            "最安の仕入先": vendor[first],
+            "最安単価": p1,
+            "次点の仕入先": np.where(has2, vendor[second], None),
+            "次点単価": p2,
+            "差額": np.round(p2 - p1, 1),
+            "差(%)": np.round((p2 - p1) / np.where(p1 > 0, p1, np.nan) * 100.0, 1),
+            "仕入先数": n,
+            "最終日": pd.to_datetime(last_d.view("datetime64[ns]")),
+        }, columns=CHEAPEST_COLUMNS)
+
+
+# -------------------------------------
+# パイプラインのキャッシュ
+# -------------------------------------
+def prices_version(raw):
+    """価格データの内容ハッシュ（行・列の値が同じなら同じ版）。"""
+    h = pd.util.hash_pandas_object(raw, index=False).to_numpy()
+    return f"{len(raw)}-{int(h.sum(dtype=np.uint64)):016x}"
+
+
+def parse_price_dates(raw):
+    """date 列を日時に変換したコピーと、その最小/最大日（無ければ NaT）。"""
+    df = raw.copy()
+    df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    return df, df["date"].min(), df["date"].max()
+
+
+def filter_window(raw, start, end):
+    return raw[(raw["date"]>=pd.to_datetime(start)) & (raw["date"]<=pd.to_datetime(end))]
+
+
+class PricingCache:
+    """キー→結果 の小さな LRU。ヒット/ミス数を数える（画面に出す用）。
+
+    複数スレッド（Streamlit の各セッション）から共有してよい。同じキーを同時に取りに来たときは
+    最初の1つだけが compute を呼び、残りはその結果を待って受け取る。
+    結果は共有物なので読み取り専用として扱う（変えるときは呼び出し側で .copy()）。
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = {}   # 計算中のキー -> threading.Event
+
+    def get(self, key, compute):
+        while True:
+            with self._lock:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return self._data[key]
+                done = self._pending.get(key)
+                if done is None:
+                    done = self._pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            done.wait()  # 他のセッションが計算中：終わったら取り直す（失敗していたら自分で計算）
+        try:
+            value = compute()
+            with self._lock:
+                self._data[key] = value
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)  # 一番古いものから捨てる
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+            done.set()
+
+    def __len__(self):
+        return len(self._data)
+
+    def retain(self, keep):
+        """keep(key) が偽のものを捨てる（古い版の分を先に空ける用）。捨てた件数を返す。"""
+        with self._lock:
+            stale = [k for k in self._data if not keep(k)]
+            for k in stale:
+                del self._data[k]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def run_pipeline(cache, raw, items, units, policy, start, end, version=None, profile=None):
+    """raw → 期間抽出 → NORM → TABLE をキャッシュ経由で返す。
+
+    raw は date 日時化済みの DataFrame か、それを返す読み込み関数（キャッシュミス時だけ呼ぶ）。
+    関数を渡すときは version（データの版）も渡すこと。
+    キーは (版, start, end)（TABLE のみ policy も）。ポリシーだけ変えたときは集計済みの採用候補を使い回す。
+    profile（k_profile.RerunProfiler）を渡すと、計算した段だけ区間として記録する。
+    """
+    if version is None:
+        version = prices_version(raw)
+
+    def _section(name):
+        return profile.section(name) if profile is not None else nullcontext({})
+
+    def _norm():
+        with _section("読込・期間抽出") as rec:
+            df = filter_window(raw() if callable(raw) else raw, start, end)
+            rec["rows"] = len(df)
+        with _section("正規化") as rec:
+            out = normalize_prices(df, items, units)
+            rec["rows"] = len(out)
+        return out
+
+    def _adopt():
+        with _section("採用候補集計") as rec:
+            rec["rows"] = len(norm)
+            return adopt_prices(norm)
+
+    def _table():
+        with _section("TABLE") as rec:
+            out = build_price_table(norm, items, policy, adopted=adopted)
+            rec["rows"] = len(out)
+        return out
+
+    norm = cache.get(("norm", version, start, end), _norm)
+    adopted = cache.get(("adopt", version, start, end), _adopt)
+    table = cache.get(("table", version, policy, start, end), _table)
+    return norm, table
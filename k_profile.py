@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜再描画の区間計測（プロファイラ）
+- RerunProfiler：1回の再描画を名前付き区間に分けて計る。
+  lap(name) は前の区間を閉じて次を始める（画面の上から順に置くだけ、インデント不要）。
+  section(name) は今の区間の内訳（入れ子）。処理行数・価格キャッシュのヒット/ミスも区間ごとに残す。
+- 1回分を1行の JSON にして追記（JSONL）。load_log / latency_summary で区間ごとの p50 / p95 を出す。
+  節だけの再実行（st.fragment）は fragment に節の名前が入り、合計は「（節のみ再実行）節名」で別に集計する。
+- キャッシュのヒット/ミスは共有キャッシュの増分（同時に動いた他のセッションの分も含む）。
+- Streamlit には依存しない。
+
+集計：
+$ python k_profile.py                        # 既定のログ（K_APP_PROFILE_LOG）の全期間
+$ python k_profile.py --since 2025-04-01 --top 10
+"""
+import argparse
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+# 計測ログの保存先は環境変数 K_APP_PROFILE_LOG（既定：このファイルと同じ場所の k_profile.jsonl）
+DEFAULT_LOG = os.environ.get(
+    "K_APP_PROFILE_LOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "k_profile.jsonl")
+)
+
+TOTAL = "（再描画 合計）"
+FRAGMENT_TOTAL = "（節のみ再実行）"
+
+# 区間表の列
+SECTION_COLUMNS = ["区間", "ms", "行数", "ヒット", "ミス"]
+SUMMARY_COLUMNS = ["区間", "回数", "p50 ms", "p95 ms", "最大 ms", "平均行数"]
+
+
+class RerunProfiler:
+    """1回の再描画の区間計測。lap で上から順に区切り、section で内訳を取る。"""
+
+    def __init__(self, cache=None, clock=time.perf_counter):
+        self._cache = cache
+        self._clock = clock
+        self._t0 = clock()
+        self._open = None    # 開いている lap の記録
+        self._stack = []     # 開いている section の名前（入れ子の親をたどる用）
+        self.sections = []   # 閉じた区間（lap・section とも。section は "親/子" の名前）
+        self.total = None
+
+    def _stats(self):
+        c = self._cache
+        return (c.hits, c.misses) if c is not None else (0, 0)
+
+    def _start(self, name, rows):
+        hits, misses = self._stats()
+        return {"name": name, "t": self._clock(), "rows": rows, "hits": hits, "misses": misses}
+
+    def _close(self, rec):
+        hits, misses = self._stats()
+        self.sections.append({
+            "name": rec["name"],
+            "ms": (self._clock() - rec["t"]) * 1e3,
+            "rows": rec["rows"],
+            "hits": hits - rec["hits"],
+            "misses": misses - rec["misses"],
+        })
+
+    def lap(self, name, rows=None):
+        """前の区間を閉じて name を始める。"""
+        if self._open is not None:
+            self._close(self._open)
+        self._open = self._start(name, rows)
+
+    def rows(self, n):
+        """今の lap の処理行数（後から分かったとき）。"""
+        if self._open is not None:
+            self._open["rows"] = int(n)
+
+    @contextmanager
+    def section(self, name, rows=None):
+        """今の区間の内訳。yield した dict の "rows" に後から行数を入れてよい。"""
+        parent = self._stack[-1] if self._stack else (self._open["name"] if self._open else "")
+        full = f"{parent}/{name}" if parent else name
+        rec = self._start(full, rows)
+        self._stack.append(full)
+        try:
+            yield rec
+        finally:
+            self._stack.pop()
+            self._close(rec)
+
+    def timed(self, name, fn):
+        """fn を section で包んだ関数（キャッシュの compute に渡す用）。行数は len(結果)。"""
+        def run():
+            with self.section(name) as rec:
+                out = fn()
+                if rec["rows"] is None and hasattr(out, "__len__"):
+                    rec["rows"] = len(out)
+                return out
+        return run
+
+    def finish(self, **extra):
+        """開いている lap を閉じて合計を確定する。1回分の記録（dict。extra も入れる）を返す。"""
+        if self._open is not None:
+            self._close(self._open)
+            self._open = None
+        if self.total is None:
+            self.total = (self._clock() - self._t0) * 1e3
+        return self.record(**extra)
+
+    def record(self, **extra):
+        return {"ts": datetime.now().isoformat(timespec="seconds"), "total_ms": round(self.total or 0.0, 3),
+                "sections": [{**s, "ms": round(s["ms"], 3)} for s in self.sections], **extra}
+
+    def frame(self):
+        """区間表（画面のサイドバー用）。内訳は lap の直後に並ぶ。"""
+        df = pd.DataFrame(self.sections, columns=["name", "ms", "rows", "hits", "misses"])
+        df.columns = SECTION_COLUMNS
+        if not len(df):
+            return df
+        # 入れ子は閉じた順に入っているので、親 lap の後ろへ並べ替える（lap は開始順）
+        top = df["区間"].str.split("/").str[0]
+        order = pd.Index(pd.unique(top))
+        df = df.assign(_k=order.get_indexer(top), _d=df["区間"].str.count("/")).sort_values(
+            ["_k", "_d"], kind="stable").drop(columns=["_k", "_d"])
+        return df.reset_index(drop=True)
+
+
+# -------------------------------------
+# ログ（JSONL）
+# -------------------------------------
+def append_log(record, path=DEFAULT_LOG):
+    """1回分を1行で追記。"""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def load_log(path=DEFAULT_LOG, since=None):
+    """ログ → 区間1つ＝1行の DataFrame（ts, session, 区間, ms, 行数, ヒット, ミス）。
+
+    合計は 区間=TOTAL（節だけの再実行なら FRAGMENT_TOTAL＋節名）。
+
+    壊れた行（書き込み途中など）は飛ばす。since（日付/日時）以降だけに絞れる。
+    """
+    rows = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                base = {"ts": rec.get("ts"), "session": rec.get("session")}
+                total = FRAGMENT_TOTAL + rec["fragment"] if rec.get("fragment") else TOTAL
+                rows.append({**base, "区間": total, "ms": rec.get("total_ms"), "行数": None, "ヒット": None, "ミス": None})
+                for s in rec.get("sections", ()):
+                    rows.append({**base, "区間": s["name"], "ms": s["ms"], "行数": s.get("rows"),
+                                 "ヒット": s.get("hits"), "ミス": s.get("misses")})
+    df = pd.DataFrame(rows, columns=["ts", "session", "区間", "ms", "行数", "ヒット", "ミス"])
+    df["ts"] = pd.to_datetime(df["ts"], errors="coerce")
+    if since is not None:
+        df = df[df["ts"] >= pd.Timestamp(since)]
+    return df.reset_index(drop=True)
+
+
+def latency_summary(log):
+    """区間ごとの 回数 / p50 / p95 / 最大 / 平均行数。全体の合計が先頭、以降は p95 の大きい順。"""
+    if not len(log):
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    g = log.groupby("区間", sort=False)
+    out = pd.DataFrame({
+        "回数": g["ms"].size(),
+        "p50 ms": g["ms"].quantile(0.50),
+        "p95 ms": g["ms"].quantile(0.95),
+        "最大 ms": g["ms"].max(),
+        "平均行数": pd.to_numeric(log["行数"], errors="coerce").groupby(log["区間"], sort=False).mean(),
+    }).round(1)
+    out["_total"] = out.index == TOTAL
+    out = out.sort_values(["_total", "p95 ms"], ascending=False).drop(columns="_total")
+    return out.rename_axis("区間").reset_index()[SUMMARY_COLUMNS]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="再描画の区間計測ログを集計（p50 / p95）")
+    ap.add_argument("log", nargs="?", default=DEFAULT_LOG, help="計測ログ（JSONL）")
+    ap.add_argument("--since", default=None, help="この日付/日時以降だけ（例 2025-04-01、2025-04-01T09:00）")
+    ap.add_argument("--top", type=int, default=None, help="合計＋p95 上位 N 区間だけ表示")
+    args = ap.parse_args(argv)
+
+    log = load_log(args.log, since=args.since)
+    if not len(log):
+        print(f"記録がありません：{args.log}")
+        return 1
+    summary = latency_summary(log)
+    if args.top is not None:
+        summary = summary.head(args.top + 1)
+    n = int((log["区間"] == TOTAL).sum())
+    print(f"{args.log}：再描画 {n:,} 回（{log['ts'].min()} ～ {log['ts'].max()}）")
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(summary.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
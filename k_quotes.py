@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜保存見積ストア（SQLite・価格履歴と同じファイル）と一括再計算
+- 見積1件＝ヘッダ（名前・採用ポリシー・期間・小計・状態）＋明細（商品ID・数量・採用単価・金額・採用注記・出どころ内訳）。
+- 明細は item_id に索引。単価改定（例：上野石材 2025-10-01 価格改定通知）のあと reprice() で、
+  採用単価が変わった品を含む見積だけを読み直して再計算し、見積ごと・明細ごとの差額を返す。
+- 採用単価は各見積の保存時の ポリシー・期間 で引き直す（開いている画面の期間には左右されない。同じ ポリシー×期間 は索引1つ）。
+- 変わった品の判定は「(ポリシー, 期間, 商品ID, 保存時の単価) の組」ごとに1回（見積の件数ではなく品の種類数に比例）。
+- 再計算した見積は前回の小計と一緒に改定履歴（quote_revisions）へ残す。
+
+起動（画面なしで再計算）：
+$ python k_quotes.py                        # 各見積の保存時の期間で、未完了（open）の見積を再計算
+$ python k_quotes.py --start 2025-01-01 --dry-run   # 全見積をこの期間で引く
+"""
+import argparse
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from k_store import DEFAULT_DB
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    created TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    policy TEXT NOT NULL,
+    start TEXT,
+    end TEXT,
+    status TEXT NOT NULL DEFAULT 'open',
+    subtotal REAL NOT NULL DEFAULT 0,
+    missing INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS quote_lines (
+    quote_id INTEGER NOT NULL REFERENCES quotes(id) ON DELETE CASCADE,
+    item_id TEXT NOT NULL,
+    qty REAL NOT NULL,
+    unit_price REAL,
+    amount REAL,
+    note TEXT NOT NULL DEFAULT '',
+    sources TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (quote_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS idx_quote_lines_item ON quote_lines(item_id);
+CREATE INDEX IF NOT EXISTS idx_quotes_status ON quotes(status, policy);
+CREATE TABLE IF NOT EXISTS quote_revisions (
+    id INTEGER PRIMARY KEY,
+    quote_id INTEGER NOT NULL REFERENCES quotes(id) ON DELETE CASCADE,
+    at TEXT NOT NULL,
+    old_subtotal REAL NOT NULL,
+    new_subtotal REAL NOT NULL,
+    changed_lines INTEGER NOT NULL
+);
+"""
+
+STATUSES = ("open", "closed")
+
+# 再計算レポートの列
+REPORT_COLUMNS = ["見積ID","見積名","採用ポリシー","旧小計","新小計","差額","変更明細数"]
+LINE_DELTA_COLUMNS = ["見積ID","商品ID","数量","旧単価","新単価","差額","採用注記"]
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _iso(d):
+    return None if d is None else pd.Timestamp(d).strftime("%Y-%m-%d")
+
+
+def _window(d):
+    # 保存した期間（ISO 文字列。NULL・NaN は None）
+    return None if d is None or (isinstance(d, float) and np.isnan(d)) else str(d)
+
+
+def _index_lookup(indexes):
+    """indexes → (ポリシー, 開始, 終了) から PriceIndex（無ければ None）を引く関数。
+
+    dict {ポリシー: PriceIndex} は期間を見ない（全見積に同じ索引）。関数 index_for(ポリシー, 開始, 終了) は
+    同じ ポリシー×期間 につき1回だけ呼ぶ。
+    """
+    if not callable(indexes):
+        return lambda policy, start, end: indexes.get(policy)
+    memo = {}
+
+    def get(policy, start, end):
+        key = (policy, start, end)
+        if key not in memo:
+            memo[key] = indexes(policy, start, end)
+        return memo[key]
+    return get
+
+
+def _price(p):
+    # NaN / None → None（SQLite の NULL）
+    return None if p is None or (isinstance(p, float) and np.isnan(p)) else float(p)
+
+
+class QuoteStore:
+    """保存見積の SQLite ストア。PriceStore と同じく操作ごとに接続を開く。"""
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        with closing(self._connect()) as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_SCHEMA)
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        con.execute("PRAGMA foreign_keys=ON")
+        return con
+
+    # ---- 書き込み ----
+    def save(self, name, lines, policy, start=None, end=None, sources=None):
+        """見積を保存して見積ID を返す。
+
+        lines は 商品ID / 数量 / 単価 / 金額 / 採用注記 の明細（PriceIndex.lookup の結果と同じ列）。
+        sources は {商品ID: {出どころ: 数量}}（QuoteCart.contributions）。無ければ空。
+        """
+        sources = sources or {}
+        now = _now()
+        records = [
+            (str(r["商品ID"]), float(r["数量"]), _price(r["単価"]), _price(r["金額"]), str(r["採用注記"] or ""),
+             json.dumps(sources.get(r["商品ID"], {}), ensure_ascii=False))
+            for r in lines.to_dict(orient="records")
+        ]
+        subtotal = float(pd.to_numeric(lines["金額"], errors="coerce").fillna(0.0).sum())
+        missing = int(pd.to_numeric(lines["単価"], errors="coerce").isna().sum())
+        with closing(self._connect()) as con, con:
+            cur = con.execute(
+                "INSERT INTO quotes(name, created, updated, policy, start, end, subtotal, missing) "
+                "VALUES (?,?,?,?,?,?,?,?)",
+                (name, now, now, policy, _iso(start), _iso(end), subtotal, missing),
+            )
+            qid = cur.lastrowid
+            con.executemany(
+                "INSERT INTO quote_lines(quote_id, item_id, qty, unit_price, amount, note, sources) "
+                "VALUES (?,?,?,?,?,?,?)",
+                [(qid, *r) for r in records],
+            )
+        return qid
+
+    def set_status(self, quote_id, status):
+        if status not in STATUSES:
+            raise ValueError(f"状態は {STATUSES} のどれかです：{status}")
+        with closing(self._connect()) as con, con:
+            con.execute("UPDATE quotes SET status = ?, updated = ? WHERE id = ?", (status, _now(), int(quote_id)))
+
+    def delete(self, quote_id):
+        with closing(self._connect()) as con, con:
+            con.execute("DELETE FROM quotes WHERE id = ?", (int(quote_id),))
+
+    # ---- 読み込み ----
+    def list(self, status=None):
+        """見積ヘッダの一覧（新しい順）。"""
+        sql = "SELECT id, name, created, updated, policy, start, end, status, subtotal, missing FROM quotes"
+        args = []
+        if status is not None:
+            sql += " WHERE status = ?"; args.append(status)
+        sql += " ORDER BY id DESC"
+        with closing(self._connect()) as con:
+            return pd.read_sql_query(sql, con, params=args)
+
+    def lines(self, quote_id):
+        """明細（商品ID / 数量 / 単価 / 金額 / 採用注記）と出どころ内訳 {商品ID: {出どころ: 数量}}。"""
+        with closing(self._connect()) as con:
+            df = pd.read_sql_query(
+                "SELECT item_id, qty, unit_price, amount, note, sources FROM quote_lines WHERE quote_id = ? "
+                "ORDER BY rowid", con, params=[int(quote_id)])
+        sources = {r.item_id: json.loads(r.sources) for r in df.itertuples()}
+        df = df.drop(columns="sources").rename(columns={
+            "item_id": "商品ID", "qty": "数量", "unit_price": "単価", "amount": "金額", "note": "採用注記"})
+        df[["単価","金額"]] = df[["単価","金額"]].astype(float)
+        return df, sources
+
+    def revisions(self, quote_id=None):
+        sql = "SELECT quote_id, at, old_subtotal, new_subtotal, changed_lines FROM quote_revisions"
+        args = []
+        if quote_id is not None:
+            sql += " WHERE quote_id = ?"; args.append(int(quote_id))
+        with closing(self._connect()) as con:
+            return pd.read_sql_query(sql + " ORDER BY id", con, params=args)
+
+    def count(self):
+        with closing(self._connect()) as con:
+            return con.execute("SELECT COUNT(*) FROM quotes").fetchone()[0]
+
+    # ---- 一括再計算 ----
+    def changed_items(self, indexes, status="open"):
+        """保存時から採用単価が変わった (ポリシー, 商品ID) の集合。
+
+        indexes は reprice と同じ（{ポリシー: PriceIndex} か index_for(ポリシー, 開始, 終了)）。
+        """
+        get = _index_lookup(indexes)
+        with closing(self._connect()) as con:
+            pairs = con.execute(
+                "SELECT DISTINCT q.policy, q.start, q.end, l.item_id, l.unit_price FROM quote_lines l "
+                "JOIN quotes q ON q.id = l.quote_id WHERE q.status = ?", (status,)).fetchall()
+        changed = set()
+        for policy, start, end, iid, old in pairs:
+            index = get(policy, _window(start), _window(end))
+            if index is None:
+                continue
+            new = index.price(iid)
+            if (old is None) != (new is None) or (old is not None and abs(old - new) > 1e-9):
+                changed.add((policy, iid))
+        return changed
+
+    def reprice(self, indexes, status="open", dry_run=False):
+        """採用単価が変わった品を含む見積だけ再計算する。
+
+        indexes：index_for(ポリシー, 開始, 終了) → PriceIndex（無ければ None）なら、各見積を保存時のポリシー・期間で
+        引き直す（同じ ポリシー×期間 の見積は1つの索引で一括）。{ポリシー: PriceIndex} なら期間は見ず全見積に同じ索引。
+        索引が無い見積は対象外。
+        戻り値：(見積ごとの差額 REPORT_COLUMNS, 明細ごとの差額 LINE_DELTA_COLUMNS)。dry_run なら書き込まない。
+        """
+        get = _index_lookup(indexes)
+        changed = self.changed_items(get, status)
+        if not changed:
+            return pd.DataFrame(columns=REPORT_COLUMNS), pd.DataFrame(columns=LINE_DELTA_COLUMNS)
+
+        items = sorted({iid for _, iid in changed})
+        with closing(self._connect()) as con:
+            ids = [r[0] for r in con.execute(
+                f"SELECT DISTINCT l.quote_id FROM quote_lines l JOIN quotes q ON q.id = l.quote_id "
+                f"WHERE q.status = ? AND l.item_id IN ({','.join('?' * len(items))})", (status, *items))]
+            marks = ",".join("?" * len(ids))
+            heads = pd.read_sql_query(
+                f"SELECT id, name, policy, start, end, subtotal FROM quotes WHERE id IN ({marks})", con, params=ids)
+            lines = pd.read_sql_query(
+                f"SELECT quote_id, item_id, qty, unit_price, amount FROM quote_lines WHERE quote_id IN ({marks})",
+                con, params=ids)
+
+        # 見積のポリシー・期間で引き直す（ポリシー×期間ごとに1回の一括引き）
+        heads["start"] = heads["start"].map(_window).astype(object)
+        heads["end"] = heads["end"].map(_window).astype(object)
+        lines = lines.merge(heads[["id","policy","start","end"]], left_on="quote_id", right_on="id").drop(columns="id")
+        lines["unit_price"] = lines["unit_price"].astype(float)
+        lines["amount"] = lines["amount"].astype(float)
+        lines["new_price"] = np.nan
+        lines["note"] = ""
+        priced_rows = np.zeros(len(lines), dtype=bool)
+        for (policy, start, end), g in lines.groupby(["policy","start","end"], sort=False, dropna=False):
+            index = get(policy, _window(start), _window(end))
+            if index is None:
+                continue
+            priced = index.price_lines(g[["item_id"]].rename(columns={"item_id": "商品ID"})
+                                       .assign(数量=g["qty"].to_numpy()))
+            lines.loc[g.index, "new_price"] = priced["単価"].to_numpy()
+            lines.loc[g.index, "note"] = priced["採用注記"].to_numpy()
+            priced_rows[lines.index.get_indexer(g.index)] = True
+        lines = lines[priced_rows]
+        lines["new_amount"] = lines["qty"] * lines["new_price"]
+        old_p, new_p = lines["unit_price"].to_numpy(), lines["new_price"].to_numpy()
+        diff = (np.isnan(old_p) != np.isnan(new_p)) | (np.abs(np.nan_to_num(old_p) - np.nan_to_num(new_p)) > 1e-9)
+        moved = lines[diff]
+
+        new_sub = lines["new_amount"].fillna(0.0).groupby(lines["quote_id"]).sum()
+        n_missing = lines["new_price"].isna().groupby(lines["quote_id"]).sum()
+        n_changed = moved.groupby("quote_id").size()
+        heads = heads[heads["id"].isin(n_changed.index)].copy()
+        heads["new"] = heads["id"].map(new_sub).fillna(0.0)
+        report = pd.DataFrame({
+            "見積ID": heads["id"].to_numpy(), "見積名": heads["name"].to_numpy(),
+            "採用ポリシー": heads["policy"].to_numpy(),
+            "旧小計": heads["subtotal"].to_numpy(), "新小計": heads["new"].to_numpy(),
+            "差額": (heads["new"] - heads["subtotal"]).to_numpy(),
+            "変更明細数": heads["id"].map(n_changed).to_numpy(),
+        }).sort_values("差額", key=np.abs, ascending=False, ignore_index=True)
+        line_deltas = pd.DataFrame({
+            "見積ID": moved["quote_id"].to_numpy(), "商品ID": moved["item_id"].to_numpy(), "数量": moved["qty"].to_numpy(),
+            "旧単価": moved["unit_price"].to_numpy(), "新単価": moved["new_price"].to_numpy(),
+            "差額": (moved["new_amount"].fillna(0.0) - moved["amount"].fillna(0.0)).to_numpy(),
+            "採用注記": moved["note"].to_numpy(),
+        })
+        if dry_run or report.empty:
+            return report, line_deltas
+
+        now = _now()
+        with closing(self._connect()) as con, con:
+            con.executemany(
+                "UPDATE quote_lines SET unit_price = ?, amount = ?, note = ? WHERE quote_id = ? AND item_id = ?",
+                [(_price(p), _price(a), n, int(q), i) for q, i, p, a, n in
+                 moved[["quote_id","item_id","new_price","new_amount","note"]].itertuples(index=False, name=None)])
+            con.executemany(
+                "UPDATE quotes SET subtotal = ?, missing = ?, updated = ? WHERE id = ?",
+                [(float(r["新小計"]), int(n_missing.get(r["見積ID"], 0)), now, int(r["見積ID"]))
+                 for r in report.to_dict(orient="records")])
+            con.executemany(
+                "INSERT INTO quote_revisions(quote_id, at, old_subtotal, new_subtotal, changed_lines) VALUES (?,?,?,?,?)",
+                [(int(r["見積ID"]), now, float(r["旧小計"]), float(r["新小計"]), int(r["変更明細数"]))
+                 for r in report.to_dict(orient="records")])
+        return report, line_deltas
+
+
+def main(argv=None):
+    from k_batch import load_price_index
+    from k_pricing import POLICIES
+    from k_store import PriceStore
+
+    ap = argparse.ArgumentParser(description="保存見積を最新の採用単価で一括再計算")
+    ap.add_argument("--db", default=DEFAULT_DB, help="SQLite ファイル（価格履歴と同じ）")
+    ap.add_argument("--start", default=None, help="採用単価の期間（開始日）。--start/--end を渡すと全見積をこの期間で引く")
+    ap.add_argument("--end", default=None, help="採用単価の期間（終了日）。無ければ各見積の保存時の期間")
+    ap.add_argument("--dry-run", action="store_true", help="差額を出すだけで書き込まない")
+    ap.add_argument("-o", "--out", default=None, help="明細ごとの差額を CSV に出す")
+    args = ap.parse_args(argv)
+
+    store = PriceStore(args.db)
+    quotes = QuoteStore(args.db)
+    if args.start is not None or args.end is not None:
+        indexes = {p: load_price_index(store, p, args.start, args.end) for p in POLICIES}
+    else:
+        def indexes(policy, start, end):
+            return load_price_index(store, policy, start, end) if policy in POLICIES else None
+    report, line_deltas = quotes.reprice(indexes, dry_run=args.dry_run)
+    if report.empty:
+        print("採用単価が変わった見積はありません。")
+        return 0
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(report.to_string(index=False))
+    print(f"{len(report)} 件の見積・{len(line_deltas)} 明細の単価が変わりました"
+          + ("（dry-run：書き込みなし）" if args.dry_run else "。"))
+    if args.out:
+        line_deltas.to_csv(args.out, index=False, encoding="utf-8-sig")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
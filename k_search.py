@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜商品検索（商品ID・カテゴリ・商品名・規格の索引）
+- 文字はそろえてから索引・検索する：NFKC（全角英数・記号→半角、半角カナ→全角）、英字は小文字、ひらがな→カタカナ、
+  ×→x、空白・中黒・ハイフン類は除く。「１／２」と「1/2」、「ﾅｯﾄ」「ナット」「なっと」は同じ。
+- 索引は 2文字の n-gram → 商品番号 の転置索引（1文字の語は 1-gram）。検索語も同じようにそろえ、
+  語ごとに n-gram の積集合で候補を絞ってから実際の部分一致で確かめる（取りこぼし・誤ヒットなし）。
+  空白区切りの複数語は AND。漢字は読みを持たないので、漢字は漢字・かなは かな（カタカナ）で引く。
+- 並び：商品ID・各欄の前方一致 → 部分一致。同じなら登録順。
+- update(items) は追加・変更された商品だけ索引に足す（作り直さない）。変更・削除された古い分は無効にするだけ。
+- PickerPages：商品一覧（TABLE）のページ送り。並べ替えの順番は列ごとに1回だけ作って持ち、
+  1ページ分は 全件なら順番の切り出し、検索で絞ったなら当たった行だけの並べ替え。1ページの手間は一覧の大きさによらない。
+- Streamlit には依存しない。
+"""
+import threading
+import unicodedata
+
+import numpy as np
+
+SEARCH_FIELDS = ["category", "name", "spec"]
+
+# ひらがな→カタカナ、× → x、区切り文字は消す
+_FOLD = {c: c + 0x60 for c in range(ord("ぁ"), ord("ゖ") + 1)}
+_FOLD.update({ord("×"): "x", ord("✕"): "x"})
+_FOLD.update({ord(c): None for c in " \t　・･-‐‑–—―－_"})   # 長音「ー」はカナの一部なので残す
+_SEP = "\x00"             # 欄の区切り（語に含まれないので、欄をまたいだ一致はしない）
+
+
+def fold(text):
+    """検索用に文字をそろえる（NFKC・小文字・ひらがな→カタカナ・区切り除去）。"""
+    if text is None or text != text:
+        return ""
+    return unicodedata.normalize("NFKC", str(text)).lower().translate(_FOLD)
+
+
+def _grams(s):
+    if len(s) == 1:
+        return {s}
+    return {s[k:k + 2] for k in range(len(s) - 1)}
+
+
+class CatalogSearch:
+    """商品の検索索引。search() は検索語 → 商品ID のリスト（よく合う順）。複数セッションから共有してよい。"""
+
+    def __init__(self, items=None, fields=SEARCH_FIELDS):
+        self.fields = list(fields)
+        self._ids = []          # 商品番号 -> 商品ID
+        self._raw = []          # 商品番号 -> 元の値（各欄。変わったかの判定用）
+        self._texts = []        # 商品番号 -> そろえた文字列（各欄の頭に _SEP。最初の欄は商品ID）
+        self._alive = []        # 商品番号 -> 有効か（変更・削除で古い番号は無効）
+        self._doc = {}          # 商品ID -> 今の商品番号
+        self._post = {}         # n-gram（1・2文字）-> [商品番号, ...]
+        self._lock = threading.Lock()
+        self.version = None     # update() に渡した版（同じ版なら何もしない）
+        if items is not None:
+            self.update(items)
+
+    def __len__(self):
+        return len(self._doc)
+
+    def update(self, items, version=None):
+        """items（item_id を index に持つ商品マスタ）の追加・変更分だけ索引に入れる。(追加, 変更, 削除) の数を返す。
+
+        元の値が前回と同じ商品は文字をそろえ直さない。version を渡すと、前回と同じ版なら何もしない。
+        """
+        if version is not None and version == self.version:
+            return 0, 0, 0
+        ids = items.index.tolist()
+        cols = [items[f].to_numpy(dtype=object, na_value=None).tolist() if f in items.columns else [None] * len(ids)
+                for f in self.fields]
+        memo = {}
+
+        def fold_once(v):
+            out = memo.get(v)
+            if out is None:
+                out = memo[v] = fold(v)
+            return out
+
+        with self._lock:
+            added = changed = 0
+            seen = set()
+            for iid, *raw in zip(ids, *cols):
+                seen.add(iid)
+                raw = tuple(raw)
+                old = self._doc.get(iid)
+                if old is not None:
+                    if self._raw[old] == raw:
+                        continue
+                    self._alive[old] = False
+                    changed += 1
+                else:
+                    added += 1
+                parts = [fold(iid), *(fold_once(v) for v in raw)]
+                grams = set()
+                for part in parts:
+                    grams.update(part)
+                    grams.update(_grams(part))
+                doc = len(self._ids)
+                self._ids.append(iid)
+                self._raw.append(raw)
+                self._texts.append("".join(_SEP + p for p in parts))
+                self._alive.append(True)
+                self._doc[iid] = doc
+                post = self._post
+                for g in grams:
+                    lst = post.get(g)
+                    if lst is None:
+                        post[g] = [doc]
+                    else:
+                        lst.append(doc)
+            gone = [iid for iid in self._doc if iid not in seen]
+            for iid in gone:
+                self._alive[self._doc.pop(iid)] = False
+            self.version = version
+        return added, changed, len(gone)
+
+    def _candidates(self, term):
+        # 語の n-gram をすべて含む商品番号（少ない転置リストから順に積集合）
+        lists = sorted((self._post.get(g, ()) for g in _grams(term)), key=len)
+        if not lists or not lists[0]:
+            return set()
+        cand = set(lists[0])
+        for lst in lists[1:]:
+            cand.intersection_update(lst)
+            if not cand:
+                break
+        return cand
+
+    def search(self, query, limit=None):
+        """検索語（空白区切りは AND）に合う商品ID（前方一致が先、同じなら登録順）。空の検索語は []。"""
+        terms = [t for t in (fold(w) for w in str(query or "").split()) if t]
+        if not terms:
+            return []
+        with self._lock:
+            cand = None
+            for t in sorted(terms, key=len, reverse=True):   # 長い語ほど候補が少ない
+                c = self._candidates(t)
+                cand = c if cand is None else cand & c
+                if not cand:
+                    return []
+            texts, alive, ids = self._texts, self._alive, self._ids
+            heads = [_SEP + t for t in terms]
+            first, rest = [], []
+            for doc in sorted(cand):
+                if not alive[doc]:
+                    continue
+                text = _SEP + texts[doc]
+                if all(t in text for t in terms):
+                    # 商品ID・各欄の前方一致が先、部分一致だけなら後
+                    (first if any(h in text for h in heads) else rest).append(doc)
+        out = [ids[doc] for doc in first + rest]
+        return out if limit is None else out[:limit]
+
+    def mask(self, item_ids, query):
+        """item_ids（画面の並び）のうち検索語に合うものの真偽配列。空の検索語なら全部 True。"""
+        item_ids = item_ids.tolist() if hasattr(item_ids, "tolist") else list(item_ids)
+        if not str(query or "").strip():
+            return np.ones(len(item_ids), dtype=bool)
+        hit = set(self.search(query))   # Arrow 文字列の isin より Python の set の方が速い
+        return np.fromiter((i in hit for i in item_ids), dtype=bool, count=len(item_ids))
+
+
+class PickerPages:
+    """商品一覧のページ送り（並べ替え・検索の絞り込みはここで。画面へは1ページ分だけ渡す）。
+
+    table は「商品ID」列を持つ一覧（TABLE）。並べ替えの順番・順位は (列, 降順か) ごとに初回だけ作る。
+    複数セッションから共有してよい（作る値はいつも同じ）。
+    """
+
+    def __init__(self, table, id_col="商品ID"):
+        self.table = table.reset_index(drop=True)
+        self._pos = {iid: k for k, iid in enumerate(self.table[id_col].tolist())}   # 商品ID -> 行位置
+        self._orders = {}                          # (列, 降順) -> (行位置の順番, 各行の順位)
+
+    def __len__(self):
+        return len(self.table)
+
+    def _order(self, sort, descending):
+        key = (sort, bool(descending))
+        hit = self._orders.get(key)
+        if hit is None:
+            n = len(self.table)
+            if sort is None:
+                order = np.arange(n)[::-1] if descending else np.arange(n)
+            else:
+                # 空欄は昇順・降順とも最後
+                order = self.table[sort].sort_values(ascending=not descending, kind="stable",
+                                                     na_position="last").index.to_numpy()
+            rank = np.empty(n, dtype=np.int64)
+            rank[order] = np.arange(n)
+            self._orders[key] = hit = (order, rank)
+        return hit
+
+    def page(self, ids=None, sort=None, descending=False, page=1, size=100):
+        """1ページ分の行と (件数, ページ数, ページ)。
+
+        ids は検索で絞った商品ID（None は全件。一覧に無いIDは無視）。sort は並べ替える列（None は一覧の順）。
+        ページは 1 から。範囲外は端のページにする。
+        """
+        order, rank = self._order(sort, descending)
+        if ids is None:
+            total = len(order)
+        else:
+            get = self._pos.get
+            pos = np.fromiter((k for k in map(get, ids) if k is not None), dtype=np.int64)
+            total = len(pos)
+        pages = max(1, -(-total // size))
+        page = min(max(int(page), 1), pages)
+        lo, hi = (page - 1) * size, min(page * size, total)
+        if ids is None:
+            rows = order[lo:hi]
+        else:
+            rows = pos[np.argsort(rank[pos], kind="stable")][lo:hi]
+        return self.table.iloc[rows], (total, pages, page)
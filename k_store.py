@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜価格履歴ストア（SQLite・ローカル1ファイル）
+- 伝票1行＝1レコード。列は PRICES_INIT と同じ（date, vendor, item_id, ... , source）。
+- 追記は差分だけ（同じ伝票行の再投入は無視。入数違いは別の行、単価・入数の空欄どうしは同じ行）。item_id×date / date に索引。
+- 画面はサイドバーの期間だけを読み込む（全履歴は持たない）。仕入先比較は前回より後の行だけ読む（load_after）。
+- 追記のたびに版（version）が 1 上がる → 価格パイプラインのキャッシュキーに使う。
+
+保存先は環境変数 K_APP_DB（既定：このファイルと同じ場所の k_prices.sqlite3）。
+"""
+import os
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+from k_pricing import PRICE_COLUMNS
+
+DEFAULT_DB = os.environ.get(
+    "K_APP_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "k_prices.sqlite3")
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    vendor TEXT NOT NULL DEFAULT '',
+    item_id TEXT NOT NULL,
+    standard TEXT NOT NULL DEFAULT '',
+    diameter TEXT NOT NULL DEFAULT '',
+    invoice_unit TEXT NOT NULL DEFAULT '',
+    unit_price REAL,
+    qty_per_invoice_unit REAL,
+    source TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_prices_item_date ON prices(item_id, date);
+CREATE INDEX IF NOT EXISTS idx_prices_date ON prices(date);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta(key, value) VALUES ('version', 0);
+"""
+
+_TEXT_COLUMNS = ["vendor","item_id","standard","diameter","invoice_unit","source"]
+
+# 同じ伝票行の判定（入数も含める。単価・入数の空欄 NULL は '' として比べ、空欄どうしも同じ行とみなす）
+_LINE_KEY = ("date, vendor, item_id, standard, diameter, invoice_unit, "
+             "COALESCE(unit_price, ''), COALESCE(qty_per_invoice_unit, ''), source")
+_UNIQUE_INDEX = "uq_prices_line_v2"
+
+
+def _to_records(df):
+    # DataFrame → INSERT 用タプル（日付は YYYY-MM-DD、文字列の欠損は ''、数値の欠損は NULL）
+    d = df.reindex(columns=PRICE_COLUMNS).copy()
+    d["date"] = pd.to_datetime(d["date"], errors="coerce").dt.strftime("%Y-%m-%d")
+    for c in _TEXT_COLUMNS:
+        d[c] = d[c].astype(object).where(d[c].notna(), "").astype(str)
+    for c in ("unit_price","qty_per_invoice_unit"):
+        v = pd.to_numeric(d[c], errors="coerce").astype(float)
+        d[c] = v.astype(object).where(v.notna(), None)
+    d = d[d["date"].notna()]
+    return list(d.itertuples(index=False, name=None))
+
+
+def _iso(d):
+    return None if d is None else pd.Timestamp(d).strftime("%Y-%m-%d")
+
+
+class PriceStore:
+    """価格履歴の SQLite ストア。操作ごとに接続を開く（Streamlit のスレッドをまたいでも安全）。"""
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        with closing(self._connect()) as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_SCHEMA)
+            self._migrate_unique(con)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _migrate_unique(con):
+        # 旧い一意索引（入数なし・NULL の単価は別行扱い）を作り直す。重なっていた行は先に入ったものだけ残す
+        if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (_UNIQUE_INDEX,)).fetchone():
+            return
+        with con:
+            con.execute("DROP INDEX IF EXISTS uq_prices_line")
+            dropped = con.execute(
+                f"DELETE FROM prices WHERE id NOT IN (SELECT MIN(id) FROM prices GROUP BY {_LINE_KEY})").rowcount
+            con.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {_UNIQUE_INDEX} ON prices({_LINE_KEY})")
+            if dropped:
+                con.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    # ---- 書き込み ----
+    def append(self, df):
+        """伝票行を追記し、実際に増えた行数を返す（既存と同じ行は無視）。"""
+        records = _to_records(df)
+        if not records:
+            return 0
+        with closing(self._connect()) as con, con:
+            before = con.total_changes
+            con.executemany(
+                f"INSERT OR IGNORE INTO prices({','.join(PRICE_COLUMNS)}) VALUES ({','.join('?' * len(PRICE_COLUMNS))})",
+                records,
+            )
+            added = con.total_changes - before
+            if added:
+                con.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return added
+
+    def seed(self, df):
+        """空のときだけ初期データ（同梱の PRICES_INIT）を入れる。"""
+        if self.count() == 0:
+            return self.append(df)
+        return 0
+
+    # ---- 読み込み ----
+    def load(self, start=None, end=None, item_ids=None):
+        """期間（両端含む）・商品で絞って読み込む。並びは登録順。"""
+        where, args = [], []
+        if start is not None:
+            where.append("date >= ?"); args.append(_iso(start))
+        if end is not None:
+            where.append("date <= ?"); args.append(_iso(end))
+        if item_ids is not None:
+            item_ids = list(item_ids)
+            if not item_ids:
+                return pd.DataFrame(columns=PRICE_COLUMNS)
+            where.append(f"item_id IN ({','.join('?' * len(item_ids))})"); args.extend(item_ids)
+        sql = f"SELECT {','.join(PRICE_COLUMNS)} FROM prices"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id"
+        with closing(self._connect()) as con:
+            df = pd.read_sql_query(sql, con, params=args)
+        df["qty_per_invoice_unit"] = df["qty_per_invoice_unit"].astype(float)
+        df["unit_price"] = df["unit_price"].astype(float)
+        return df
+
+    def load_after(self, row_id=0):
+        """行ID が row_id より後の行（追記分）と、その中の最大行ID。無ければ (空, row_id)。並びは登録順。"""
+        sql = f"SELECT id, {','.join(PRICE_COLUMNS)} FROM prices WHERE id > ? ORDER BY id"
+        with closing(self._connect()) as con:
+            df = pd.read_sql_query(sql, con, params=[int(row_id)])
+        last = int(df["id"].iloc[-1]) if len(df) else int(row_id)
+        df = df.drop(columns="id")
+        df["qty_per_invoice_unit"] = df["qty_per_invoice_unit"].astype(float)
+        df["unit_price"] = df["unit_price"].astype(float)
+        return df, last
+
+    def date_range(self):
+        """(最小日, 最大日)。空なら (None, None)。"""
+        with closing(self._connect()) as con:
+            lo, hi = con.execute("SELECT MIN(date), MAX(date) FROM prices").fetchone()
+        return (pd.Timestamp(lo) if lo else None, pd.Timestamp(hi) if hi else None)
+
+    def count(self):
+        with closing(self._connect()) as con:
+            return con.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+
+    def version(self):
+        with closing(self._connect()) as con:
+            return con.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜拾い計算エンジン（画面なし・NumPy 一括）
+- 鉄筋スラブ（鉄筋方式 vs メッシュ方式）／ブロック積／土間スラブ／立上り梁 の数量計算。
+- 寸法・係数はスカラーでも配列でも可（ブロードキャスト）。1回の呼び出しで何千件でも計算する。
+- 結果は k_app3 の各フォームの式と完全一致させること（丸め・切り上げの順序も同じ）。
+- 戻り値は {数量名: 配列} の dict。スカラー入力なら 0 次元配列（float()/int() で取り出す）。
+- *_lines() は計算結果を見積に入れる商品（商品ID, 数量）の組へ。画面のカート反映と一括見積（k_batch）で共通。
+"""
+import numpy as np
+
+# CDメッシュ 1枚（m）
+MESH_W, MESH_H = 1.8, 0.9
+
+# 型枠パネル（1820×910）の採用高さ候補(mm) と 金物ピッチ(m)
+FORM_HEIGHTS = np.array([200, 300, 450, 600, 900])
+FORM_SHEET_LEN = 1.82
+TIE_PITCH = 0.45
+
+# 立上り梁の延長モード
+BEAM_MODES = ["全周 (L×2+W×2)", "L×1+W×2", "L×2+W×1", "任意入力"]
+
+
+def _f(x):
+    return np.asarray(x, dtype=float)
+
+
+def _ceil(x):
+    return np.ceil(x).astype(np.int64)
+
+
+def _floor(x):
+    return np.floor(x).astype(np.int64)
+
+
+def needed_sheets(target, sheet, lap):
+    """target(m) を sheet(m) 幅のメッシュで重なり lap(m) を取りながら覆う枚数。"""
+    target, sheet, lap = np.broadcast_arrays(_f(target), _f(sheet), _f(lap))
+    step = np.maximum(sheet - lap, 0.01)
+    extra = _ceil(np.maximum(target - sheet, 0.0) / step)
+    return np.where(target <= 0, 0, np.where(target <= sheet, 1, 1 + extra))
+
+
+def form_height(depth_mm):
+    """型枠の採用高さ(mm)：候補のうち depth 以上の最小（超えたら 900）。"""
+    i = np.searchsorted(FORM_HEIGHTS, _f(depth_mm), side="left")
+    return FORM_HEIGHTS[np.minimum(i, len(FORM_HEIGHTS) - 1)]
+
+
+# -------------------------------------
+# 鉄筋スラブ（鉄筋方式 vs メッシュ方式）
+# -------------------------------------
+def rebar_mesh(L, W, cover_edge_mm, pitch_x_mm, pitch_y_mm, layers, waste, kgpm,
+               tie_kg_per_sqm, sykoro_per_sqm_layer, mesh_lap_x, mesh_lap_y):
+    """鉄筋方式（総延長/重量）とメッシュ方式（枚数）、共通の結束線・サイコロ。
+
+    定尺の本数・発注量は切断計画（k_cutting.plan_cuts）で出す（ここでは割り算しない）。
+    valid が False の行（かぶりが大きすぎて有効寸法が 0 以下）は数量を信用しないこと。
+    """
+    L, W = _f(L), _f(W)
+    cov = _f(cover_edge_mm) / 1000.0
+    L_eff, W_eff = np.maximum(0.0, L - 2*cov), np.maximum(0.0, W - 2*cov)
+    A_eff = L_eff * W_eff
+    layers = np.asarray(layers)
+
+    # 鉄筋方式
+    px, py = _f(pitch_x_mm)/1000.0, _f(pitch_y_mm)/1000.0
+    n_x = _floor(W_eff / px) + 1
+    n_y = _floor(L_eff / py) + 1
+    total_m = (n_x * L_eff + n_y * W_eff) * layers
+    total_m = total_m * (1.0 + _f(waste)/100.0)
+    total_kg = total_m * _f(kgpm)
+    tie_kg = A_eff * _f(tie_kg_per_sqm) * layers
+    sykoro_pcs = _ceil(A_eff * _f(sykoro_per_sqm_layer) * layers)
+
+    # メッシュ方式（0.9×1.8 を縦横どちら向きに敷くか、少ない方）
+    nxA = needed_sheets(L_eff, MESH_W, mesh_lap_x)
+    nyA = needed_sheets(W_eff, MESH_H, mesh_lap_y)
+    nxB = needed_sheets(L_eff, MESH_H, mesh_lap_x)
+    nyB = needed_sheets(W_eff, MESH_W, mesh_lap_y)
+    mesh_sheets = np.minimum(nxA*nyA, nxB*nyB) * layers
+
+    return {
+        "valid": (L_eff > 0) & (W_eff > 0),
+        "L_eff": L_eff, "W_eff": W_eff, "A_eff": A_eff,
+        "n_x": n_x, "n_y": n_y,
+        "total_m": total_m, "total_kg": total_kg,
+        "tie_kg": tie_kg, "sykoro_pcs": sykoro_pcs,
+        "mesh_sheets": mesh_sheets,
+    }
+
+
+# -------------------------------------
+# ブロック基礎（ブロック積）
+# -------------------------------------
+def block_found(L, H, corners, halfs, joint_mm, loss_pct, block_len_mm,
+                cement_per_block, sand_per_cement, gravel_per_cement,
+                use_hbar, hbar_pitch_course, use_vbar, vbar_pitch_m):
+    """ブロック個数・モルタル（袋）・φ10 4m棒（横筋/縦筋）。"""
+    L, H = _f(L), _f(H)
+    # 実効長（目地考慮）：1ピースの有効長 ≒ (ブロック長 + 目地)
+    pitch_m = (_f(block_len_mm) + _f(joint_mm)) / 1000.0
+    courses = np.maximum(1, np.round(H / 0.2)).astype(np.int64)  # 1段 ≒ 200mm の簡易
+    blocks_per_course = np.maximum(1, _ceil(L / pitch_m))
+    corners = np.maximum(0, np.asarray(corners)).astype(np.int64)
+    base_blocks = blocks_per_course * courses + corners
+    half_blocks = np.maximum(0, np.asarray(halfs)).astype(np.int64)
+    total_blocks = _ceil(base_blocks * (1.0 + _f(loss_pct)/100.0))
+
+    # モルタル（袋換算）
+    cement_bags = total_blocks * _f(cement_per_block)
+    sand_bags = cement_bags * _f(sand_per_cement)
+    gravel_bags = cement_bags * _f(gravel_per_cement)
+
+    # 鉄筋（φ10 4m棒）
+    used_courses = _ceil(courses / np.maximum(1, np.asarray(hbar_pitch_course)))
+    hbars = np.where(np.asarray(use_hbar, dtype=bool), used_courses * _ceil(L / 4.0), 0)
+    vp = _f(vbar_pitch_m)
+    has_v = np.asarray(use_vbar, dtype=bool) & (vp > 0)
+    pos = _ceil(L / np.where(vp > 0, vp, 1.0)) + 1  # 端部含めて+1
+    vbars = np.where(has_v, _ceil(pos * H / 4.0), 0)
+
+    return {
+        "courses": courses,
+        "total_blocks": total_blocks,
+        "half_blocks": half_blocks,
+        "corners": corners,
+        "cement_bags": cement_bags, "sand_bags": sand_bags, "gravel_bags": gravel_bags,
+        "hbars": hbars, "vbars": vbars,
+    }
+
+
+# -------------------------------------
+# 基礎：土間スラブ（ベタコン）
+# -------------------------------------
+def slab(L, W, t_mm, conc_waste, cover_mm, pitch_mm, layer_n, kgpm, tie_kg_per_sqm, chair_per_sqm,
+         subbase_t_mm, side_mul, screws_per_sheet, form_waste, sanki_override):
+    """生コン・スラブ配筋・砕石・周囲型枠（パネル/ビス/サンギ）。side_mul は 片面=1／両面=2。"""
+    L, W, t_mm = _f(L), _f(W), _f(t_mm)
+    A = L * W
+    P = 2*(L+W)
+    layer_n = np.asarray(layer_n)
+
+    # 生コン
+    slab_m3 = A * (t_mm/1000.0) * (1.0 + _f(conc_waste)/100.0)
+
+    # 配筋（有効寸）
+    cov = _f(cover_mm)/1000.0
+    L_eff, W_eff = np.maximum(0.0, L-2*cov), np.maximum(0.0, W-2*cov)
+    px = py = _f(pitch_mm)/1000.0
+    safe = np.where(px > 0, px, 1.0)
+    n_x = np.where(px > 0, _floor(W_eff/safe) + 1, 0)
+    n_y = np.where(py > 0, _floor(L_eff/safe) + 1, 0)
+    total_m = (n_x*L_eff + n_y*W_eff) * layer_n
+
+    # 重量・付帯
+    slab_kg = total_m * _f(kgpm)
+    tie_kg = A * _f(tie_kg_per_sqm) * layer_n
+    chairs = _ceil(A * _f(chair_per_sqm) * layer_n)
+
+    # 砕石
+    sub = _f(subbase_t_mm)
+    agg_m3 = np.where(sub > 0, A * (sub/1000.0), 0.0)
+
+    # 周囲型枠（採用高さ＝土間厚の切上げ）
+    H_use = form_height(t_mm)
+    side_mul = np.asarray(side_mul)
+    sheet_h_m = H_use/1000.0
+    area_per_sheet = FORM_SHEET_LEN * sheet_h_m
+    gross_area = P * sheet_h_m * side_mul * (1.0 + _f(form_waste)/100.0)
+    sheets = _ceil(gross_area / area_per_sheet)
+    screws = sheets * np.asarray(screws_per_sheet)
+
+    # サンギ：片面 1m/か所、両面（または指定）2m/か所
+    cols = _ceil(P / TIE_PITCH) + 1
+    rows = np.maximum(1, _ceil((H_use/1000.0) / TIE_PITCH))
+    positions = _ceil(cols * rows * (1.0 + _f(form_waste)/100.0))
+    both = np.asarray(sanki_override, dtype=bool) | (side_mul == 2)
+    sanki_m = positions * np.where(both, 2.0, 1.0)
+
+    return {
+        "A": A, "P": P,
+        "slab_m3": slab_m3,
+        "total_m": total_m, "slab_kg": slab_kg, "tie_kg": tie_kg, "chairs": chairs,
+        "agg_m3": agg_m3,
+        "H_use": H_use, "sheets": sheets, "screws": screws, "sanki_m": sanki_m,
+    }
+
+
+# -------------------------------------
+# 基礎：立上り梁
+# -------------------------------------
+def beam_length(L, W, mode, custom_len=0.0):
+    """梁延長(m)。mode は BEAM_MODES のいずれか（配列可）。"""
+    L, W, mode = _f(L), _f(W), np.asarray(mode)
+    return np.select(
+        [mode == BEAM_MODES[0], mode == BEAM_MODES[1], mode == BEAM_MODES[2]],
+        [2*(L+W), L + 2*W, 2*L + W],
+        _f(custom_len),
+    )
+
+
+def beam(beam_len, b, h, conc_waste, rebar_coef, tie_coef, screws_per_sheet, form_waste, sanki_both):
+    """生コン・配筋（係数）・両面型枠・セパ/Pコン/サンギ（450×450）。"""
+    beam_len, h = _f(beam_len), _f(h)
+    beam_m3 = beam_len * (_f(b)/1000.0) * (h/1000.0) * (1.0 + _f(conc_waste)/100.0)
+
+    # 配筋（係数）
+    rebar_kg = beam_m3 * _f(rebar_coef)
+    tie_kg = beam_m3 * _f(tie_coef)
+
+    # 型枠（両面）
+    H_use = form_height(h)
+    sheet_h_m = H_use/1000.0
+    area_per_sheet = FORM_SHEET_LEN * sheet_h_m
+    gross_area = beam_len * sheet_h_m * 2 * (1.0 + _f(form_waste)/100.0)
+    sheets = _ceil(gross_area / area_per_sheet)
+    screws = sheets * np.asarray(screws_per_sheet)
+
+    # Pコン・セパ・サンギ
+    cols = _ceil(beam_len / TIE_PITCH) + 1
+    rows = np.maximum(1, _ceil((H_use/1000.0) / TIE_PITCH))
+    positions = _ceil(cols * rows * (1.0 + _f(form_waste)/100.0))
+    sanki_m = positions * np.where(np.asarray(sanki_both, dtype=bool), 2.0, 1.0)
+
+    return {
+        "beam_m3": beam_m3, "rebar_kg": rebar_kg, "tie_kg": tie_kg,
+        "H_use": H_use, "sheets": sheets, "screws": screws,
+        "sepa_qty": positions, "pcon_qty": positions * 2, "sanki_m": sanki_m,
+    }
+
+
+# -------------------------------------
+# 見積反映品（商品ID, 数量）
+# -------------------------------------
+TIE_WIRE_ITEM = "tie_wire_band5_350"
+SYKORO_ITEM = "conc_sykoro_4x5x6"
+SCREW_ITEM = "conpa_screw_35"
+MESH_ITEM = "cdmesh_6_150"
+BEAM_REBAR_ITEM = "rebar_D13_SD295A"   # 立上り梁の配筋（kg → D13 の m 換算）
+BLOCK_REBAR_ITEM = "rebar_bar10_4m"
+BLOCK_CORNER = {"block_B10_basic": "block_B10_corner", "block_C12_basic": "block_C12_corner"}
+BLOCK_HALF = {"block_C12_basic": "block_C12_half"}
+
+
+def rebar_dia(item_id):
+    """鉄筋の商品ID → 径（D10/D13/D16）。"""
+    return "D10" if "D10" in item_id else ("D13" if "D13" in item_id else "D16")
+
+
+def _map_items(items, table):
+    if np.ndim(items) == 0:
+        return table.get(items)
+    return np.array([table.get(i) for i in items], dtype=object)
+
+
+def slab_lines(r, rmx_item, agg_item, rebar_item):
+    """slab() の結果 → [(商品ID, 数量)]。商品IDはスカラーでも配列でも可。"""
+    return [
+        (rmx_item, r["slab_m3"]),
+        (agg_item, r["agg_m3"]),
+        (rebar_item, r["total_m"]),
+        (TIE_WIRE_ITEM, r["tie_kg"]),
+        (SYKORO_ITEM, r["chairs"]),
+        (SCREW_ITEM, r["screws"]),
+    ]
+
+
+def beam_lines(r, rmx_item, d13_kgpm):
+    """beam() の結果 → [(商品ID, 数量)]。鉄筋 kg は D13 の m に換算する。"""
+    rebar_m = _f(r["rebar_kg"]) / d13_kgpm if d13_kgpm > 0 else np.zeros_like(_f(r["rebar_kg"]))
+    return [
+        (rmx_item, r["beam_m3"]),
+        (BEAM_REBAR_ITEM, rebar_m),
+        (TIE_WIRE_ITEM, r["tie_kg"]),
+        (SCREW_ITEM, r["screws"]),
+    ]
+
+
+def block_lines(r, basic_item):
+    """block_found() の結果 → [(商品ID, 数量)]。隅・1/2 は対応品のある種別だけ（無ければ None）。"""
+    return [
+        (basic_item, r["total_blocks"]),
+        (_map_items(basic_item, BLOCK_CORNER), r["corners"]),
+        (_map_items(basic_item, BLOCK_HALF), r["half_blocks"]),
+        ("bag_cement", r["cement_bags"]),
+        ("bag_sand", r["sand_bags"]),
+        ("bag_gravel", r["gravel_bags"]),
+        (BLOCK_REBAR_ITEM, r["hbars"] + r["vbars"]),
+    ]
+
+
+def rebar_lines(r, rebar_item, stock_m=None):
+    """rebar_mesh() の結果 → 鉄筋方式の [(商品ID, 数量)]。
+
+    stock_m（切断計画の定尺総延長 m。端材込みの発注量）があれば鉄筋の数量はそれ。無ければ総延長。
+    """
+    rebar_m = r["total_m"] if stock_m is None else stock_m
+    return [(rebar_item, rebar_m), (TIE_WIRE_ITEM, r["tie_kg"]), (SYKORO_ITEM, r["sykoro_pcs"])]
+
+
+def mesh_lines(r):
+    """rebar_mesh() の結果 → メッシュ方式の [(商品ID, 数量)]。"""
+    return [(MESH_ITEM, r["mesh_sheets"]), (TIE_WIRE_ITEM, r["tie_kg"]), (SYKORO_ITEM, r["sykoro_pcs"])]
+
+
+def lines_dict(lines):
+    """スカラー入力の [(商品ID, 数量)] → {商品ID: 数量}（数量 0 以下・商品なしは除く）。"""
+    out = {}
+    for iid, q in lines:
+        q = float(q)
+        if iid is not None and q > 0:
+            out[iid] = out.get(iid, 0.0) + q
+    return out
+
+
+# -------------------------------------
+# 鉄筋 vs メッシュ：パラメータスイープ
+# -------------------------------------
+def sweep_rebar_mesh(L, W, cover_edge_mm, waste, tie_kg_per_sqm, sykoro_per_sqm_layer,
+                     layer_options, rebar_kgpm, rebar_price, pitches_mm, laps,
+                     mesh_price, tie_price, sykoro_price, square=True):
+    """鉄筋方式（層×鉄筋種類×ピッチ）とメッシュ方式（層×重なり）の全組合せを1回の配列計算で原価まで出す。
+
+    ピッチは X・Y に同じ候補を使う（square=True なら X=Y だけ）。メッシュの重なりは縦横同じ値。
+    単価が無い品は nan を渡す（その組合せの原価は nan）。
+    鉄筋は総延長（ロス率込み）で値入れする概算（組合せごとに切断計画は作らない）。
+
+    戻り値：
+      rebar_cost [層, 鉄筋, X, Y]（square なら [層, 鉄筋, ピッチ]）/ rebar_m（同形：総延長 m）
+      mesh_cost [層, 重なり] / mesh_sheets（同形）
+      crossover [層, 鉄筋, 重なり]：正方ピッチで鉄筋方式がメッシュ以下になる最小ピッチ(mm)。ならなければ nan
+    """
+    layers = np.asarray(layer_options)
+    kgpm, rprice = _f(rebar_kgpm), _f(rebar_price)
+    p = _f(pitches_mm)
+    lap = _f(laps)
+
+    # 鉄筋方式：[層, 鉄筋, X, Y]
+    px = p[None, None, :, None]
+    py = p[None, None, :, None] if square else p[None, None, None, :]
+    rb = rebar_mesh(L, W, cover_edge_mm, px, py, layers[:, None, None, None], waste,
+                    kgpm[None, :, None, None], tie_kg_per_sqm, sykoro_per_sqm_layer, 0.0, 0.0)
+    rebar_m = rb["total_m"]
+    rebar_cost = (rebar_m * rprice[None, :, None, None]
+                  + rb["tie_kg"] * _f(tie_price) + rb["sykoro_pcs"] * _f(sykoro_price))
+    if square:
+        rebar_m, rebar_cost = rebar_m[..., 0], rebar_cost[..., 0]
+
+    # メッシュ方式：[層, 重なり]
+    ms = rebar_mesh(L, W, cover_edge_mm, p[0], p[0], layers[:, None], waste, 0.0,
+                    tie_kg_per_sqm, sykoro_per_sqm_layer, lap[None, :], lap[None, :])
+    mesh_sheets = ms["mesh_sheets"]
+    mesh_cost = mesh_sheets * _f(mesh_price) + ms["tie_kg"] * _f(tie_price) + ms["sykoro_pcs"] * _f(sykoro_price)
+
+    # 切替点：正方ピッチの原価 [層, 鉄筋, 1, ピッチ] と メッシュ [層, 1, 重なり, 1]
+    diag = rebar_cost if square else np.diagonal(rebar_cost, axis1=2, axis2=3)
+    wins = diag[:, :, None, :] <= mesh_cost[:, None, :, None]
+    first = np.argmax(wins, axis=-1)
+    crossover = np.where(wins.any(axis=-1), p[first], np.nan)
+
+    return {
+        "valid": bool(np.all(rb["valid"])),
+        "rebar_cost": rebar_cost, "rebar_m": rebar_m,
+        "mesh_cost": mesh_cost, "mesh_sheets": mesh_sheets,
+        "crossover": crossover,
+    }
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+原価管理MVP｜単位換算（商品・カテゴリ別の単位グラフ）
+- 換算は「1 A = 係数 B」の辺の集まり。辺は 全商品（all）/ カテゴリ（category）/ 商品（item）のどれかに効く。
+  径（diameter）付きの辺は、その径の伝票行だけに効く。同じ2単位の辺は 商品 > カテゴリ > 全商品 の順に上書き。
+- 辺の出どころ：
+  - catalog/units.csv（t↔kg、砕石のかさ比重 t↔m3、塗料のケース入数、棒鋼1本の長さ …）
+  - 鉄筋の 径→kg/m（カテゴリ「鉄筋」・径付き：1m = kg/m kg）
+  - 商品マスタの入数（1箱・1束 = 入数 本。units.csv の商品の辺があればそちらが優先）
+  - 伝票の入数（箱・束 で、上のどれでも基準単位に届かないときだけ：1箱 = 伝票の入数 本）
+- 伝票単位 → 基準単位 は辺の数が一番少ない経路（幅優先）。商品・伝票単位・径 の組ごとに1回だけ探してメモする。
+  単価 = 伝票単価 × 分子 ÷ 分母（分子・分母は経路の係数の積。割り算の入数はそのまま割るので丸め誤差が増えない）。
+- 経路は注記に残す：例「kg→m換算（1m=0.995kg D13）」「t→m3換算（1m3=1.8t かさ比重）」。
+- 単位を増やすのはデータ（units.csv に行を足す）だけ。
+"""
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# 箱・束（入数で 本 に按分できる荷姿）
+BOX_UNITS = ("箱","束")
+PIECE = "本"
+
+REBAR_CATEGORY = "鉄筋"
+
+# 辺の表（catalog/units.csv と同じ列）
+UNIT_EDGE_COLUMNS = ["scope","key","diameter","from_unit","factor","to_unit","note"]
+SCOPES = ("all","category","item")
+
+
+def _g(x):
+    return f"{x:g}"
+
+
+class UnitGraph:
+    """単位の辺（全商品・カテゴリ・商品・径別）から、伝票単位→基準単位 の換算を引く。
+
+    resolve() は組ごとにメモするので、同じ組を何度引いても経路探索は1回。複数セッションから共有してよい
+    （メモへの書き込みが重なっても同じ値を入れるだけ）。
+    """
+
+    def __init__(self, edges=None, kg_per_m=None):
+        self._scoped = {}   # (scope, key) -> [(径, A, 係数, B, 注記), ...]（後に足したものが優先）
+        self._memo = {}
+        for d, kgpm in (kg_per_m or {}).items():
+            self._add("category", REBAR_CATEGORY, d, "m", float(kgpm), "kg", "")
+        if edges is not None:
+            for r in edges[UNIT_EDGE_COLUMNS].itertuples(index=False):
+                self._add(r.scope, r.key, r.diameter, r.from_unit, float(r.factor), r.to_unit, r.note)
+
+    @property
+    def item_keys(self):
+        """商品別（item）の辺を持つ商品ID。"""
+        return {k for scope, k in self._scoped if scope == "item"}
+
+    def _add(self, scope, key, dia, a, f, b, note):
+        if scope not in SCOPES:
+            raise ValueError(f"単位の辺：scope は {SCOPES} のどれか（{scope}）")
+        if not f > 0 or a == b:
+            raise ValueError(f"単位の辺：1{a}={f}{b} は使えません")
+        self._scoped.setdefault((scope, key if scope != "all" else ""), []).append(
+            (dia or "", a, f, b, note or ""))
+
+    def _adjacency(self, item_id, category, units_per_box, dia):
+        # この商品・径に効く辺を優先度の低い順に重ね、同じ2単位は後のもので上書き
+        pair = {}
+        layers = [self._scoped.get(("all", ""), ()), self._scoped.get(("category", category), ())]
+        if units_per_box is not None:
+            layers.append([("", u, units_per_box, PIECE, "入数") for u in BOX_UNITS])
+        layers.append(self._scoped.get(("item", item_id), ()))
+        for layer in layers:
+            for d, a, f, b, note in layer:
+                if not d or d == dia:
+                    pair[frozenset((a, b))] = (a, f, b, note, d)
+        adj = {}
+        for a, f, b, note, d in pair.values():
+            hop = f"1{a}={_g(f)}{b}" + (f" {d}" if d else "") + (f" {note}" if note else "")
+            adj.setdefault(a, []).append((b, f, 1.0, hop))   # a → b：a 1つは b が f 個
+            adj.setdefault(b, []).append((a, 1.0, f, hop))
+        return adj
+
+    @staticmethod
+    def _path(adj, src, dst):
+        # src 1つが dst 何個か（分子, 分母, 経路の説明）。届かなければ None
+        if src == dst:
+            return 1.0, 1.0, []
+        seen = {src: (1.0, 1.0, [])}
+        queue = deque([src])
+        while queue:
+            u = queue.popleft()
+            num, den, hops = seen[u]
+            for v, fn, fd, hop in adj.get(u, ()):
+                if v in seen:
+                    continue
+                seen[v] = (num * fn, den * fd, hops + [hop])
+                if v == dst:
+                    return seen[v]
+                queue.append(v)
+        return None
+
+    def resolve(self, item_id, category, base_unit, units_per_box, invoice_unit, diameter=""):
+        """伝票単位の単価 → 基準単位の単価 の換算。
+
+        (分子, 分母, 注記, 伝票入数の分子, 伝票入数の分母, 伝票入数の注記) を返す。
+        基準単価 = 伝票単価 × 分子 ÷ 分母。届かなければ 分子 = NaN・注記「未対応(伝票単位→基準単位)」。
+        伝票入数の3つは、箱・束 を伝票の入数で 本 にすれば届くときだけ（基準単価 = 伝票単価 × 分子 ÷ (分母 × 入数)）。
+        """
+        upb = float(units_per_box) if units_per_box is not None and not pd.isna(units_per_box) else None
+        upb = upb if upb else None   # 0 は入数なし
+        key = (item_id, category, base_unit, upb, invoice_unit, diameter)
+        hit = self._memo.get(key)
+        if hit is not None:
+            return hit
+        ng = f"未対応({invoice_unit}→{base_unit})"
+        adj = self._adjacency(item_id, category, upb, diameter)
+        found = self._path(adj, base_unit, invoice_unit)
+        if found is None:
+            out = (np.nan, 1.0, ng)
+        elif not found[2]:
+            out = (1.0, 1.0, f"{base_unit}単価")
+        else:
+            out = (found[0], found[1], f"{invoice_unit}→{base_unit}換算（" + "・".join(found[2]) + "）")
+        via = (np.nan, 1.0, ng)
+        if found is None and invoice_unit in BOX_UNITS:
+            piece = self._path(adj, base_unit, PIECE)
+            if piece is not None:
+                hops = [f"1{invoice_unit}=入数{PIECE} 伝票"] + piece[2]
+                via = (piece[0], piece[1], f"{invoice_unit}→{base_unit}換算（" + "・".join(hops) + "）")
+        self._memo[key] = hit = out + via
+        return hit
+
+    def convert(self, price, item_id, category, base_unit, units_per_box, invoice_unit, diameter="", qty=None):
+        """1行分：伝票単価 → (基準単価, 注記)。qty は伝票の入数（箱・束 の按分用。無ければ None）。"""
+        num, den, note, qnum, qden, qnote = self.resolve(item_id, category, base_unit, units_per_box,
+                                                         invoice_unit, diameter)
+        if not np.isnan(num):
+            return price * num / den, note
+        if not np.isnan(qnum) and qty is not None and not pd.isna(qty) and float(qty) > 0:
+            return price * qnum / (qden * float(qty)), qnote
+        return np.nan, note
+
+    def units_for(self, item_id, category, base_unit, units_per_box=None, diameter=""):
+        """基準単位へ換算できる単位（基準単位を含む。伝票の入数が要る箱・束 は除く）。"""
+        upb = float(units_per_box) if units_per_box is not None and not pd.isna(units_per_box) else None
+        adj = self._adjacency(item_id, category, upb or None, diameter)
+        seen, queue = {base_unit}, deque([base_unit])
+        while queue:
+            for v, *_ in adj.get(queue.popleft(), ()):
+                if v not in seen:
+                    seen.add(v)
+                    queue.append(v)
+        return sorted(seen)
+
+
+def as_unit_graph(units):
+    """UnitGraph はそのまま、dict（径→kg/m）なら鉄筋の辺だけのグラフにする（旧い呼び出し用）。"""
+    return units if isinstance(units, UnitGraph) else UnitGraph(kg_per_m=units)
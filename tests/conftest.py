@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# リポジトリ直下のモジュール（k_pricing など）を import できるようにする
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
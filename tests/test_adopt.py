@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+採用候補の一括集計（adopt_prices）の回帰テスト。
+- 正解は商品ごとの adopt_price（4ポリシーとも）。単価と、日付のある行は注記も一致させる。
+- 同じ日の複数行（最新日付の高値・直近中央値の並び）、日付なし（NaT）、単価なしの行、
+  平均がちょうど 0.05 の丸め境界に来る商品（足し順で丸めが変わる）を含める。
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from k_pricing import MEDIAN_POLICY, POLICIES, adopt_price, adopt_prices
+
+COLUMNS = {"高い方（値上がり優先）": ("price_max", "note_max"), "最新日付": ("price_latest", "note_latest"),
+           "期間平均": ("price_avg", "note_avg"), MEDIAN_POLICY: ("price_median", "note_median")}
+
+
+def _rows(item_id, prices, dates, rng):
+    n = len(prices)
+    return pd.DataFrame({
+        "item_id": item_id, "date": pd.to_datetime(dates),
+        "vendor": rng.choice(["A", "B", "C"], n), "source": [f"s{k}" for k in range(n)],
+        "price_per_base": prices,
+    })
+
+
+def _history(seed=0):
+    rng = np.random.default_rng(seed)
+    days = pd.date_range("2025-01-01", periods=8).strftime("%Y-%m-%d").tolist()
+    frames = []
+    for g in range(300):
+        n = int(rng.integers(1, 25))
+        prices = np.round(rng.choice([100.0, 105.5, 110.0], n) if g % 3 == 0 else rng.uniform(1, 5000, n), 1)
+        dates = rng.choice(days[:3] if g % 4 == 0 else days, n).astype(object)   # 同じ日が多い商品も
+        if g % 5 == 0:
+            dates[rng.random(n) < 0.3] = None                                     # 日付なし
+        dates[0] = days[int(rng.integers(len(days)))]                             # 日付のある行は必ず1行
+        prices[rng.random(n) < 0.1] = np.nan                                      # 単価なし（除外される）
+        prices[0] = 1.0 if np.isnan(prices[0]) else prices[0]
+        frames.append(_rows(f"i{g}", prices, dates, rng))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _tie_history():
+    # 平均が 0.05 の丸め境界の近く：行順に足すと Series.mean（ペアごとの足し算）と丸めが変わる商品を集める
+    rng = np.random.default_rng(1)
+    frames = []
+    while len(frames) < 20:
+        p = np.round(rng.uniform(1, 5000, int(rng.integers(9, 60))), 1)
+        seq = 0.0
+        for v in p:
+            seq += v
+        if np.round(seq / len(p), 1) != np.round(pd.Series(p).mean(), 1):
+            frames.append(_rows(f"t{len(frames)}", p, ["2025-01-01"] * len(p), rng))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _check(norm):
+    got = adopt_prices(norm)
+    for item_id, g in norm.groupby("item_id", sort=False):
+        dated = g["date"].notna().all()
+        for policy in POLICIES:
+            want, note, _ = adopt_price(g, policy)
+            price_col, note_col = COLUMNS[policy]
+            assert got.loc[item_id, price_col] == pytest.approx(want, abs=1e-9), (item_id, policy)
+            if dated or policy in ("期間平均", MEDIAN_POLICY):
+                assert got.loc[item_id, note_col] == note, (item_id, policy)
+
+
+def test_adopt_prices_matches_adopt_price():
+    _check(_history())
+
+
+def test_average_on_rounding_boundary():
+    _check(_tie_history())
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+時点指定の索引（AsOfPriceIndex）の回帰テスト。
+- 正解は「その日以前（window_days を渡せば直近 window_days 日）の履歴」に絞った商品ごとの adopt_price。
+  4ポリシーとも単価と注記を比べる。
+- 同じ日の複数行、日付なし（NaT。索引にも adopt_price にも入らない）、
+  平均がちょうど 0.05 の丸め境界に来る商品（0.1 + 0.2 など）を含める。
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from k_pricing import POLICIES, AsOfPriceIndex, adopt_price
+
+DAYS = pd.date_range("2025-01-01", periods=30)
+
+
+def _history(seed=0):
+    rng = np.random.default_rng(seed)
+    n = 1200
+    df = pd.DataFrame({
+        "item_id": rng.choice([f"i{k}" for k in range(30)], n),
+        "date": rng.choice(DAYS, n),
+        "vendor": rng.choice(["A", "B", "C"], n),
+        "source": [f"s{k}" for k in range(n)],
+        "price_per_base": np.round(rng.choice([100.0, 120.5, 99.9], n), 1),
+    })
+    wide = rng.random(n) < 0.5
+    df.loc[wide, "price_per_base"] = np.round(rng.uniform(1, 5000, wide.sum()), 1)
+    df.loc[rng.random(n) < 0.05, "date"] = pd.NaT
+    df.loc[rng.random(n) < 0.05, "price_per_base"] = np.nan
+    # 丸め境界：平均がちょうど x.x5（浮動小数の和では少しずれる）
+    ties = [("t0", [0.1, 0.2]), ("t1", [100.1, 100.2]), ("t2", [0.1, 0.2, 0.3, 0.4]), ("t3", [2.2, 2.3, 2.4, 2.7])]
+    rows = [(iid, DAYS[k % 3], "A", f"t{k}", p) for iid, ps in ties for k, p in enumerate(ps)]
+    return pd.concat([df, pd.DataFrame(rows, columns=df.columns)], ignore_index=True)
+
+
+@pytest.mark.parametrize("window_days", [None, 7])
+def test_asof_matches_adopt_price(window_days):
+    norm = _history()
+    index = AsOfPriceIndex(norm)
+    item_ids = sorted(norm["item_id"].unique()) + ["nope"]
+    dates = [DAYS[0] - pd.Timedelta(days=1), DAYS[0], DAYS[1], DAYS[2], DAYS[9], DAYS[20], DAYS[-1]]
+    for policy in POLICIES:
+        table = index.prices(item_ids, dates, policy, window_days)
+        for d in dates:
+            part = norm[norm["date"] <= d]
+            if window_days is not None:
+                part = part[part["date"] > d - pd.Timedelta(days=window_days)]
+            groups = dict(tuple(part.groupby("item_id")))
+            lines, missing = index.lookup(dict.fromkeys(item_ids, 1.0), d, policy, window_days)
+            for k, iid in enumerate(item_ids):
+                want, note, _ = adopt_price(groups.get(iid, part.iloc[:0]), policy)
+                got = table.loc[d, iid]
+                if np.isnan(want):
+                    assert np.isnan(got) and iid in missing, (policy, d, iid)
+                else:
+                    assert got == pytest.approx(want, abs=1e-9), (policy, d, iid)
+                    assert lines["採用注記"].iloc[k] == note, (policy, d, iid)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+見積カート（QuoteCart）の回帰テスト。
+- replace は変わった品だけ返し、合計は出どころごとの内訳の和。
+- set_qty は manual 分で合計を合わせる。0 以下は外す、NaN・無限大は ValueError。
+- 合計が 0 以下になった品は隠すだけで内訳は残る（反映し直せば手動の調整ごと戻る）。remove_item は内訳ごと消す。
+"""
+import math
+
+import pytest
+
+from k_cart import MANUAL, QuoteCart
+
+
+def test_replace_tracks_changes_and_totals():
+    cart = QuoteCart()
+    assert cart.replace("rebar", {"a": 10.0, "b": 2.0}) == {"a", "b"}
+    assert cart.replace("mesh", {"a": 1.5}) == {"a"}
+    assert cart.qty("a") == 11.5 and cart.qty("b") == 2.0
+    # 同じ値は変わらない・0 以下と None は入れない・無くなった品は差し戻す
+    assert cart.replace("rebar", {"a": 10.0, "c": 0.0, None: 3.0}) == {"b"}
+    assert "b" not in cart and cart.contributions("b") == {}
+    assert cart.source("rebar") == {"a": 10.0}
+    assert cart.clear("mesh") == {"a"}
+    assert cart.totals == {"a": 10.0}
+
+
+def test_set_qty_adjusts_manual_only():
+    cart = QuoteCart()
+    cart.replace("rebar", {"a": 10.0})
+    cart.set_qty("a", 4.0)
+    assert cart.qty("a") == 4.0
+    assert cart.contributions("a") == {MANUAL: -6.0, "rebar": 10.0}
+    cart.add_item("b", 2.0)
+    cart.add_item("b", 5.0)                          # 入っている品は変えない
+    assert cart.qty("b") == 2.0
+    cart.set_qty("b", 0)                             # 0 以下は外す
+    assert "b" not in cart and cart.contributions("b") == {}
+
+
+@pytest.mark.parametrize("qty", [math.nan, math.inf, -math.inf])
+def test_set_qty_rejects_non_finite(qty):
+    cart = QuoteCart()
+    cart.replace("rebar", {"a": 10.0})
+    with pytest.raises(ValueError):
+        cart.set_qty("a", qty)
+    assert cart.qty("a") == 10.0 and cart.contributions("a") == {"rebar": 10.0}
+
+
+def test_zero_total_hides_line_but_keeps_contributions():
+    cart = QuoteCart()
+    cart.replace("rebar", {"a": 10.0})
+    cart.set_qty("a", 4.0)                           # manual -6
+    cart.replace("rebar", {"a": 6.0})                # 合計 0 → 隠す
+    assert "a" not in cart and len(cart) == 0
+    assert cart.contributions("a") == {MANUAL: -6.0, "rebar": 6.0}
+    cart.replace("rebar", {"a": 12.0})               # 反映し直すと手動の調整ごと戻る
+    assert cart.qty("a") == 6.0
+
+
+def test_remove_item_drops_every_source():
+    cart = QuoteCart()
+    cart.replace("rebar", {"a": 10.0})
+    cart.replace("mesh", {"a": 2.0, "b": 1.0})
+    cart.set_qty("a", 15.0)
+    cart.remove_item("a")
+    assert "a" not in cart and cart.contributions("a") == {}
+    assert cart.source("rebar") == {} and cart.source("mesh") == {"b": 1.0}
+    cart.replace("rebar", {"a": 3.0})                # 消した後は自動分だけで戻る
+    assert cart.qty("a") == 3.0
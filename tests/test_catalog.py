@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+商品マスタ・初期価格のコンパイル（compile_catalog）の回帰テスト。
+- 初期価格の単価は CSV の値のまま（小数を丸めない）。空・負の単価は ValueError。
+"""
+import pytest
+
+from k_catalog import ITEMS_CSV, UNITS_CSV, compile_catalog
+
+HEADER = "date,vendor,item_id,standard,diameter,invoice_unit,unit_price,qty_per_invoice_unit,source\n"
+
+
+def _prices(tmp_path, *prices):
+    path = tmp_path / "prices_init.csv"
+    path.write_text(HEADER + "".join(f"2025-03-21,A,rebar_D10_SD295A,SD295A,D10,kg,{p},,s\n" for p in prices),
+                    encoding="utf-8")
+    return path
+
+
+def test_decimal_unit_price_is_kept(tmp_path):
+    _, prices, _ = compile_catalog(ITEMS_CSV, _prices(tmp_path, "12.5", "141"), UNITS_CSV)
+    assert prices["unit_price"].tolist() == [12.5, 141.0]
+
+
+@pytest.mark.parametrize("price", ["", "-3"])
+def test_bad_unit_price_raises(tmp_path, price):
+    with pytest.raises(ValueError, match="unit_price"):
+        compile_catalog(ITEMS_CSV, _prices(tmp_path, "141", price), UNITS_CSV)
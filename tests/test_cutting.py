@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+定尺取りの回帰テスト。
+- slab_stock_m（一括見積の閉じた式）は 定尺1種類の plan_cuts(slab_pieces(...)) と同じ定尺総延長。
+"""
+import numpy as np
+import pytest
+
+from k_cutting import plan_cuts, slab_pieces, slab_stock_m
+
+
+def test_slab_stock_m_matches_ffd():
+    rng = np.random.default_rng(0)
+    n = 500
+    L = np.round(rng.uniform(0.5, 30.0, n), 3)
+    W = np.round(rng.uniform(0.5, 30.0, n), 3)
+    L[:20], W[20:40] = 4.0, 8.0                      # 定尺ちょうど
+    L[40:60] = W[40:60] = 3.6                        # X・Y が同じ長さ
+    n_x, n_y = rng.integers(0, 40, n), rng.integers(0, 40, n)
+    layers = rng.integers(1, 3, n)
+    stock = rng.choice([4.0, 5.5, 6.0, 8.0], n)
+    lap = rng.choice([0.0, 0.4, 0.5, 1.0], n)
+    got = slab_stock_m(L, W, n_x, n_y, layers, stock, lap)
+    want = [plan_cuts(slab_pieces(*args[:6], args[6]), [args[5]]).stock_m
+            for args in zip(L, W, n_x, n_y, layers, stock, lap)]
+    assert got == pytest.approx(want)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+伝票取込（validate_chunk）の回帰テスト。
+- 1つの chunk に書式の違う日付が混ざっても、読める日付の行は採用する（先頭行の書式に決め打ちしない）。
+"""
+import pandas as pd
+
+from k_import import parse_dates, validate_chunk
+from k_pricing import PRICE_COLUMNS
+
+ITEMS = pd.DataFrame(
+    [["wire", "副資材", "結束線", "", "kg", None]],
+    columns=["item_id", "category", "name", "spec", "base_unit", "units_per_box"],
+).set_index("item_id")
+
+
+def _chunk(dates):
+    n = len(dates)
+    return pd.DataFrame({
+        "date": dates, "vendor": "A", "item_id": "wire", "standard": "", "diameter": "",
+        "invoice_unit": "kg", "unit_price": "380", "qty_per_invoice_unit": None, "source": "s",
+    }, columns=PRICE_COLUMNS, index=range(10, 10 + n))
+
+
+def test_mixed_date_formats_in_one_chunk():
+    df = _chunk(["2025-11-01", "2025/11/02", "2025年11月3日", "2025.11.4", "2025/1/5", "20251106",
+                 "11/07/2025", "2025-13-01", ""])
+    good, bad = validate_chunk(df, ITEMS, {})
+    want = pd.to_datetime(["2025-11-01", "2025-11-02", "2025-11-03", "2025-11-04", "2025-01-05", "2025-11-06"])
+    assert good["date"].tolist() == want.tolist()
+    assert good.index.tolist() == [10, 11, 12, 13, 14, 15]
+    # 年が先頭でないもの・月が範囲外・空欄は日付不正（元の値のままレポートへ）
+    assert bad["理由"].tolist() == ["日付不正"] * 3
+    assert bad["date"].tolist() == ["11/07/2025", "2025-13-01", ""]
+
+
+def test_parse_dates_keeps_index_and_timestamps():
+    s = pd.Series([pd.Timestamp("2025-11-01"), None, " 2025/11/02 "], index=[3, 4, 5], dtype=object)
+    out = parse_dates(s)
+    assert out.index.tolist() == [3, 4, 5]
+    assert out[3] == pd.Timestamp("2025-11-01") and pd.isna(out[4]) and out[5] == pd.Timestamp("2025-11-02")
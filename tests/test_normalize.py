@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+単価正規化（normalize_prices / normalize_price）の回帰テスト。
+- 正解は最初の画面（k_app3）にあった行単位の規則をそのまま写した _baseline（以後は直さない）。
+  列演算・単位グラフに作り直した今の実装とは独立に、元の規則で決まる行の単価・未対応を固定する。
+- 元の規則に無かった換算（t↔kg、kg 基準の鉄筋の m→kg）は手計算の値で別に確かめる。
+- 商品マスタ・径→kg/m は下の合成データ（本体の表・同梱カタログの units.csv を直しても正解は動かない）。
+"""
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from k_pricing import normalize_price, normalize_prices
+from k_units import UNIT_EDGE_COLUMNS, UnitGraph
+
+# 径→kg/m（元の k_app3 の表）
+REBAR_KG_PER_M = {
+    "D6":0.222,"D10":0.617,"D13":0.995,"D16":1.560,"D19":2.250,
+    "D22":2.980,"D25":3.980,"D29":5.040,"D32":6.350,"D35":7.990,
+    "D38":9.860,"D41":11.90,
+}
+
+ITEMS = pd.DataFrame(
+    [
+        ["rb", "鉄筋", "異径鋼", "", "m", None],
+        ["rb_kg", "鉄筋", "異径鋼（kg 基準）", "", "kg", None],
+        ["screw_box", "金物", "ビス", "50本入", "本", 50],
+        ["screw", "金物", "ビス", "", "本", None],
+        ["block", "ブロック材", "ブロック", "基本", "個", None],
+        ["wire", "副資材", "結束線", "", "kg", None],
+        ["panel_box", "型枠", "パネル", "10枚入", "枚", 10],
+    ],
+    columns=["item_id", "category", "name", "spec", "base_unit", "units_per_box"],
+).set_index("item_id")
+ITEMS_D = ITEMS.to_dict(orient="index")
+
+
+def _baseline(row):
+    """元の行単位の規則（k_app3 の最初の normalize_price を写したもの）→ (基準単価, 未対応か)。"""
+    meta = ITEMS_D[row["item_id"]]
+    inv_unit = str(row["invoice_unit"]) if row["invoice_unit"] is not None else ""
+    price = float(row["unit_price"]) if row["unit_price"] is not None else np.nan
+    qpu = row["qty_per_invoice_unit"]
+    bunit = meta["base_unit"]
+    upb = meta["units_per_box"]
+    upb = None if upb is None or (isinstance(upb, float) and math.isnan(upb)) else upb
+
+    # 箱/束 → 本に按分
+    if inv_unit in ("箱", "束"):
+        n = upb or qpu
+        if n and float(n) > 0:
+            price = price / float(n)
+            inv_unit = "本"
+
+    # 鉄筋：kg→m
+    if meta["category"] == "鉄筋" and bunit == "m":
+        dia = str(row.get("diameter") or "")
+        if inv_unit == "kg" and dia in REBAR_KG_PER_M:
+            return price * REBAR_KG_PER_M[dia], False
+        if inv_unit == "m":
+            return price, False
+        return np.nan, True
+
+    if inv_unit == bunit:
+        return price, False
+    return np.nan, True
+
+
+def _rows(rows):
+    return pd.DataFrame(rows, columns=["item_id", "invoice_unit", "unit_price", "diameter", "qty_per_invoice_unit"])
+
+
+# 元の規則で決まる行：鉄筋 kg→m（全径）・m、箱/束（マスタの入数・伝票の入数）、単位一致、未対応
+BASELINE_ROWS = _rows(
+    [["rb", "kg", 120.0, d, None] for d in REBAR_KG_PER_M]
+    + [
+        ["rb", "m", 95.0, "D13", None],
+        ["rb", "本", 400.0, "D13", None],           # 未対応
+        ["rb", "kg", 120.0, "", None],              # 径なし → 未対応
+        ["rb", "kg", 120.0, "D99", None],           # 径が表に無い → 未対応
+        ["screw_box", "箱", 1500.0, "", None],      # マスタの入数 50
+        ["screw_box", "束", 1500.0, "", 100],       # マスタの入数が伝票の入数より優先
+        ["screw", "箱", 2400.0, "", 100],           # 伝票の入数
+        ["screw", "束", 330.0, "", 20],
+        ["screw", "箱", 2400.0, "", None],          # 入数なし → 未対応
+        ["screw", "束", 330.0, "", 0],              # 入数 0 → 未対応
+        ["screw", "本", 18.0, "", None],
+        ["block", "個", 210.0, "", None],
+        ["block", "本", 210.0, "", None],           # 未対応
+        ["wire", "kg", 380.0, "", None],
+        ["wire", "t", 380000.0, "", None],          # 辺が無ければ未対応
+        ["panel_box", "箱", 9000.0, "", None],      # 本 に按分しても 枚 にならない → 未対応
+        ["panel_box", "枚", 900.0, "", None],
+    ]
+)
+
+
+def test_vectorized_matches_baseline():
+    out = normalize_prices(BASELINE_ROWS, ITEMS, REBAR_KG_PER_M)
+    for k, row in BASELINE_ROWS.iterrows():
+        want, ng = _baseline(row.where(row.notna(), None))
+        got = out.loc[k, "price_per_base"]
+        assert out.loc[k, "detail"].startswith("未対応") == ng, (k, row.tolist(), out.loc[k, "detail"])
+        if ng:
+            assert np.isnan(got), (k, row.tolist())
+        else:
+            assert got == pytest.approx(round(want, 1), abs=1e-9), (k, row.tolist())
+
+
+def test_rowwise_matches_baseline():
+    for k, row in BASELINE_ROWS.iterrows():
+        row = row.where(row.notna(), None)
+        want, ng = _baseline(row)
+        got, note = normalize_price(row, ITEMS_D, REBAR_KG_PER_M)
+        assert note.startswith("未対応") == ng, (k, row.tolist(), note)
+        if ng:
+            assert np.isnan(got)
+        else:
+            assert got == pytest.approx(want), (k, row.tolist())
+
+
+def test_unknown_item():
+    out = normalize_prices(_rows([["nope", "kg", 100.0, "", None]]), ITEMS, REBAR_KG_PER_M)
+    assert np.isnan(out.loc[0, "price_per_base"])
+    assert out.loc[0, "detail"] == "未登録商品"
+
+
+def test_ton_and_reverse_rebar_conversions():
+    # 元の規則には無い換算：t↔kg（全商品の辺）と、kg 基準の鉄筋の m 単価（径の kg/m で割る）
+    edges = pd.DataFrame([["all", "", "", "t", 1000.0, "kg", ""]], columns=UNIT_EDGE_COLUMNS)
+    graph = UnitGraph(edges, REBAR_KG_PER_M)
+    rows = _rows([
+        ["wire", "t", 380000.0, "", None],      # 380 円/kg
+        ["rb", "t", 120000.0, "D13", None],     # 120 円/kg × 0.995 kg/m
+        ["rb_kg", "m", 100.0, "D10", None],     # 100 円/m ÷ 0.617 kg/m
+        ["rb_kg", "t", 120000.0, "", None],     # 120 円/kg
+        ["block", "t", 1000.0, "", None],       # 個 には届かない → 未対応
+    ])
+    out = normalize_prices(rows, ITEMS, graph)
+    want = [380.0, round(120.0 * REBAR_KG_PER_M["D13"], 1), round(100.0 / REBAR_KG_PER_M["D10"], 1), 120.0]
+    assert out["price_per_base"].iloc[:4].tolist() == pytest.approx(want)
+    assert np.isnan(out.loc[4, "price_per_base"])
+    assert out.loc[4, "detail"] == "未対応(t→個)"
+    for k, row in rows.iloc[:4].iterrows():
+        got, _ = normalize_price(row.where(row.notna(), None), ITEMS_D, graph)
+        assert round(got, 1) == pytest.approx(want[k])
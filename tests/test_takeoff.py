@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+拾い計算エンジン（k_takeoff）の回帰テスト。
+- 正解は最初の画面（k_app3）の各フォームにあったスカラーの式をそのまま写した _base_*（以後は直さない）。
+  鉄筋スラブ・ブロック積・土間スラブ・立上り梁の数量と、見積に入れる商品（*_lines）を固定する。
+- 同じ入力を1件ずつ（スカラー）と全件まとめて（配列）の両方で渡し、どちらも一致させる。
+- 定尺本数（元の bars_stock）は切断計画へ移したので、ここでは比べない。
+"""
+import math
+
+import numpy as np
+import pytest
+
+import k_takeoff as takeoff
+
+D13_KGPM = 0.995
+
+
+# -------------------------------------
+# 元の式（k_app3 のフォームから写したもの）
+# -------------------------------------
+def _base_rebar_mesh(L, W, cover_edge_mm, pitch_x_mm, pitch_y_mm, layers, waste, kgpm,
+                     tie_kg_per_sqm, sykoro_per_sqm_layer, mesh_lap_x, mesh_lap_y):
+    cov = cover_edge_mm / 1000.0
+    L_eff, W_eff = max(0.0, L - 2*cov), max(0.0, W - 2*cov)
+    A_eff = L_eff * W_eff
+    px, py = pitch_x_mm/1000.0, pitch_y_mm/1000.0
+    n_x = int(math.floor(W_eff / px)) + 1
+    n_y = int(math.floor(L_eff / py)) + 1
+    total_m = (n_x * L_eff + n_y * W_eff) * layers
+    total_m *= (1.0 + waste/100.0)
+    total_kg = total_m * kgpm
+    tie_kg = A_eff * tie_kg_per_sqm * layers
+    sykoro_pcs = math.ceil(A_eff * sykoro_per_sqm_layer * layers)
+
+    mesh_w, mesh_h = 1.8, 0.9
+
+    def needed_sheets(target, sheet, lap):
+        if target <= 0: return 0
+        if target <= sheet: return 1
+        step = max(sheet - lap, 0.01)
+        return 1 + int(math.ceil((target - sheet)/step))
+    nxA = needed_sheets(L_eff, mesh_w, mesh_lap_x)
+    nyA = needed_sheets(W_eff, mesh_h, mesh_lap_y)
+    nxB = needed_sheets(L_eff, mesh_h, mesh_lap_x)
+    nyB = needed_sheets(W_eff, mesh_w, mesh_lap_y)
+    mesh_sheets = min(nxA*nyA, nxB*nyB) * layers
+    return {"total_m": total_m, "total_kg": total_kg, "tie_kg": tie_kg, "sykoro_pcs": sykoro_pcs,
+            "mesh_sheets": mesh_sheets}
+
+
+def _base_block_found(L, H, corners, halfs, joint_mm, loss_pct, block_len_mm, cement_per_block,
+                      sand_per_cement, gravel_per_cement, use_hbar, hbar_pitch_course, use_vbar, vbar_pitch_m):
+    pitch_m = (block_len_mm + joint_mm) / 1000.0
+    courses = int(max(1, round(H / 0.2)))
+    blocks_per_course = max(1, int(math.ceil(L / pitch_m)))
+    base_blocks = blocks_per_course * courses
+    base_blocks += int(max(0, corners))
+    half_blocks = int(max(0, halfs))
+    total_blocks = math.ceil(base_blocks * (1.0 + loss_pct/100.0))
+    cement_bags = total_blocks * cement_per_block
+    sand_bags = cement_bags * sand_per_cement
+    gravel_bags = cement_bags * gravel_per_cement
+    hbars = 0
+    vbars = 0
+    if use_hbar:
+        used_courses = math.ceil(courses / max(1, hbar_pitch_course))
+        bars_per_course = math.ceil(L / 4.0)
+        hbars = used_courses * bars_per_course
+    if use_vbar and vbar_pitch_m > 0:
+        pos = math.ceil(L / vbar_pitch_m) + 1
+        total_len_v = pos * H
+        vbars = math.ceil(total_len_v / 4.0)
+    return {"courses": courses, "total_blocks": total_blocks, "half_blocks": half_blocks,
+            "cement_bags": cement_bags, "sand_bags": sand_bags, "gravel_bags": gravel_bags,
+            "hbars": hbars, "vbars": vbars}
+
+
+def _base_block_items(r, corners, use_hbar, use_vbar, block_item):
+    item_corner = {"block_B10_basic": "block_B10_corner", "block_C12_basic": "block_C12_corner"}.get(block_item)
+    item_half = {"block_C12_basic": "block_C12_half"}.get(block_item)
+    new_items = {block_item: float(r["total_blocks"])}
+    if item_corner and corners > 0:
+        new_items[item_corner] = float(corners)
+    if item_half and r["half_blocks"] > 0:
+        new_items[item_half] = float(r["half_blocks"])
+    if r["cement_bags"] > 0: new_items["bag_cement"] = float(r["cement_bags"])
+    if r["sand_bags"] > 0: new_items["bag_sand"] = float(r["sand_bags"])
+    if r["gravel_bags"] > 0: new_items["bag_gravel"] = float(r["gravel_bags"])
+    if (use_hbar and r["hbars"] > 0) or (use_vbar and r["vbars"] > 0):
+        new_items["rebar_bar10_4m"] = float(r["hbars"] + r["vbars"])
+    return new_items
+
+
+def _base_slab(L, W, t_mm, conc_waste, cover_mm, pitch_mm, layer_n, kgpm, tie_kg_per_sqm, chair_per_sqm,
+               subbase_t_mm, side_mul, screws_per_sheet, form_waste, sanki_override):
+    A, P = L * W, 2*(L+W)
+    slab_m3 = A * (t_mm/1000.0) * (1.0 + conc_waste/100.0)
+    cov = cover_mm/1000.0
+    L_eff, W_eff = max(0.0, L-2*cov), max(0.0, W-2*cov)
+    px = py = pitch_mm/1000.0
+    n_x = int(math.floor(W_eff/px)) + 1 if px > 0 else 0
+    n_y = int(math.floor(L_eff/py)) + 1 if py > 0 else 0
+    total_m_slab = (n_x*L_eff + n_y*W_eff) * layer_n
+    total_m_slab *= 1.0
+    slab_kg = total_m_slab * kgpm
+    tie_kg = A * tie_kg_per_sqm * layer_n
+    chairs = math.ceil(A * chair_per_sqm * layer_n)
+    agg_m3 = A * (subbase_t_mm/1000.0) if subbase_t_mm > 0 else 0.0
+    avail = [200, 300, 450, 600, 900]
+    H_use = next((x for x in avail if x >= t_mm), avail[-1])
+    sheet_len = 1.82
+    sheet_h_m = H_use/1000.0
+    area_per_sheet = sheet_len * sheet_h_m
+    gross_area = P * sheet_h_m * side_mul * (1.0 + form_waste/100.0)
+    sheets = math.ceil(gross_area / area_per_sheet)
+    screws = sheets * screws_per_sheet
+    pitch = 0.45
+    cols = math.ceil(P / pitch) + 1
+    rows = max(1, math.ceil((H_use/1000.0) / pitch))
+    positions = math.ceil(cols * rows * (1.0 + form_waste/100.0))
+    sanki_m = positions * (2.0 if (sanki_override or side_mul == 2) else 1.0)
+    return {"slab_m3": slab_m3, "total_m": total_m_slab, "slab_kg": slab_kg, "tie_kg": tie_kg, "chairs": chairs,
+            "agg_m3": agg_m3, "H_use": H_use, "sheets": sheets, "screws": screws, "sanki_m": sanki_m}
+
+
+def _base_beam(beam_len, b, h, conc_waste_b, rebar_coef, tie_coef, screws_per_sheet_b, form_waste_b, sanki_both_b):
+    beam_m3 = beam_len * (b/1000.0) * (h/1000.0) * (1.0 + conc_waste_b/100.0)
+    rebar_kg = beam_m3 * rebar_coef
+    tie_kg = beam_m3 * tie_coef
+    avail = [200, 300, 450, 600, 900]
+    H_use = next((x for x in avail if x >= h), avail[-1])
+    sheet_len = 1.82
+    sheet_h_m = H_use/1000.0
+    area_per_sheet = sheet_len * sheet_h_m
+    gross_area = beam_len * sheet_h_m * 2 * (1.0 + form_waste_b/100.0)
+    sheets = math.ceil(gross_area / area_per_sheet)
+    screws = sheets * screws_per_sheet_b
+    pitch = 0.45
+    cols = math.ceil(beam_len / pitch) + 1
+    rows = max(1, math.ceil((H_use/1000.0) / pitch))
+    positions = math.ceil(cols * rows * (1.0 + form_waste_b/100.0))
+    return {"beam_m3": beam_m3, "rebar_kg": rebar_kg, "tie_kg": tie_kg, "H_use": H_use, "sheets": sheets,
+            "screws": screws, "sepa_qty": positions, "pcon_qty": positions * 2,
+            "sanki_m": positions * (2.0 if sanki_both_b else 1.0)}
+
+
+# -------------------------------------
+# 入力（画面の既定値・境界・ばらつき）
+# -------------------------------------
+REBAR_MESH_CASES = [
+    (12.29, 5.98, 40.0, 200.0, 200.0, 1, 5.0, 0.617, 0.4, 4.0, 0.15, 0.15),   # 画面の既定値
+    (10.0, 8.0, 60.0, 150.0, 250.0, 2, 0.0, 0.995, 0.5, 4.0, 0.15, 0.1),
+    (1.7, 0.85, 20.0, 100.0, 100.0, 1, 3.0, 0.617, 0.4, 3.0, 0.3, 0.3),       # メッシュ1枚に収まる
+    (30.5, 18.2, 75.0, 300.0, 200.0, 2, 10.0, 1.56, 0.3, 5.0, 0.9, 0.95),     # 重ねがシートより大きい
+    (0.06, 5.0, 40.0, 200.0, 200.0, 1, 5.0, 0.617, 0.4, 4.0, 0.2, 0.2),       # かぶりで有効幅 0
+]
+BLOCK_CASES = [
+    (10.0, 0.8, 0, 0, 10.0, 3.0, 390.0, 0.05, 4.0, 0.0, True, 1, False, 1.2),  # 画面の既定値（延長 10m）
+    (10.0, 1.0, 2, 4, 10.0, 3.0, 390.0, 0.04, 3.0, 0.0, True, 2, True, 0.8),
+    (7.35, 0.6, 0, 0, 10.0, 0.0, 390.0, 0.05, 2.5, 1.0, False, 1, False, 0.8),
+    (0.3, 0.05, -1, -2, 5.0, 5.0, 440.0, 0.04, 3.0, 0.5, True, 0, True, 0.0),  # 段数・隅・半の下限
+    (25.0, 1.6, 4, 10, 10.0, 2.5, 390.0, 0.04, 3.0, 0.0, True, 3, True, 0.4),
+]
+BLOCK_ITEMS = ["block_C12_basic", "block_B10_basic", "block_other"]
+SLAB_CASES = [
+    (12.29, 5.98, 100.0, 5.0, 40.0, 200.0, 1, 0.617, 0.4, 4.0, 100.0, 1, 30, 8.0, False),  # 画面の既定値
+    (8.0, 6.0, 150.0, 3.0, 60.0, 150.0, 2, 0.995, 0.5, 5.0, 0.0, 2, 15, 0.0, False),
+    (5.5, 4.0, 950.0, 0.0, 50.0, 0.0, 1, 1.56, 0.4, 4.0, 100.0, 1, 20, 10.0, True),      # ピッチ 0・最大高さ超え
+    (20.0, 0.05, 300.0, 5.0, 40.0, 250.0, 2, 0.617, 0.3, 3.0, 80.0, 1, 18, 2.0, False),  # かぶりで有効幅 0
+]
+BEAM_CASES = [
+    (36.54, 150.0, 450.0, 5.0, 110.0, 2.0, 30, 8.0, True),     # 画面の既定値（全周 12.29×5.98）
+    (12.0, 120.0, 300.0, 0.0, 110.0, 1.0, 16, 0.0, False),
+    (0.3, 150.0, 1000.0, 3.0, 90.0, 0.5, 20, 10.0, True),      # 高さが最大の型枠を超える
+]
+
+
+def _check(got, want, k=None):
+    for key, v in want.items():
+        g = got[key] if k is None else got[key][k]
+        assert float(g) == pytest.approx(v, rel=1e-12, abs=1e-12), (key, k)
+
+
+def _columns(cases):
+    return [np.array(c) for c in zip(*cases)]
+
+
+def _as_dict(lines, k=None):
+    return takeoff.lines_dict([(iid if np.ndim(iid) == 0 else iid[k], q if k is None else np.asarray(q)[k])
+                               for iid, q in lines])
+
+
+def test_rebar_mesh_matches_baseline():
+    for args in REBAR_MESH_CASES:
+        _check(takeoff.rebar_mesh(*args), _base_rebar_mesh(*args))
+    r = takeoff.rebar_mesh(*_columns(REBAR_MESH_CASES))
+    for k, args in enumerate(REBAR_MESH_CASES):
+        _check(r, _base_rebar_mesh(*args), k)
+        base = _base_rebar_mesh(*args)
+        assert _as_dict(takeoff.mesh_lines(r), k) == takeoff.lines_dict(
+            [("cdmesh_6_150", base["mesh_sheets"]), ("tie_wire_band5_350", base["tie_kg"]),
+             ("conc_sykoro_4x5x6", base["sykoro_pcs"])])
+
+
+@pytest.mark.parametrize("block_item", BLOCK_ITEMS)
+def test_block_found_matches_baseline(block_item):
+    r = takeoff.block_found(*_columns(BLOCK_CASES))
+    for k, args in enumerate(BLOCK_CASES):
+        want = _base_block_found(*args)
+        _check(takeoff.block_found(*args), want)
+        _check(r, want, k)
+        corners, use_hbar, use_vbar = args[2], args[10], args[12]
+        got = _as_dict(takeoff.block_lines(r, np.array([block_item] * len(BLOCK_CASES), dtype=object)), k)
+        assert got == pytest.approx(_base_block_items(want, corners, use_hbar, use_vbar, block_item))
+
+
+def test_slab_matches_baseline():
+    r = takeoff.slab(*_columns(SLAB_CASES))
+    for k, args in enumerate(SLAB_CASES):
+        want = _base_slab(*args)
+        _check(takeoff.slab(*args), want)
+        _check(r, want, k)
+        got = _as_dict(takeoff.slab_lines(r, "rmx", "agg", "rebar_D10_NA"), k)
+        assert got == pytest.approx(takeoff.lines_dict([
+            ("rmx", want["slab_m3"]), ("agg", want["agg_m3"]), ("rebar_D10_NA", want["total_m"]),
+            ("tie_wire_band5_350", want["tie_kg"]), ("conc_sykoro_4x5x6", want["chairs"]),
+            ("conpa_screw_35", want["screws"])]))
+
+
+def test_beam_matches_baseline():
+    r = takeoff.beam(*_columns(BEAM_CASES))
+    for k, args in enumerate(BEAM_CASES):
+        want = _base_beam(*args)
+        _check(takeoff.beam(*args), want)
+        _check(r, want, k)
+        got = _as_dict(takeoff.beam_lines(r, "rmx", D13_KGPM), k)
+        assert got == pytest.approx(takeoff.lines_dict([
+            ("rmx", want["beam_m3"]), ("rebar_D13_SD295A", want["rebar_kg"] / D13_KGPM),
+            ("tie_wire_band5_350", want["tie_kg"]), ("conpa_screw_35", want["screws"])]))
+
+
+def test_beam_length_modes():
+    L, W = 12.29, 5.98
+    want = [2*(L+W), L + 2*W, 2*L + W, 7.5]
+    got = takeoff.beam_length(L, W, np.array(takeoff.BEAM_MODES), 7.5)
+    assert got.tolist() == pytest.approx(want)